@@ -1,24 +1,67 @@
 #!/usr/bin/env python3
 from services.firebase import get_all_rows
-from services.get_context import build_context
-from flask import Flask, Response, stream_with_context, jsonify, request
+from services.get_context import build_context, iter_context
+from services.summary_cache import shared_summary_cache
+from flask import Flask, Response, send_file, stream_with_context, jsonify, request
 from services.drive import GoogleDrive
-from storage.cloud import CloudStorage
+from services.drive_sync import DriveSync
+from storage.cloud import CloudStorage, add_listener
+from storage.index import ListingIndex
+from storage import preview
+from storage.disk_cache import iter_file_range, shared_disk_cache
+from storage.pipe import MigrationPipeline
 from services.recorder import record_seconds, status
 from services.canvas_extract import extract_and_upload
+from services.jobs import ACTIVE, JobManager
+from services.search_index import SearchIndex, SearchIndexer
+from services.retrieval import retrieve_context
+from services.pdf_text import shared_extractor
 import firebase_admin
 from firebase_admin import credentials, firestore
+import json
+import mimetypes
 import os
+import time
+from storage.state import state_path
 
 app = Flask(__name__)
-drive = GoogleDrive("")
-cloud = CloudStorage()
+authenticated = False
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "service-account.json"))
-    firebase_admin.initialize_app(cred)
 
-db = firestore.client()
+def _start():
+    """
+    builds the services the routes use. skipped when this module is re-imported as
+    __mp_main__ by a spawned worker process (pdf text extraction), which only needs
+    the parsers, not another set of listeners, reconcilers and firebase clients.
+    """
+    global drive, cloud, disk_cache, jobs, listing_index, search, db
+    drive = GoogleDrive("")
+    cloud = CloudStorage()
+    disk_cache = shared_disk_cache()
+    # long operations (migration, canvas extraction, context builds, recordings) run here
+    jobs = JobManager()
+
+    # answers /vault/list from memory; kept fresh by CloudStorage events plus a periodic full listing
+    listing_index = ListingIndex(state_path("listing_index.json"))
+    listing_index.load_snapshot()
+    add_listener(listing_index.on_change)
+    listing_index.start_reconciler(cloud, interval=int(os.getenv("KB_INDEX_RECONCILE_SECONDS", "300")))
+
+    # full-text index of vault pdfs, fed by the same change events; pdfs it hasn't seen are queued at startup
+    search = SearchIndexer(SearchIndex(), cloud)
+    add_listener(search.on_change)
+    if listing_index.ready and os.getenv("KB_SEARCH_BACKFILL", "1") == "1":
+        search.backfill(listing_index.names())
+
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "service-account.json"))
+        firebase_admin.initialize_app(cred)
+
+    db = firestore.client()
+
+if __name__ != "__mp_main__":
+    _start()
+
 COL = "companies"
 
 @app.get("/status")
@@ -43,8 +86,7 @@ def record():
         bucket = data.get("bucket", os.getenv("KB_BUCKET", "kb"))
         gcs_prefix = data.get("gcs_prefix", "screen_recordings/")
 
-        res = record_seconds(
-            int(seconds),
+        kwargs = dict(
             bucket=bucket,
             gcs_prefix=gcs_prefix,
             fps=fps,
@@ -53,6 +95,12 @@ def record():
             crf=crf,
             preset=preset,
         )
+        if data.get("async"):
+            job = jobs.submit("record", lambda job: record_seconds(int(seconds), **kwargs),
+                              params={"seconds": int(seconds), **kwargs})
+            return _accepted(job)
+
+        res = record_seconds(int(seconds), **kwargs)
         code = 200 if res.get("ok") else 500
         print(res)
         return jsonify(res), code
@@ -74,9 +122,22 @@ def canvas_extract():
 
     bucket = data.get("bucket") or os.getenv("KB_BUCKET", "kb")
     prefix = data.get("prefix") or "course_data/"
+    incremental = bool(data.get("incremental"))
+
+    if data.get("async"):
+        # never persist the access token with the job
+        job = jobs.submit(
+            "canvas_extract",
+            lambda job: extract_and_upload(base_url, access_token, bucket=bucket, prefix=prefix,
+                                           cancel=job.cancel_event, progress=job.update,
+                                           incremental=incremental, cloud=cloud),
+            params={"baseUrl": base_url, "bucket": bucket, "prefix": prefix, "incremental": incremental},
+        )
+        return _accepted(job)
 
     try:
-        out = extract_and_upload(base_url, access_token, bucket=bucket, prefix=prefix)
+        out = extract_and_upload(base_url, access_token, bucket=bucket, prefix=prefix, incremental=incremental,
+                                 cloud=cloud)
         return jsonify(out), 200
     except PermissionError as e:
         return jsonify(ok=False, error=str(e)), 401
@@ -100,26 +161,88 @@ def drive_status():
 
 @app.post("/migrate_files")
 def migrate_files():
-    global authenticated, migration_triggered
+    """
+    run a drive migration as a background job. {"async": true} returns the job id
+    right away; otherwise the request waits for the job and returns its result.
+    """
     if not authenticated:
         return jsonify({"error": "Not authenticated"}), 403
-    try:
-        migration_triggered = True  # mark migration started
-        files = drive.get_all_files_with_paths()
-        cloud.migrate_files(files)
-        return jsonify({"count": len(files)}), 200
-    except Exception as e:
-        migration_triggered = False
-        return jsonify({"success": False, "error": str(e)}), 500
+    data = request.get_json(force=True, silent=True) or {}
+    pipeline_kwargs = {k: int(data[k]) for k in ("download_workers", "upload_workers") if data.get(k)}
+    incremental, full = bool(data.get("incremental")), bool(data.get("full"))
+
+    def run(job):
+        if incremental:
+            # only transfer what changed since the last sync (first run does a full walk)
+            return DriveSync(drive, cloud, **pipeline_kwargs).run(full=full, cancel=job.cancel_event, progress=job.update)
+        pipeline = MigrationPipeline(drive, cloud, **pipeline_kwargs)
+        return pipeline.run(drive.iter_files_with_paths(), cancel=job.cancel_event, progress=job.update)
+
+    job, started = jobs.submit_if_idle("migration", run, params={"incremental": incremental, "full": full, **pipeline_kwargs})
+    if not started:
+        return jsonify({"success": False, "error": "migration already running", "job_id": job.id}), 409
+    if data.get("async"):
+        return _accepted(job)
+    job.wait()
+    if job.status == "failed":
+        return jsonify({"success": False, "error": job.error, "job_id": job.id}), 500
+    return jsonify(job.result), 200
 
 @app.get("/migration_status")
 def migration_status():
+    job = jobs.latest("migration")
     return jsonify({
         "authenticated": authenticated,
-        "migration_triggered": migration_triggered
+        "migration_triggered": bool(job and job.status in ("queued", "running", "succeeded")),
+        "job": job.to_dict() if job else None,
     }), 200
 
+def _accepted(job):
+    return jsonify(ok=True, job_id=job.id, status=job.status, status_url=f"/jobs/{job.id}"), 202
+
+@app.get("/jobs")
+def list_jobs():
+    return jsonify(ok=True, jobs=[j.to_dict() for j in jobs.list(request.args.get("kind"))]), 200
 
+@app.get("/jobs/<job_id>")
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify(ok=False, error="no such job"), 404
+    return jsonify(ok=True, job=job.to_dict()), 200
+
+@app.get("/jobs/<job_id>/result")
+def get_job_result(job_id):
+    """200 with the result once succeeded, 202 while queued/running, 409 otherwise"""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify(ok=False, error="no such job"), 404
+    if job.status in ACTIVE:
+        return jsonify(ok=True, job=job.to_dict()), 202
+    if job.status != "succeeded":
+        return jsonify(ok=False, job=job.to_dict(), error=job.error or job.status), 409
+    return jsonify(ok=True, job=job.to_dict(), result=job.result), 200
+
+@app.post("/jobs/<job_id>/cancel")
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if not job:
+        return jsonify(ok=False, error="no such job"), 404
+    return jsonify(ok=True, job=job.to_dict()), 200
+
+
+
+def _list_directory(path=""):
+    """listing from the in-memory index once it has loaded, gcs otherwise"""
+    if listing_index.ready:
+        return listing_index.listing(path)
+    return cloud.list_files_in_directory(path)
+
+def _child_count(prefix):
+    if listing_index.ready:
+        return listing_index.child_count(prefix)
+    child_listing = cloud.list_files_in_directory(prefix)
+    return len(child_listing.get("files", [])) + len(child_listing.get("folders", []))
 
 @app.post('/vault/directory')
 def get_pwd():
@@ -127,7 +250,7 @@ def get_pwd():
     Return folders and files in the present working directory
     """
     try:
-        file_folder_dict = cloud.list_files_in_directory()
+        file_folder_dict = _list_directory()
         return jsonify(file_folder_dict), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -144,15 +267,14 @@ def vault_list():
         if path and not path.endswith("/"):
             path += "/"
 
-        listing = cloud.list_files_in_directory(path)  # {"files":[...], "folders":[...]}
+        listing = _list_directory(path)  # {"files":[...], "folders":[...]}
 
         # build folder objects with counts of direct children
         folders = []
         for raw in listing.get("folders", []):
             name = raw.rstrip("/").split("/")[-1]
             child_prefix = f"{path}{raw.rstrip('/')}/"
-            child_listing = cloud.list_files_in_directory(child_prefix)
-            count = len(child_listing.get("files", [])) + len(child_listing.get("folders", []))
+            count = _child_count(child_prefix)
             folders.append({"name": name, "path": child_prefix, "count": count})
 
         files = [{"name": f.split("/")[-1], "path": f"{path}{f}"} for f in listing.get("files", [])]
@@ -161,25 +283,196 @@ def vault_list():
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
+def _vault_paths(values):
+    return [(v or "").lstrip("/") for v in values or [] if v]
+
+def _vault_pairs(items):
+    return [(it["source"].lstrip("/"), it["destination"].lstrip("/"))
+            for it in items or [] if it.get("source") and it.get("destination")]
+
+def _bulk(kind, fn, data, params):
+    """
+    run a bulk vault operation: inline by default, as a background job with {"async": true}.
+    `fn()` returns per-item results; the response carries them plus a failure count.
+    """
+    def summarize(results):
+        failed = sum(1 for r in results if not r["ok"])
+        return {"ok": failed == 0, "count": len(results), "failed": failed, "results": results}
+
+    if data.get("async"):
+        return _accepted(jobs.submit(kind, lambda job: summarize(fn()), params=params))
+    try:
+        out = summarize(fn())
+        return jsonify(out), 200 if out["ok"] else 207
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+@app.post("/vault/delete")
+def vault_delete():
+    """{"paths": [...]} -> delete every object in gcs batch requests"""
+    data = request.get_json(force=True, silent=True) or {}
+    paths = _vault_paths(data.get("paths"))
+    if not paths:
+        return jsonify({"ok": False, "error": "paths is required"}), 400
+    return _bulk("vault_delete", lambda: cloud.delete_files(paths), data, {"count": len(paths)})
+
+@app.post("/vault/copy")
+def vault_copy():
+    """{"items": [{"source", "destination"}, ...]} -> server-side copies"""
+    data = request.get_json(force=True, silent=True) or {}
+    pairs = _vault_pairs(data.get("items"))
+    if not pairs:
+        return jsonify({"ok": False, "error": "items with source and destination are required"}), 400
+    return _bulk("vault_copy", lambda: cloud.copy_files(pairs), data, {"count": len(pairs)})
+
+@app.post("/vault/move")
+def vault_move():
+    """{"items": [{"source", "destination"}, ...]} -> copy then delete each source"""
+    data = request.get_json(force=True, silent=True) or {}
+    pairs = _vault_pairs(data.get("items"))
+    if not pairs:
+        return jsonify({"ok": False, "error": "items with source and destination are required"}), 400
+    return _bulk("vault_move", lambda: cloud.move_files(pairs), data, {"count": len(pairs)})
+
+@app.post("/vault/move_folder")
+def vault_move_folder():
+    """{"source": "a/", "destination": "b/"} -> move everything under a/ to b/"""
+    data = request.get_json(force=True, silent=True) or {}
+    source = (data.get("source") or "").lstrip("/")
+    destination = (data.get("destination") or "").lstrip("/")
+    if not source or not destination:
+        return jsonify({"ok": False, "error": "source and destination are required"}), 400
+    return _bulk("vault_move_folder", lambda: cloud.move_folder(source, destination), data,
+                 {"source": source, "destination": destination})
+
+@app.post("/vault/delete_folder")
+def vault_delete_folder():
+    """{"path": "a/"} -> delete everything under a/ (never the whole bucket)"""
+    data = request.get_json(force=True, silent=True) or {}
+    path = (data.get("path") or "").lstrip("/")
+    if not path.strip("/"):
+        return jsonify({"ok": False, "error": "path is required"}), 400
+    return _bulk("vault_delete_folder", lambda: cloud.delete_folder(path), data, {"path": path})
+
+@app.get("/vault/search")
+def vault_search():
+    """
+    ranked full-text search: ?q=words (all must match; "any=1" for any; "word*" = prefix)
+    &prefix=folder/ &limit=20 &offset=0 -> hits {path, score, snippet}, best first
+    """
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "q is required"}), 400
+    prefix = (request.args.get("prefix") or "").lstrip("/")
+    try:
+        limit = max(1, min(100, int(request.args.get("limit", 20))))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify({"ok": False, "error": "limit and offset must be integers"}), 400
+    started = time.perf_counter()
+    try:
+        hits = search.index.search(q, prefix=prefix, limit=limit, offset=offset,
+                                   any_term=request.args.get("any") in ("1", "true"))
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, "q": q, "prefix": prefix, "results": hits,
+                    "took_ms": round((time.perf_counter() - started) * 1000, 2)}), 200
+
+@app.post("/vault/search/reindex")
+def vault_search_reindex():
+    """{"prefix": "", "force": false} -> queue pdfs under prefix that aren't indexed (all of them with force)"""
+    data = request.get_json(force=True, silent=True) or {}
+    prefix = (data.get("prefix") or "").lstrip("/")
+    names = listing_index.names() if listing_index.ready else cloud.list_prefix(prefix)
+    queued = search.backfill((n for n in names if n.startswith(prefix)), force=bool(data.get("force")))
+    return jsonify({"ok": True, "queued": queued, "index": search.stats()}), 202
+
+def _preview_cache_headers(resp, etag, modified):
+    resp.headers["ETag"] = etag
+    if modified:
+        resp.headers["Last-Modified"] = preview.http_date(modified)
+    resp.headers["Cache-Control"] = preview.cache_control()
+
 @app.get("/vault/preview")
 def vault_preview():
+    """
+    stream an object inline. honours Range/If-Range (single and multi-range) with
+    ranged gcs reads, so seeking a video or paging a pdf only pulls the bytes asked for;
+    the whole object is cached in the background only if it is small or keeps being
+    read (see DiskCache.ranged_miss).
+    ETag/Last-Modified come from the cached gcs metadata; a matching
+    If-None-Match/If-Modified-Since gets a bodyless 304.
+    """
     path = (request.args.get("path") or "").lstrip("/")
     if not path:
         return jsonify({"ok": False, "error": "path is required"}), 400
     try:
-        fh, mime, filename = cloud.open_stream(path)
+        meta = cloud.stat(path)
+        size = meta["size"] or 0
+        mime = meta["content_type"] or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        filename = os.path.basename(path)
+        etag = preview.etag_for(meta)
+        modified = preview.last_modified(meta)
+
+        if preview.not_modified(request.headers.get("If-None-Match"), request.headers.get("If-Modified-Since"), etag, modified):
+            resp = Response(status=304)
+            _preview_cache_headers(resp, etag, modified)
+            return resp
+
+        ranges = None
+        if request.headers.get("Range") and preview.if_range_matches(request.headers.get("If-Range"), etag, modified):
+            try:
+                ranges = preview.parse_range(request.headers["Range"], size)
+            except preview.RangeNotSatisfiable:
+                resp = Response(status=416)
+                resp.headers["Content-Range"] = f"bytes */{size}"
+                return resp
+
+        # hot objects are served from the local content cache instead of gcs;
+        # a dedup alias reads (and caches) its canonical object. the cache hands back an
+        # open handle, so eviction can't pull the file out from under this response
+        source, generation = meta["path"], meta["generation"]
+        local = disk_cache.open(source, generation)
+        handed_off = False  # once the response owns the handle it closes it
+        try:
+            def read_range(start, end):
+                if local:
+                    return iter_file_range(local, start, end)
+                return cloud.iter_range(source, start, end, generation=generation)
 
-        def generate(chunk=1024 * 512):
-            with fh:
-                while True:
-                    data = fh.read(chunk)
-                    if not data:
-                        break
-                    yield data
+            if not ranges and local:
+                # file_wrapper lets the wsgi server use sendfile; it closes the handle when done
+                resp = send_file(local, mimetype=mime, etag=False, conditional=False)
+                resp.content_length = size
+                handed_off = True
+            elif not ranges:
+                body = disk_cache.tee(read_range(0, size - 1), source, generation, size)
+                resp = Response(stream_with_context(body), mimetype=mime)
+                resp.content_length = size
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                resp = Response(stream_with_context(read_range(start, end)), status=206, mimetype=mime)
+                resp.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+                resp.content_length = end - start + 1
+            else:
+                boundary, length, body = preview.multipart_byteranges(ranges, size, mime, read_range)
+                resp = Response(stream_with_context(body), status=206,
+                                content_type=f"multipart/byteranges; boundary={boundary}")
+                resp.content_length = length
+            if ranges and not local:
+                disk_cache.ranged_miss(source, generation, size,
+                                       lambda: cloud.iter_range(source, 0, size - 1, generation=generation))
+            elif ranges:
+                resp.call_on_close(local.close)
+                handed_off = True
+        finally:
+            if local and not handed_off:
+                local.close()
 
-        resp = Response(stream_with_context(generate()), mimetype=mime)
         resp.headers["Content-Disposition"] = f'inline; filename="{filename}"'  # <-- no download
-        resp.headers["Cache-Control"] = "no-store"
+        _preview_cache_headers(resp, etag, modified)
         resp.headers["X-Content-Type-Options"] = "nosniff"
         resp.headers["Accept-Ranges"] = "bytes"  # helps video seeking
         return resp
@@ -190,16 +483,94 @@ def vault_preview():
 def context_build():
     """
     summarize all pdfs under an optional prefix (e.g. 'course_data/').
-    returns one big string.
+    returns one big string, or with {"stream": true} one json event per line
+    (server-sent events if the client accepts text/event-stream) as each pdf finishes,
+    or with {"async": true} a job id whose result is the string.
+    the string fits in {"max_tokens"} (default KB_BUILD_CONTEXT_TOKENS); {"focus": "..."}
+    gives documents matching those words a bigger share of it. neither applies to a
+    stream, so combining them with {"stream": true} is a 400.
+    with {"query": "..."} it instead returns only the passages most relevant to the
+    question ({"top_k", "max_tokens"} optional), from a local vector index: no llm calls.
     """
     data = request.get_json(force=True, silent=True) or {}
     prefix = (data.get("prefix") or "").strip()
+    if (data.get("query") or "").strip():
+        return _retrieve(prefix, data)
+    kwargs = {"concurrency": int(data["concurrency"])} if data.get("concurrency") else {}
+    if data.get("stream"):
+        # events go out as each pdf finishes, before the budget could be split across them
+        if data.get("max_tokens") or (data.get("focus") or "").strip():
+            return jsonify(ok=False, error="max_tokens and focus can't be combined with stream"), 400
+        return _stream_context(prefix, kwargs)
+    if data.get("max_tokens"):
+        kwargs["max_tokens"] = int(data["max_tokens"])
+    if (data.get("focus") or "").strip():
+        kwargs["focus"] = data["focus"].strip()
+    if data.get("async"):
+        job = jobs.submit(
+            "context_build",
+            lambda job: build_context(prefix=prefix, cancel=job.cancel_event, progress=job.update, **kwargs),
+            params={"prefix": prefix, **kwargs},
+        )
+        return _accepted(job)
     try:
-        result = build_context(prefix=prefix)
+        result = build_context(prefix=prefix, **kwargs)
         return jsonify(ok=True, context=result), 200
     except Exception as e:
         return jsonify(ok=False, error=f"{e.__class__.__name__}: {e}"), 500
 
+def _retrieve(prefix, data):
+    query = data["query"].strip()
+    kwargs = {k: int(data[k]) for k in ("top_k", "max_tokens") if data.get(k)}
+
+    def run():
+        # text the search index already extracted is reused instead of re-parsing the pdf
+        text_for = lambda path, cid: search.index.text_for_content(cid) if cid else None
+        context, passages = retrieve_context(prefix, query, cloud=cloud, text_for=text_for, **kwargs)
+        return {"context": context, "passages": passages}
+
+    if data.get("async"):
+        job = jobs.submit("context_retrieve", lambda job: run(), params={"prefix": prefix, "query": query, **kwargs})
+        return _accepted(job)
+    try:
+        return jsonify(ok=True, **run()), 200
+    except Exception as e:
+        return jsonify(ok=False, error=f"{e.__class__.__name__}: {e}"), 500
+
+def _stream_context(prefix, kwargs):
+    sse = "text/event-stream" in (request.headers.get("Accept") or "")
+
+    def generate():
+        # flask closes this generator when the client goes away, which closes
+        # iter_context and cancels every document that hasn't started yet
+        events = iter_context(prefix=prefix, **kwargs)
+        try:
+            for event in events:
+                line = json.dumps(event)
+                yield f"event: {event['type']}\ndata: {line}\n\n" if sse else line + "\n"
+        except Exception as e:
+            line = json.dumps({"type": "error", "error": f"{e.__class__.__name__}: {e}"})
+            yield f"event: error\ndata: {line}\n\n" if sse else line + "\n"
+        finally:
+            events.close()
+
+    resp = Response(stream_with_context(generate()),
+                    mimetype="text/event-stream" if sse else "application/x-ndjson")
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"  # don't let a proxy sit on the stream
+    return resp
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    hit/miss counters for the gcs listing/metadata cache and the local content cache,
+    plus dedup savings and pdf text extraction throughput
+    """
+    return jsonify(ok=True, cache=cloud.cache.stats(), disk=disk_cache.stats(),
+                   summaries=shared_summary_cache().stats(), dedup=cloud.dedup.stats(),
+                   checksums=cloud.hashes.stats(), search=search.stats(),
+                   pdf_text=shared_extractor().stats()), 200
+
 @app.get("/companies")
 def list_companies():
     return jsonify(get_all_rows()), 200
@@ -1,25 +1,135 @@
 import requests
 import json
+import random
+import threading
 import time
 from typing import Dict, List, Optional
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread using a client, paced by Canvas's own quota.
+
+    Everything is in Canvas cost units (what X-Request-Cost and X-Rate-Limit-Remaining
+    count): rates are cost units per second and `burst` is a number of cost units. Each
+    request reserves what requests have recently cost, and once Canvas reports the real
+    cost the difference is charged (the bucket may go negative after an expensive call,
+    delaying the next one). Canvas refills its own per-token bucket at about 10 units/s;
+    while plenty of it is left we spend at up to `max_rate`, as it drains the rate falls
+    off towards `min_rate`, and a throttled response drops straight to `min_rate` and
+    empties the bucket.
+    """
+    def __init__(self, rate: float = 10.0, burst: float = 20.0, min_rate: float = 1.0, max_rate: float = 20.0,
+                 comfortable_remaining: float = 300.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.comfortable_remaining = comfortable_remaining
+        self.remaining: Optional[float] = None
+        self.last_cost: Optional[float] = None
+        self.cost = 1.0  # running estimate of what one request costs, in cost units
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Wait until a request's estimated cost is in the bucket; returns the amount reserved"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # never reserve more than a full bucket, or a costly endpoint would wait forever
+                need = min(self.cost, self.burst)
+                if self._tokens >= need:
+                    self._tokens -= need
+                    return need
+                wait = (need - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, headers, reserved: float = 1.0):
+        """Charge the request's reported cost against what `acquire` reserved, and re-tune the pace"""
+        try:
+            cost = float(headers.get('X-Request-Cost'))
+        except (TypeError, ValueError):
+            cost = None
+        try:
+            remaining = float(headers.get('X-Rate-Limit-Remaining'))
+        except (TypeError, ValueError):
+            remaining = None
+        with self._lock:
+            if cost is not None:
+                self.last_cost = cost
+                self._tokens -= cost - reserved
+                self.cost = 0.8 * self.cost + 0.2 * cost
+            if remaining is not None:
+                self.remaining = remaining
+                share = max(0.0, min(1.0, remaining / self.comfortable_remaining))
+                # quadratic falloff: barely slow down until the quota is genuinely low
+                self.rate = self.min_rate + (self.max_rate - self.min_rate) * share * share
+
+    def throttled(self):
+        """Canvas refused a request for rate limiting: back right off"""
+        with self._lock:
+            self.rate = self.min_rate
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'rate': round(self.rate, 2), 'remaining': self.remaining, 'last_cost': self.last_cost,
+                    'cost_estimate': round(self.cost, 3)}
 
 class CanvasClient:
-    def __init__(self, base_url: str, access_token: str):
+    def __init__(self, base_url: str, access_token: str, max_connections: int = 16,
+                 rate_limiter: Optional[RateLimiter] = None, max_attempts: int = 6,
+                 http_cache: Optional[Dict] = None):
         self.base_url = base_url.rstrip('/')
+        self.max_attempts = max_attempts
+        # url -> {etag, last_modified, data, next}; when set, listing pages are fetched
+        # conditionally and a 304 replays the stored page
+        self.http_cache = http_cache
+        self.not_modified = 0
         self.access_token = access_token
+        self.rate_limiter = rate_limiter or RateLimiter()
         self.session = requests.Session()
+        # size the pool for concurrent extraction so threads reuse keep-alive connections
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.session.headers.update({
             'Authorization': f'Bearer {access_token}',
             'Accept': 'application/json+canvas-string-ids'
         })
 
-    def _make_request(self, endpoint: str, params: Dict = None) -> requests.Response:
+    def _is_throttled(self, response: requests.Response) -> bool:
+        # canvas answers "403 Forbidden (Rate Limit Exceeded)"; 429 from proxies in front of it
+        return response.status_code == 429 or (
+            response.status_code == 403 and 'rate limit' in (response.text or '').lower()
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Rate-limited GET on the shared session, retrying throttled responses with jittered backoff"""
+        for attempt in range(self.max_attempts):
+            reserved = self.rate_limiter.acquire()
+            response = self.session.get(url, **kwargs)
+            self.rate_limiter.observe(response.headers, reserved)
+            if not self._is_throttled(response) or attempt == self.max_attempts - 1:
+                return response
+            self.rate_limiter.throttled()
+            response.close()
+            delay = min(30.0, 0.5 * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+        return response
+
+    def _make_request(self, endpoint: str, params: Dict = None, headers: Dict = None) -> requests.Response:
         """Make a request to the Canvas API with basic error handling"""
         url = urljoin(f"{self.base_url}/api/v1/", endpoint.lstrip('/'))
 
         try:
-            response = self.session.get(url, params=params)
+            response = self.get(url, params=params, headers=headers)
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
@@ -31,8 +141,17 @@ class CanvasClient:
         url = endpoint
 
         while url:
-            response = self._make_request(url, params)
-            data = response.json()
+            key = self._cache_key(url, params)
+            cached = self.http_cache.get(key) if self.http_cache is not None else None
+            response = self._make_request(url, params, self._conditional_headers(cached))
+            if response.status_code == 304 and cached:
+                self.not_modified += 1
+                data = cached['data']
+                next_url = cached.get('next')
+            else:
+                data = response.json()
+                next_url = response.links.get('next', {}).get('url')
+                self._remember(key, response, data, next_url)
 
             if isinstance(data, list):
                 all_data.extend(data)
@@ -40,17 +159,37 @@ class CanvasClient:
                 all_data.append(data)
 
             # Check for pagination
-            links = response.links
-            url = links.get('next', {}).get('url')
+            url = next_url
             if url:
                 # Extract just the endpoint part for next request
                 url = url.replace(f"{self.base_url}/api/v1/", "")
-
-            # Simple rate limiting
-            time.sleep(0.1)
+                # the next link already carries the query string
+                params = None
 
         return all_data
 
+    def _cache_key(self, url: str, params: Optional[Dict]) -> str:
+        return url + ('?' + json.dumps(params, sort_keys=True) if params else '')
+
+    def _conditional_headers(self, cached: Optional[Dict]) -> Dict:
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def _remember(self, key: str, response: requests.Response, data, next_url: Optional[str]):
+        """Keep a page for conditional re-fetching if Canvas gave us a validator for it"""
+        if self.http_cache is None:
+            return
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.http_cache[key] = {'etag': etag, 'last_modified': last_modified, 'data': data, 'next': next_url}
+        else:
+            self.http_cache.pop(key, None)
+
     def get_user_profile(self) -> Dict:
         """Get the current user's profile"""
         response = self._make_request('/users/self/profile')
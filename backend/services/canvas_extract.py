@@ -1,10 +1,20 @@
 # services/canvas_extract.py
 from datetime import datetime
-import os, re, tempfile
-from typing import Any, Dict, Iterable, List, Tuple
+import hashlib, io, os, re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from services.canvas_client import CanvasClient
-from services.data_extractor import CanvasDataExtractor
+from services.data_extractor import CanvasDataExtractor, COURSE_ENDPOINTS
+from services.local_storage import LocalStorage
 from storage.cloud import CloudStorage
+from storage.pipe import MigrationPipeline
+from storage.state import state_path
+
+# incremental runs keep their snapshot here, one folder per (canvas instance, token)
+SNAPSHOT_DIR = state_path("canvas")
+HTTP_CACHE_FILE = "http_cache.json"
+UPLOADS_FILE = "uploads.json"
+KEEP_EXTRACTIONS = 3
+TRANSFER_WORKERS = int(os.getenv("KB_CANVAS_TRANSFER_WORKERS", "4"))
 
 PDF_CTS = {
     "application/pdf",
@@ -24,19 +34,59 @@ def _safe_name(s: str) -> str:
     s = (s or "").strip().replace(" ", "_")
     return re.sub(r"[^A-Za-z0-9._-]+", "", s) or "file.pdf"
 
-def _download_pdf(session, url: str) -> str:
-    with session.get(url, stream=True, allow_redirects=True, timeout=60) as r:
-        r.raise_for_status()
-        fd, path = tempfile.mkstemp(prefix="kb_pdf_", suffix=".pdf")
-        with os.fdopen(fd, "wb") as out:
-            for chunk in r.iter_content(1024 * 1024):
+class CanvasFileSource:
+    """
+    canvas pdfs as a `MigrationPipeline` source: each file dict carries its download url,
+    and the body is streamed through the client's rate-limited session
+    """
+    def __init__(self, client: CanvasClient):
+        self.client = client
+
+    def content_type(self, file: Dict[str, Any]) -> str:
+        return file["mimeType"]
+
+    def stream_file(self, file: Dict[str, Any], fd, chunksize: int) -> None:
+        with self.client.get(file["url"], stream=True, allow_redirects=True, timeout=60) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunksize):
                 if chunk:
-                    out.write(chunk)
-        return path
+                    fd.write(chunk)
+
+    def _load_file(self, file: Dict[str, Any]) -> None:
+        """buffered variant for KB_MIGRATE_STREAMING=0"""
+        buf = io.BytesIO()
+        self.stream_file(file, buf, 1024 * 1024)
+        buf.seek(0)
+        file["stream"] = buf
+
+def _snapshot_store(base_url: str, access_token: str) -> LocalStorage:
+    # hash the token so it never lands on disk, but different users get different snapshots
+    owner = hashlib.sha256(f"{base_url.rstrip('/')}|{access_token}".encode()).hexdigest()[:16]
+    return LocalStorage(os.path.join(SNAPSHOT_DIR, owner))
+
+def _file_version(meta: Optional[Dict[str, Any]]) -> Optional[List[Any]]:
+    """what has to change for a canvas file to be downloaded again"""
+    if not meta:
+        return None
+    return [meta.get("updated_at") or meta.get("modified_at"), meta.get("size")]
+
+def _count_changed(previous: Optional[Dict[str, Any]], manifest: Dict[str, Any]) -> int:
+    """course items that are new or whose updated_at moved since the previous manifest"""
+    def stamps(m):
+        out = {}
+        for cid, data in ((m or {}).get("courses_data") or {}).items():
+            for key in COURSE_ENDPOINTS:
+                for item in (data or {}).get(key) or []:
+                    if isinstance(item, dict) and item.get("id") is not None:
+                        out[(str(cid), key, str(item["id"]))] = item.get("updated_at")
+        return out
 
-def _pdf_candidates_from_manifest(manifest: Dict[str, Any], client: CanvasClient) -> Iterable[Tuple[str, str, str]]:
+    before = stamps(previous)
+    return sum(1 for k, v in stamps(manifest).items() if k not in before or before[k] != v)
+
+def _pdf_candidates_from_manifest(manifest: Dict[str, Any], client: CanvasClient) -> Iterable[Tuple[str, str, str, Optional[Dict[str, Any]]]]:
     """
-    yield (course_id, filename, url)
+    yield (course_id, filename, url, file metadata or None)
     priority: per-course files; then generic scan for .pdf links anywhere in course data
     """
     courses = manifest.get("courses_list") or []
@@ -59,7 +109,7 @@ def _pdf_candidates_from_manifest(manifest: Dict[str, Any], client: CanvasClient
                 # canonical fallback
                 url = f"{client.base_url}/api/v1/files/{fid}/?download=1"
             name = _safe_name(f.get("display_name") or f.get("filename") or f"file_{f.get('id','')}.pdf")
-            yield (cid, name, url)
+            yield (cid, name, url, f)
 
     # 2) fallback: scan all course_data objects for .pdf-looking links
     def walk(obj: Any, cid="misc"):
@@ -68,7 +118,7 @@ def _pdf_candidates_from_manifest(manifest: Dict[str, Any], client: CanvasClient
                 v = obj.get(k)
                 if isinstance(v, str) and ".pdf" in v.lower():
                     name = _safe_name(obj.get("display_name") or obj.get("filename") or "file.pdf")
-                    yield (str(cid), name, v)
+                    yield (str(cid), name, v, None)
             for v in obj.values():
                 yield from walk(v, cid)
         elif isinstance(obj, list):
@@ -78,39 +128,71 @@ def _pdf_candidates_from_manifest(manifest: Dict[str, Any], client: CanvasClient
     for cid, data in courses_data.items():
         yield from walk(data, cid)
 
-def extract_and_upload(base_url: str, access_token: str, *, bucket: str = "kb", prefix: str = "course_data/"):
+def extract_and_upload(base_url: str, access_token: str, *, bucket: str = "kb", prefix: str = "course_data/",
+                       cancel=None, progress=None, incremental: bool = False, cloud: CloudStorage = None,
+                       workers: int = TRANSFER_WORKERS):
     """
     pull canvas data, find *all* pdf links, upload each as its own object in GCS.
-    returns summary; no json manifest saved.
+    returns summary (failed transfers listed with their error); no json manifest saved.
+    pdfs go through a `MigrationPipeline`: `workers` downloads at a time, each streamed
+    straight into a resumable GCS upload and retried on failure.
+    stops queueing pdfs once `cancel` (threading.Event) is set; `progress(**counts)` as pdfs finish.
+
+    incremental=True keeps a snapshot per user under KB_STATE_DIR/canvas: listing pages are
+    re-fetched conditionally (ETag / If-Modified-Since), and a pdf is only downloaded again
+    when its canvas updated_at/size moved (links found outside the files listing carry no
+    metadata, so those are fetched once).
     """
-    client = CanvasClient(base_url, (access_token or "").strip())
+    access_token = (access_token or "").strip()
+    store = _snapshot_store(base_url, access_token) if incremental else None
+    http_cache = store.load_json_data(HTTP_CACHE_FILE, {}) if store else None
+    client = CanvasClient(base_url, access_token, max_connections=max(16, workers), http_cache=http_cache)
     manifest = CanvasDataExtractor(client).extract_all_data()
 
-    cs = CloudStorage()
-    uploaded: List[str] = []
-    seen: set[str] = set()
-
-    for cid, name, url in _pdf_candidates_from_manifest(manifest, client):
-        if not url or url in seen:
-            continue
-        seen.add(url)
+    previous = store.load_latest_canvas_data() if store else None
+    known: Dict[str, Dict[str, Any]] = store.load_json_data(UPLOADS_FILE, {}) if store else {}
+    counts = {"pdfs_seen": 0, "pdfs_skipped": 0}
+    folder = prefix.rstrip('/') + '/'
 
-        tmp = None
-        try:
-            tmp = _download_pdf(client.session, url)
+    def pending() -> Iterable[Dict[str, Any]]:
+        seen: set[str] = set()
+        for cid, name, url, meta in _pdf_candidates_from_manifest(manifest, client):
+            if not url or url in seen:
+                continue
+            seen.add(url)
+            counts["pdfs_seen"] = len(seen)
             # keep flat under course_data/, prefix filenames with course id to avoid collisions
-            dest = f"{prefix.rstrip('/') + '/'}/{cid}_{name}"
-            with open(tmp, "rb") as fh:
-                file_dict = {'stream': fh, 'full_path': dest, 'folder_path': f"{prefix.rstrip('/') + '/'}",  'name': f"{cid}_{name}", 'mimeType': "application/pdf"}
-                cs.upload_file(file_dict)
-                # cs.upload_file(fh, dest, "application/pdf")
-            uploaded.append(dest)
-        except Exception:
-            # skip failures; keep going
-            pass
-        finally:
-            if tmp:
-                try: os.remove(tmp)
-                except Exception: pass
-
-    return {"ok": True, "pdfs_uploaded": len(uploaded), "prefix": prefix.rstrip("/")}
+            dest = f"{folder}/{cid}_{name}"
+            version = _file_version(meta)
+            last = known.get(url)
+            if store and last and last.get("dest") == dest and last.get("version") == version:
+                counts["pdfs_skipped"] += 1
+                continue
+            yield {'url': url, 'version': version, 'full_path': dest, 'folder_path': folder,
+                   'name': f"{cid}_{name}", 'mimeType': "application/pdf", 'size': (meta or {}).get("size")}
+
+    def uploaded(file: Dict[str, Any]) -> None:
+        known[file["url"]] = {"dest": file["full_path"], "version": file["version"],
+                              "uploaded_at": datetime.now().isoformat()}
+
+    def report(count, migrated, deduped, bytes, failed):
+        if progress:
+            progress(pdfs_uploaded=migrated, pdfs_deduped=deduped, pdfs_failed=failed, bytes=bytes, **counts)
+
+    pipeline = MigrationPipeline(CanvasFileSource(client), cloud or CloudStorage(), user_prefix="",
+                                 download_workers=workers)
+    result = pipeline.run(pending(), cancel=cancel, progress=report, done=uploaded)
+
+    out = {"ok": True, "pdfs_uploaded": result["migrated"], "prefix": prefix.rstrip("/"),
+           "pdfs_deduped": result["deduped"], "pdfs_failed": len(result["failed"]), "failed": result["failed"], "bytes": result["bytes"],
+           "cancelled": result["cancelled"], "rate_limit": client.rate_limiter.stats()}
+    if store:
+        # uploads and validators are valid even for a cancelled run; the manifest only when complete
+        store.save_json_data(known, UPLOADS_FILE)
+        store.save_json_data(client.http_cache, HTTP_CACHE_FILE)
+        if not result["cancelled"]:
+            store.save_canvas_data(manifest)
+            store.prune_extractions(KEEP_EXTRACTIONS)
+        out.update(incremental=True, pdfs_skipped=counts["pdfs_skipped"], not_modified=client.not_modified,
+                   items_changed=_count_changed(previous, manifest))
+    return out
@@ -0,0 +1,233 @@
+# token-budgeted context assembly: count tokens with a local tokenizer (tiktoken, else
+# an estimate when its encoding can't be loaded), split one global budget across documents by relevance,
+# recency and size, drop near-duplicate passages, and trim each document to its share
+
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+from storage.state import state_path
+
+try:
+    import tiktoken
+except ImportError:  # listed in requirements.txt; without it tokens are estimated from length
+    tiktoken = None
+
+ENCODING = os.getenv("KB_TOKENIZER", "o200k_base")  # gpt-4o family
+BUILD_MAX_TOKENS = int(os.getenv("KB_BUILD_CONTEXT_TOKENS", "32000"))
+MIN_SHARE = 64               # a document that makes the cut gets at least this many tokens
+NEAR_DUPLICATE = 0.8         # shingle jaccard at which two passages count as the same
+SHINGLE_WORDS = 5
+RECENCY_HALF_LIFE_DAYS = 30.0
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SPACE = re.compile(r"[ \t\f\v\u00a0]+")
+
+
+# ---------- tokens ----------
+_encoder = None
+_encoder_lock = threading.Lock()
+
+def _encoding():
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = False
+            if tiktoken is not None:
+                # the bpe file is downloaded once, then read from the state dir on every start
+                os.environ.setdefault("TIKTOKEN_CACHE_DIR", state_path("tiktoken"))
+                try:
+                    _encoder = tiktoken.get_encoding(ENCODING)
+                except Exception as e:  # e.g. the bpe file can't be fetched offline
+                    print(f"tokenizer {ENCODING} unavailable, estimating tokens: {e}")
+        return _encoder or None
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """the longest prefix of `text` within `max_tokens`, ending at a line or word break when one is near"""
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        cut = enc.decode(ids[:max_tokens])
+    else:
+        if len(text) <= max_tokens * 4:
+            return text
+        cut = text[:max_tokens * 4]
+    for sep in ("\n", " "):
+        i = cut.rfind(sep)
+        if i > len(cut) * 0.8:
+            return cut[:i].rstrip()
+    return cut
+
+
+# ---------- compression ----------
+def compress(text: str) -> str:
+    """
+    collapses runs of spaces and blank lines, drops immediately repeated lines, and keeps
+    only the first copy of a line repeated 3+ times (running headers/footers in pdf text)
+    """
+    return compress_pages([text])[0]
+
+def compress_pages(pages: Sequence[str]) -> List[str]:
+    """
+    compress() over a whole document at once, so a header or footer repeated on every
+    page is seen as repeated and kept only on the first; one string per page comes back
+    """
+    pages = [[_SPACE.sub(" ", line).strip() for line in page.splitlines()] for page in pages]
+    repeated = {line for line, n in Counter(l for page in pages for l in page if l).items() if n >= 3}
+    emitted = set()
+    previous = None
+    out: List[str] = []
+    for lines in pages:
+        kept: List[str] = []
+        for line in lines:
+            if not line:
+                if kept and kept[-1]:
+                    kept.append("")
+                    previous = ""
+                continue
+            if (line in repeated and line in emitted) or previous == line:
+                continue
+            emitted.add(line)
+            kept.append(line)
+            previous = line
+        out.append("\n".join(kept).strip())
+    return out
+
+
+# ---------- near duplicates ----------
+def _shingles(text: str) -> set:
+    words = _WORD.findall(text.lower())
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+class NearDuplicates:
+    """
+    passages kept so far, as word-shingle sets behind an inverted index; `keep(text)`
+    records a passage unless one already kept is near-identical (jaccard >= threshold).
+    passages too short to shingle are always kept.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE):
+        self.threshold = threshold
+        self.dropped = 0
+        self._sizes: List[int] = []
+        self._postings: Dict[int, List[int]] = {}
+
+    def keep(self, text: str) -> bool:
+        shingles = _shingles(text)
+        if not shingles:
+            return True
+        overlap = Counter(pid for s in shingles for pid in self._postings.get(s, ()))
+        for pid, shared in overlap.items():
+            if shared / (len(shingles) + self._sizes[pid] - shared) >= self.threshold:
+                self.dropped += 1
+                return False
+        pid = len(self._sizes)
+        self._sizes.append(len(shingles))
+        for s in shingles:
+            self._postings.setdefault(s, []).append(pid)
+        return True
+
+
+# ---------- allocation ----------
+def allocate(needs: Sequence[int], weights: Sequence[float], budget: int, floor: int = 0) -> List[int]:
+    """
+    splits `budget` tokens in proportion to `weights` after giving every document up to
+    `floor`, never more than it needs; what a capped document leaves over goes round
+    again to the others
+    """
+    shares = [min(need, floor) for need in needs]
+    active = {i for i, need in enumerate(needs) if need > shares[i]}
+    left = budget - sum(shares)
+    while active and left > 0:
+        total = sum(weights[i] for i in active)
+        capped = [i for i in active if needs[i] - shares[i] <= left * weights[i] / total]
+        if not capped:
+            for i in active:
+                shares[i] += int(left * weights[i] / total)
+            break
+        for i in capped:
+            left -= needs[i] - shares[i]
+            shares[i] = needs[i]
+            active.discard(i)
+    return shares
+
+def _recency(updated: Optional[str], now: datetime) -> float:
+    """1.0 for just-modified, halving every RECENCY_HALF_LIFE_DAYS; 0.5 when unknown"""
+    try:
+        when = datetime.fromisoformat(updated)
+    except (TypeError, ValueError):
+        return 0.5
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    age_days = max(0.0, (now - when).total_seconds() / 86400)
+    return 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+def _relevance(query_terms: set, text: str) -> float:
+    """share of the query's words that appear in the text"""
+    if not query_terms:
+        return 1.0
+    words = {w.lower() for w in _WORD.findall(text)}
+    return len(query_terms & words) / len(query_terms)
+
+
+# ---------- assembly ----------
+def assemble(documents: Sequence[Dict], max_tokens: int = BUILD_MAX_TOKENS, query: str = "") -> Tuple[str, Dict]:
+    """
+    documents: [{"label", "text", "updated"?, "score"?}] in output order. `score` (0..1,
+    e.g. from a search) overrides the query-word overlap as relevance.
+    returns (context, stats) where the context is "[label]\\ntext" blocks within
+    `max_tokens`; stats: {tokens, documents, truncated, omitted, duplicates}
+    """
+    now = datetime.now(timezone.utc)
+    query_terms = {w.lower() for w in _WORD.findall(query or "")}
+    prior = [
+        (0.5 + (d["score"] if d.get("score") is not None else _relevance(query_terms, d["text"])))
+        * (0.5 + _recency(d.get("updated"), now))
+        for d in documents
+    ]
+
+    # the most important document keeps a passage; later copies of it are dropped
+    seen = NearDuplicates()
+    bodies = [""] * len(documents)
+    for i in sorted(range(len(documents)), key=lambda i: -prior[i]):
+        passages = compress(documents[i]["text"]).splitlines()
+        bodies[i] = "\n".join(p for p in passages if p and seen.keep(p))
+
+    heads = [f"[{d['label']}]\n" for d in documents]
+    head_tokens = [count_tokens(h) + 1 for h in heads]  # + the blank line between blocks
+    needs = [count_tokens(b) + head_tokens[i] if b else 0 for i, b in enumerate(bodies)]
+    weights = [prior[i] * math.sqrt(need) for i, need in enumerate(needs)]
+
+    # too many documents for the budget: the lowest-weighted ones are left out entirely
+    ranked = [i for i in sorted(range(len(needs)), key=lambda i: -weights[i]) if needs[i]]
+    included = set(ranked[:max(1, max_tokens // MIN_SHARE)])
+    shares = allocate([n if i in included else 0 for i, n in enumerate(needs)], weights, max_tokens, MIN_SHARE)
+
+    blocks, truncated = [], 0
+    for i, share in enumerate(shares):
+        room = share - head_tokens[i]
+        if room <= 0:
+            continue
+        body = truncate_tokens(bodies[i], room)
+        if len(body) < len(bodies[i]):
+            truncated += 1
+        blocks.append(heads[i] + body)
+    context = "\n\n".join(blocks)
+    stats = {"tokens": count_tokens(context), "documents": len(blocks), "truncated": truncated,
+             "omitted": sum(1 for n in needs if n) - len(blocks), "duplicates": seen.dropped}
+    return context, stats
@@ -1,11 +1,29 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List
 from services.canvas_client import CanvasClient
 
+# course_data key -> CanvasClient method
+COURSE_ENDPOINTS = {
+    'assignments': 'get_course_assignments',
+    'discussions': 'get_course_discussions',
+    'files': 'get_course_files',
+    'modules': 'get_course_modules',
+    'announcements': 'get_course_announcements',
+}
+
 class CanvasDataExtractor:
-    def __init__(self, canvas_client: CanvasClient):
+    def __init__(self, canvas_client: CanvasClient, max_workers: int = 8):
         self.client = canvas_client
+        self.max_workers = max_workers
+
+    def _fetch_course_endpoint(self, key: str, course_id: str) -> List[Dict]:
+        """Fetch one per-course listing; failures become an empty list"""
+        try:
+            return getattr(self.client, COURSE_ENDPOINTS[key])(course_id)
+        except Exception as e:
+            return []
 
     def extract_user_data(self) -> Dict:
         """Extract all user-related data"""
@@ -30,40 +48,17 @@ class CanvasDataExtractor:
             'extracted_at': datetime.now().isoformat()
         }
 
-        # Get assignments
-        try:
-            course_data['assignments'] = self.client.get_course_assignments(course_id)
-        except Exception as e:
-            course_data['assignments'] = []
-
-        # Get discussions
-        try:
-            course_data['discussions'] = self.client.get_course_discussions(course_id)
-        except Exception as e:
-            course_data['discussions'] = []
-
-        # Get files
-        try:
-            course_data['files'] = self.client.get_course_files(course_id)
-        except Exception as e:
-            course_data['files'] = []
-
-        # Get modules
-        try:
-            course_data['modules'] = self.client.get_course_modules(course_id)
-        except Exception as e:
-            course_data['modules'] = []
-
-        # Get announcements
-        try:
-            course_data['announcements'] = self.client.get_course_announcements(course_id)
-        except Exception as e:
-            course_data['announcements'] = []
+        for key in COURSE_ENDPOINTS:
+            course_data[key] = self._fetch_course_endpoint(key, course_id)
 
         return course_data
 
     def extract_all_data(self) -> Dict:
-        """Extract all available data from Canvas"""
+        """
+        Extract all available data from Canvas.
+        Every course endpoint (and the user data) is fetched on a bounded worker pool;
+        the client's shared rate limiter and connection pool pace the requests.
+        """
 
         all_data = {
             'extraction_timestamp': datetime.now().isoformat(),
@@ -71,24 +66,27 @@ class CanvasDataExtractor:
             'courses_data': {}
         }
 
-        # Extract user data
-        all_data['user_data'] = self.extract_user_data()
-
-        # Get courses and extract data for each
-        courses = self.client.get_courses()
-        all_data['courses_list'] = courses
-
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="canvas") as pool:
+            # Extract user data alongside the course listing
+            user_future = pool.submit(self.extract_user_data)
 
-        for course in courses:
-            course_id = course['id']
-            course_name = course.get('name', 'Unknown Course')
+            # Get courses and fan out every (course, endpoint) pair
+            courses = self.client.get_courses()
+            all_data['courses_list'] = courses
 
-            try:
-                all_data['courses_data'][course_id] = self.extract_course_data(course_id)
-            except Exception as e:
+            futures = {}
+            for course in courses:
+                course_id = course['id']
                 all_data['courses_data'][course_id] = {
-                    'error': str(e),
+                    'course_id': course_id,
                     'extracted_at': datetime.now().isoformat()
                 }
+                for key in COURSE_ENDPOINTS:
+                    futures[(course_id, key)] = pool.submit(self._fetch_course_endpoint, key, course_id)
+
+            for (course_id, key), future in futures.items():
+                all_data['courses_data'][course_id][key] = future.result()
+
+            all_data['user_data'] = user_future.result()
 
-        return all_data
\ No newline at end of file
+        return all_data
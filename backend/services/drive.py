@@ -1,4 +1,7 @@
 import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
@@ -7,10 +10,19 @@ from io import BytesIO
 from googleapiclient.http import MediaIoBaseDownload
 
 
+CHUNK_SIZE = int(os.getenv("KB_TRANSFER_CHUNK_MB", "8")) * 1024 * 1024
+FILE_FIELDS = "id, name, mimeType, size, md5Checksum, modifiedTime, parents"
+# parent clauses OR-ed into one files().list query; keeps the query well under the URL limit
+FOLDER_BATCH_SIZE = 20
+LIST_WORKERS = int(os.getenv("KB_DRIVE_LIST_WORKERS", "4"))
+
+
 class GoogleDrive(DataSource):
     def __init__(self, name):
         super().__init__(name)
         self.drive_service = None
+        self.creds = None
+        self._local = threading.local()
         self._native_types = {
             "application/vnd.google-apps.document": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             "application/vnd.google-apps.spreadsheet": "text/csv",
@@ -28,6 +40,7 @@ class GoogleDrive(DataSource):
             GOOGLE_DRIVE_CREDENTIALS, SCOPES
         )
         creds = flow.run_local_server(port=0)
+        self.creds = creds
         self.drive_service = build('drive', 'v3', credentials=creds)
         return self.drive_service
 
@@ -46,7 +59,7 @@ class GoogleDrive(DataSource):
 
         while True:
             response = self.drive_service.files().list(
-                pageSize=100,
+                pageSize=1000,
                 fields="nextPageToken, files(id, name, mimeType)",
                 pageToken=page_token
             ).execute()
@@ -78,106 +91,173 @@ class GoogleDrive(DataSource):
 
         files = results.get('files', [])
         return files
-    def _load_file(self, file):
-        """
-        Loads a file from the user's google drive.
-        Mutates the file dictionary by adding a filestream key.
-        """
-        id, name = file['id'], file['name']
-        type = file['mimeType']
-        if type in self._native_types:
-            type = self._native_types[type]
-
-        files = results.get('files', [])
-        return files
 
 
-    def _load_file(self, file):
+    def _service(self):
         """
-        Loads a file from the user's google drive.
-        Mutates the file dictionary by adding a filestream key.
+        Returns a drive service owned by the calling thread.
+        httplib2 connections are not thread-safe, so worker threads each build their own.
         """
-        id, name = file['id'], file['name']
-        type = file['mimeType']
-        if type in self._native_types:
-            type = self._native_types[type]
+        if self.creds is None:
+            return self.drive_service
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = build('drive', 'v3', credentials=self.creds, cache_discovery=False)
+            self._local.service = service
+        return service
 
 
-        request = self.drive_service.files().export_media(
-            fileId=id,
-            mimeType=type
-            )
-        fh = BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
+    def content_type(self, file):
+        """Returns the mime type the file's bytes are delivered as (native docs are exported)."""
+        return self._native_types.get(file['mimeType'], file['mimeType'])
+
 
+    def _media_request(self, file):
+        """Google-native docs must be exported; everything else is fetched as-is."""
+        if file['mimeType'].startswith('application/vnd.google-apps.'):
+            return self._service().files().export_media(
+                fileId=file['id'],
+                mimeType=self.content_type(file)
+                )
+        return self._service().files().get_media(fileId=file['id'])
 
+
+    def stream_file(self, file, fd, chunksize=CHUNK_SIZE):
+        """
+        Downloads a file chunk by chunk into the writable `fd`.
+        Only one chunk is held in memory at a time.
+        """
+        downloader = MediaIoBaseDownload(fd, self._media_request(file), chunksize=chunksize)
         done = False
         while not done:
             status, done = downloader.next_chunk()
 
 
+    def _load_file(self, file):
+        """
+        Loads a file from the user's google drive.
+        Mutates the file dictionary by adding a filestream key.
+        """
+        fh = BytesIO()
+        self.stream_file(file, fh)
         fh.seek(0)
         file['stream'] = fh
 
 
-
-
-    def get_all_files_with_paths(self, root_folder_id='root'):
-        """
-        Returns all files with their paths.
-        Sample output: [{id, name, mimeType, full_path, folder_path}, ...]
-        """
-    def get_all_files_with_paths(self, root_folder_id='root'):
+    def _list_children(self, batch):
         """
-        Returns all files with their paths.
-        Sample output: [{id, name, mimeType, full_path, folder_path}, ...]
+        Lists the children of a batch of folders with one `'<id>' in parents or ...` query,
+        following every page. Returns [(item, parent_path), ...].
         """
+        paths = dict(batch)
+        parents_clause = " or ".join(f"'{folder_id}' in parents" for folder_id in paths)
+        children = []
+        page_token = None
+        while True:
+            response = self._service().files().list(
+                q=f"({parents_clause}) and trashed=false",
+                pageSize=1000,
+                fields=f"nextPageToken, files({FILE_FIELDS})",
+                pageToken=page_token
+            ).execute()
 
+            for item in response.get('files', []):
+                # an item can live in several folders; file it under the first one we asked about
+                parent = next((p for p in item.get('parents', []) if p in paths), None)
+                if parent is not None:
+                    children.append((item, paths[parent]))
 
-        all_files_with_paths = []
-
-        all_files_with_paths = []
-
-
-
-
-        folder_queue = [(root_folder_id, "")]
-
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return children
 
-        while folder_queue:
-            current_folder_id, current_path = folder_queue.pop(0)
 
+    def iter_files_with_paths(self, root_folder_id='root', folders=None, batch_size=FOLDER_BATCH_SIZE, workers=LIST_WORKERS):
+        """
+        Walks the drive and yields file metadata with paths, without downloading.
+        If `folders` is a dict it is filled with {folder_id: folder_path} along the way.
 
-            response = self.drive_service.files().list(
-                q=f"'{current_folder_id}' in parents and trashed=false", # grab all files with current directory as parent
-                pageSize=100,
-                fields="files(id, name, mimeType)"
-            ).execute()
+        Pending folders are listed `batch_size` at a time in a single query and up to
+        `workers` of those queries run concurrently; files are yielded as soon as their
+        batch comes back rather than after the whole tree is walked.
+        Sample item: {id, name, mimeType, size, md5Checksum, modifiedTime, full_path, folder_path}
+        """
+        if root_folder_id == 'root':
+            # children report the real root id in `parents`, never the 'root' alias
+            root_folder_id = self._service().files().get(fileId='root', fields='id').execute()['id']
+        folder_queue = deque([(root_folder_id, "")])
+        running = set()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-list") as pool:
+            while folder_queue or running:
+                while folder_queue and len(running) < workers:
+                    batch = [folder_queue.popleft() for _ in range(min(batch_size, len(folder_queue)))]
+                    running.add(pool.submit(self._list_children, batch))
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for item, current_path in future.result():
+                        item_name = item['name']
+                        item_full_path = f"{current_path}/{item_name}" if current_path else f"/{item_name}"
+
+                        if item['mimeType'] == 'application/vnd.google-apps.folder':
+                            # It's a folder - add to queue for later processing
+                            print(f"Found subfolder: {item_name}")
+                            folder_queue.append((item['id'], item_full_path))
+                            if folders is not None:
+                                folders[item['id']] = item_full_path
+                        else:
+                            # It's a file - hand it to the caller
+                            print(f"Found file: {item_name}")
+                            yield {
+                                **item,
+                                'full_path': item_full_path,
+                                'folder_path': current_path if current_path else "",
+                            }
 
 
-            items = response.get('files', [])
+    def get_all_files_with_paths(self, root_folder_id='root'):
+        """
+        Returns all files with their paths, each loaded into memory.
+        Prefer `iter_files_with_paths` with `storage.pipe.MigrationPipeline` for large drives.
+        Sample output: [{id, name, mimeType, full_path, folder_path, stream}, ...]
+        """
+        all_files_with_paths = []
+        for file_with_path in self.iter_files_with_paths(root_folder_id):
+            self._load_file(file_with_path)
+            all_files_with_paths.append(file_with_path)
+        return all_files_with_paths
 
 
-            # Process each item in this folder
-            for item in items:
-                item_name = item['name']
-                item_full_path = f"{current_path}/{item_name}" if current_path else f"/{item_name}"
+    def get_file_metadata(self, file_id):
+        """Returns {id, name, mimeType, size, md5Checksum, modifiedTime, parents, trashed} for one file."""
+        return self._service().files().get(
+            fileId=file_id,
+            fields=f"{FILE_FIELDS}, trashed"
+        ).execute()
 
 
-                if item['mimeType'] == 'application/vnd.google-apps.folder':
-                    # It's a folder - add to queue for later processing
-                    print(f"Found subfolder: {item_name}")
-                    folder_queue.append((item['id'], item_full_path))
-                else:
-                    # It's a file - add to results
-                    print(f"Found file: {item_name}")
-                    file_with_path = {
-                        **item,
-                        'full_path': item_full_path,
-                        'folder_path': current_path if current_path else "",
-                    }
-                    self._load_file(file_with_path)
-                    all_files_with_paths.append(file_with_path)
+    def get_start_page_token(self):
+        """Returns the Changes API cursor for "now"; changes after this point can be listed later."""
+        response = self._service().changes().getStartPageToken().execute()
+        return response['startPageToken']
 
 
-        return all_files_with_paths
+    def list_changes(self, page_token):
+        """
+        Lists every change since `page_token`.
+        Returns (changes, new_start_page_token); each change is {fileId, removed, file}.
+        """
+        changes = []
+        while True:
+            response = self._service().changes().list(
+                pageToken=page_token,
+                pageSize=1000,
+                includeRemoved=True,
+                spaces='drive',
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}, trashed))"
+            ).execute()
+            changes.extend(response.get('changes', []))
+            if 'newStartPageToken' in response:
+                return changes, response['newStartPageToken']
+            page_token = response['nextPageToken']
@@ -0,0 +1,297 @@
+from services.local_storage import LocalStorage
+from storage.pipe import MigrationPipeline
+from storage.state import state_path
+
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+STATE_PATH = "drive_sync/state.json"
+MAX_FOLDER_DEPTH = 64
+
+
+class _Unavailable(Exception):
+    """Drive metadata could not be fetched for a reason other than the item being gone."""
+
+
+def _http_status(error):
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+class DriveSync:
+    """
+    Incremental Google Drive -> GCS sync.
+
+    The first run walks the whole drive, uploads everything and records a manifest
+    ({file_id: md5Checksum, modifiedTime, full_path, gcs_path}) plus a Changes API
+    cursor. Later runs only list the changes since that cursor: new or modified files
+    are transferred, renamed/moved ones are moved in GCS and removed ones are deleted,
+    so a repeat sync costs O(changes) instead of O(all files).
+
+    Only Drive saying so (removed, trashed, 404) deletes anything from GCS. A change
+    whose metadata can't be fetched (timeout, 5xx, quota) is left untouched and kept
+    in `pending`, so the next run retries it even though the cursor has moved on.
+    """
+    def __init__(self, drive, cloud, store=None, user_prefix="user_files", **pipeline_kwargs):
+        self.drive = drive
+        self.cloud = cloud
+        self.store = store or LocalStorage(state_path())
+        self.user_prefix = user_prefix
+        self.pipeline_kwargs = pipeline_kwargs
+        self.cancel = self.progress = None
+
+    def run(self, full=False, cancel=None, progress=None):
+        """
+        Syncs the drive; falls back to a full walk when there is no saved cursor or `full` is set.
+        A cancelled run keeps the previous cursor so the next run replays the same changes.
+        Returns a summary dict.
+        """
+        self.cancel, self.progress = cancel, progress
+        state = None if full else self.store.load_json_data(STATE_PATH)
+        if not state or not state.get('start_page_token'):
+            return self._full_sync()
+        return self._incremental_sync(state)
+
+    def gcs_path(self, full_path):
+        return f"{self.user_prefix}/{full_path.lstrip('/')}"
+
+    def _full_sync(self):
+        # take the cursor before walking so edits made during the walk are replayed next time
+        token = self.drive.get_start_page_token()
+        root_id = self.drive.get_file_metadata('root')['id']
+        state = {"start_page_token": token, "root_id": root_id, "folders": {}, "files": {}, "pending": []}
+
+        def walk():
+            for file in self.drive.iter_files_with_paths(root_id, folders=state['folders']):
+                state['files'][file['id']] = self._entry(file)
+                yield file
+
+        result = self._transfer(state, walk())
+        result.update(mode="full", changes=0, moved=0, deleted=0, unchanged=0, deferred=0)
+        if not result['cancelled']:
+            self.store.save_json_data(state, STATE_PATH)
+        return result
+
+    def _incremental_sync(self, state):
+        changes, token = self.drive.list_changes(state['start_page_token'])
+        changed = {c['fileId']: c for c in changes}
+        # files that failed last time are retried even if drive reports nothing new
+        for file_id in state.get('pending', []):
+            changed.setdefault(file_id, {"fileId": file_id, "removed": False, "file": None})
+        state['pending'] = []
+
+        summary = {"mode": "incremental", "changes": len(changes), "moved": 0, "deleted": 0, "unchanged": 0}
+        deferred = set()
+        for change in changed.values():
+            if change.get('file') is None and not change.get('removed'):
+                try:
+                    change['file'] = self._fetch(change['fileId'])
+                except _Unavailable as e:
+                    print(f"Deferring {change['fileId']} to the next sync: {e}")
+                    deferred.add(change['fileId'])
+                    continue
+                change['removed'] = change['file'] is None
+        for file_id in deferred:
+            del changed[file_id]
+
+        # folders first, so file paths resolve against the updated tree
+        to_transfer = []
+        for change in changed.values():
+            if self._is_folder(state, change):
+                try:
+                    to_transfer.extend(self._apply_folder(state, change, summary))
+                except _Unavailable as e:
+                    print(f"Deferring folder {change['fileId']} to the next sync: {e}")
+                    deferred.add(change['fileId'])
+        queued = {r['id'] for r in to_transfer}
+        for change in changed.values():
+            if not self._is_folder(state, change) and change['fileId'] not in queued:
+                try:
+                    record = self._apply_file(state, change, summary)
+                except _Unavailable as e:
+                    print(f"Deferring {change['fileId']} to the next sync: {e}")
+                    deferred.add(change['fileId'])
+                    continue
+                if record:
+                    to_transfer.append(record)
+        state['pending'].extend(deferred)
+        summary['deferred'] = len(deferred)
+
+        replaced = {r['id']: state['files'][r['id']]['gcs_path'] for r in to_transfer if r['id'] in state['files']}
+        for record in to_transfer:
+            state['files'][record['id']] = self._entry(record)
+        result = self._transfer(state, iter(to_transfer))
+
+        # a changed file that landed on a new path leaves its old object behind
+        for file_id, old_gcs_path in replaced.items():
+            entry = state['files'].get(file_id)
+            if entry and entry['gcs_path'] != old_gcs_path:
+                self._delete(old_gcs_path)
+
+        result.update(summary)
+        if not result['cancelled']:
+            state['start_page_token'] = token
+            self.store.save_json_data(state, STATE_PATH)
+        return result
+
+    def _transfer(self, state, files):
+        pipeline = MigrationPipeline(self.drive, self.cloud, user_prefix=self.user_prefix, **self.pipeline_kwargs)
+        result = pipeline.run(files, cancel=self.cancel, progress=self.progress)
+        failed_paths = {f['path'] for f in result['failed']}
+        for file_id, entry in list(state['files'].items()):
+            if entry['full_path'] in failed_paths:
+                del state['files'][file_id]
+                state['pending'].append(file_id)
+        return result
+
+    def _apply_folder(self, state, change, summary):
+        """
+        Applies a folder add/rename/move/delete. Returns files to transfer for folders
+        that appeared with content already in them (e.g. restored from trash).
+        Raises _Unavailable, before changing anything, if the new path can't be resolved.
+        """
+        folders, folder_id = state['folders'], change['fileId']
+        old = folders.get(folder_id)
+        new = None if change.get('removed') else self._resolve_path(state, change['file'])
+        if old == new:
+            return []
+
+        if old is None:
+            folders[folder_id] = new
+            records, sub_folders = [], {}
+            for file in self.drive.iter_files_with_paths(folder_id, folders=sub_folders):
+                file['full_path'] = new + file['full_path']
+                file['folder_path'] = new + file['folder_path']
+                entry = state['files'].get(file['id'])
+                if not (entry and self._same_content(entry, file) and entry['full_path'] == file['full_path']):
+                    records.append(file)
+            folders.update({k: new + v for k, v in sub_folders.items()})
+            return records
+
+        # re-home (or drop) everything that lived beneath the old path
+        for sub_id, sub_path in list(folders.items()):
+            if sub_path == old or sub_path.startswith(old + "/"):
+                if new is None:
+                    del folders[sub_id]
+                else:
+                    folders[sub_id] = new + sub_path[len(old):]
+        for file_id, entry in list(state['files'].items()):
+            if not entry['full_path'].startswith(old + "/"):
+                continue
+            if new is None:
+                self._delete(entry['gcs_path'])
+                del state['files'][file_id]
+                summary['deleted'] += 1
+            else:
+                full_path = new + entry['full_path'][len(old):]
+                self._move(entry, full_path, full_path.rsplit('/', 1)[0])
+                summary['moved'] += 1
+        return []
+
+    def _apply_file(self, state, change, summary):
+        """
+        Applies a file change in place; returns a file record if its bytes need transferring.
+        Raises _Unavailable, before changing anything, if the parent folder can't be resolved.
+        """
+        file_id, file = change['fileId'], change.get('file')
+        entry = state['files'].get(file_id)
+        folder_path = None
+        if file and not change.get('removed') and not file.get('trashed') and file.get('parents'):
+            folder_path = self._resolve_folder(state, file['parents'][0])
+
+        if folder_path is None:
+            # removed, trashed, or moved out of my drive
+            if entry:
+                self._delete(entry['gcs_path'])
+                del state['files'][file_id]
+                summary['deleted'] += 1
+            return None
+
+        record = {**file, 'full_path': f"{folder_path}/{file['name']}", 'folder_path': folder_path}
+        if entry and self._same_content(entry, file):
+            if entry['full_path'] != record['full_path']:
+                self._move(entry, record['full_path'], folder_path)
+                summary['moved'] += 1
+            else:
+                summary['unchanged'] += 1
+            state['files'][file_id] = self._entry(record)
+            return None
+        return record
+
+    def _resolve_path(self, state, file):
+        if file.get('trashed') or not file.get('parents'):
+            return None
+        parent = self._resolve_folder(state, file['parents'][0])
+        return None if parent is None else f"{parent}/{file['name']}"
+
+    def _resolve_folder(self, state, folder_id, depth=0):
+        """
+        Returns the drive path of a folder ("" for root), or None if it is outside my drive
+        (gone, trashed, or parentless). Raises _Unavailable if Drive couldn't be asked.
+        """
+        if folder_id == state['root_id']:
+            return ""
+        if folder_id in state['folders']:
+            return state['folders'][folder_id]
+        if depth > MAX_FOLDER_DEPTH:
+            return None
+        meta = self._fetch(folder_id)
+        if not meta or meta.get('trashed') or not meta.get('parents'):
+            return None
+        parent = self._resolve_folder(state, meta['parents'][0], depth + 1)
+        if parent is None:
+            return None
+        path = f"{parent}/{meta['name']}"
+        state['folders'][folder_id] = path
+        return path
+
+    def _is_folder(self, state, change):
+        file = change.get('file') or {}
+        return file.get('mimeType') == FOLDER_MIME or change['fileId'] in state['folders']
+
+    def _same_content(self, entry, file):
+        if entry.get('md5Checksum') and file.get('md5Checksum'):
+            return entry['md5Checksum'] == file['md5Checksum']
+        # google-native docs have no checksum
+        return bool(entry.get('modifiedTime')) and entry.get('modifiedTime') == file.get('modifiedTime')
+
+    def _entry(self, file):
+        return {
+            'name': file['name'],
+            'mimeType': file['mimeType'],
+            'md5Checksum': file.get('md5Checksum'),
+            'modifiedTime': file.get('modifiedTime'),
+            'full_path': file['full_path'],
+            'folder_path': file['folder_path'],
+            'gcs_path': self.gcs_path(file['full_path']),
+        }
+
+    def _fetch(self, file_id):
+        """Returns the item's metadata, or None if Drive reports it doesn't exist (404)."""
+        try:
+            return self.drive.get_file_metadata(file_id)
+        except Exception as e:
+            if _http_status(e) == 404:
+                return None
+            raise _Unavailable(f"could not fetch drive metadata for {file_id}: {e}") from e
+
+    def _move(self, entry, full_path, folder_path):
+        new_gcs_path = self.gcs_path(full_path)
+        try:
+            if folder_path:
+                self.cloud.create_folder(f"{self.user_prefix}{folder_path}")
+            self.cloud.move_file(entry['gcs_path'], new_gcs_path)
+        except Exception as e:
+            print(f"Failed to move {entry['gcs_path']} -> {new_gcs_path}: {e}")
+            return
+        entry['full_path'] = full_path
+        entry['folder_path'] = folder_path
+        entry['gcs_path'] = new_gcs_path
+
+    def _delete(self, gcs_path):
+        try:
+            self.cloud.delete_file(gcs_path)
+        except Exception as e:
+            print(f"Failed to delete {gcs_path}: {e}")
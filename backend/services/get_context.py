@@ -2,12 +2,22 @@
 # summarize all pdfs under a gcs prefix using openai; concat into one string
 # env: OPENAI_KEY (or OPENAI_API_KEY)
 
+import hashlib
 import os
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tempfile import SpooledTemporaryFile
-from typing import Iterable, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIConnectionError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
 from storage.cloud import CloudStorage
+from storage.disk_cache import shared_disk_cache
+from services.summary_cache import SummaryCache, content_id, prompt_hash, shared_summary_cache
+from services.context_budget import BUILD_MAX_TOKENS, assemble, compress, compress_pages, count_tokens, truncate_tokens
+from services.pdf_text import shared_extractor
 
 # ---------- helpers ----------
 def _join(a: str, b: str) -> str:
@@ -25,6 +35,64 @@ def iter_all_paths(cloud: CloudStorage, prefix: str = "") -> Iterable[str]:
             sub += "/"
         yield from iter_all_paths(cloud, sub)
 
+def _open_document(cloud: CloudStorage, path: str):
+    """
+    seekable handle for a gcs object: a file in the local content cache when it fits
+    (downloaded once per object version), else a spooled copy of the gcs stream
+    """
+    try:
+        meta = cloud.stat(path)
+        # dedup aliases share their canonical object's cache entry
+        source = meta["path"]
+        local = shared_disk_cache().fetch(
+            source, meta["generation"], meta["size"],
+            lambda: cloud.iter_range(source, 0, meta["size"] - 1, generation=meta["generation"]),
+        )
+        if local:
+            return local
+    except Exception:
+        pass
+    fh, _, _ = cloud.open_stream(path)
+    try:
+        return _copy_stream_to_spooled(fh)
+    finally:
+        fh.close()
+
+class _Lent:
+    """a handle lent to a reader that closes what it opens (pdf_text sources): close() leaves it open"""
+    def __init__(self, fh):
+        self._fh = fh
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+    def close(self):
+        pass
+
+class _Document:
+    """a gcs object opened on first use (see _open_document) and shared by every reader until closed"""
+    def __init__(self, cloud: CloudStorage, path: str):
+        self.cloud, self.path = cloud, path
+        self._fh = None
+
+    def open(self):
+        """the open handle, rewound"""
+        if self._fh is None:
+            self._fh = _open_document(self.cloud, self.path)
+        self._fh.seek(0)
+        return self._fh
+
+    def lend(self) -> _Lent:
+        return _Lent(self.open())
+
+    def close(self) -> None:
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except Exception:
+                pass
+            self._fh = None
+
 def _copy_stream_to_spooled(fh, max_mem_mb=64):
     """copy a file-like into a SpooledTemporaryFile (no disk unless big)"""
     out = SpooledTemporaryFile(max_size=max_mem_mb * 1024 * 1024, mode="w+b")
@@ -37,18 +105,48 @@ def _copy_stream_to_spooled(fh, max_mem_mb=64):
     return out
 
 # ---------- openai summarization ----------
+SUMMARY_WORKERS = int(os.getenv("KB_SUMMARY_WORKERS", "4"))
+REQUEST_TIMEOUT = float(os.getenv("KB_OPENAI_TIMEOUT", "120"))
+MAX_ATTEMPTS = 5
+CHAT_INPUT_TOKENS = int(os.getenv("KB_SUMMARY_INPUT_TOKENS", "30000"))
+# every openai call in the process (documents, chunks, merges, uploads) takes one of these
+OPENAI_SLOTS = threading.BoundedSemaphore(int(os.getenv("KB_OPENAI_CONCURRENCY", str(SUMMARY_WORKERS))))
+
+def _with_backoff(fn, *args, attempts: int = MAX_ATTEMPTS, base: float = 1.0, **kwargs):
+    """
+    call fn holding an OPENAI_SLOTS slot, retrying rate limits / timeouts / 5xx with
+    jittered exponential backoff (the slot is given back while waiting)
+    """
+    for attempt in range(attempts):
+        try:
+            with OPENAI_SLOTS:
+                return fn(*args, **kwargs)
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt == attempts - 1:
+                raise
+            response = getattr(e, "response", None)
+            retry_after = response.headers.get("retry-after") if response is not None else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = base * 2 ** attempt
+            time.sleep(delay + random.uniform(0, delay / 2))
+
 SYS_PROMPT = (
     "you are a precise study-notes writer. read the attached pdf and produce a terse summary "
     "optimized for recall. include: title (if obvious), 6–12 bullet points with key facts, "
     "definitions/terms, formulas/equations, and any deadlines/dates. "
     "omit boilerplate and navigation. keep it under ~180 words. write plain text bullets."
 )
+MODEL = "gpt-4o-mini"
+PROMPT_HASH = prompt_hash(SYS_PROMPT)
 
 def _responses_summarize_file(client: OpenAI, file_id: str, file_path_label: str) -> str:
     """use the responses api with a file attachment"""
     prompt = f"summarize this document. file path: {file_path_label}"
-    r = client.responses.create(
-        model="gpt-4o-mini",
+    r = _with_backoff(
+        client.responses.create,
+        model=MODEL,
         instructions=SYS_PROMPT,
         input=[{
             "role": "user",
@@ -76,106 +174,389 @@ def _responses_summarize_file(client: OpenAI, file_id: str, file_path_label: str
     print("text", text)
     return (text or "").strip()
 
-def _chat_summarize_text(client: OpenAI, text: str, file_path_label: str) -> str:
+def _chat_summarize_text(client: OpenAI, text: str, file_path_label: str, prompt: str = SYS_PROMPT) -> str:
     """fallback: summarize extracted text via chat completions"""
-    snippet = text if len(text) < 120_000 else text[:120_000]
-    r = client.chat.completions.create(
-        model="gpt-4o-mini",
+    snippet = truncate_tokens(compress(text), CHAT_INPUT_TOKENS)
+    r = _with_backoff(
+        client.chat.completions.create,
+        model=MODEL,
         messages=[
-            {"role": "system", "content": SYS_PROMPT},
+            {"role": "system", "content": prompt},
             {"role": "user", "content": f"file path: {file_path_label}\n\n{snippet}"}
         ],
         temperature=0.2,
     )
     return (r.choices[0].message.content or "").strip()
 
-def _extract_text_locally(fh) -> str:
-    """lightweight local extraction for fallback"""
+def _extract_text_locally(fh, key: Optional[str] = None, version=None) -> str:
+    """local extraction for fallback, page-parallel; `key`/`version` cache the pages (see pdf_text)"""
+    return shared_extractor().extract(fh, key=key, version=version)
+
+def _text_key(cloud: CloudStorage, path: str) -> Tuple[Optional[str], Optional[int]]:
+    """page-text cache (key, version): the object actually holding the bytes, and its current generation"""
+    try:
+        meta = cloud.stat(path)
+        return meta["path"], meta["generation"]
+    except Exception:
+        return None, None
+
+def extract_document_text(cloud: CloudStorage, path: str) -> str:
+    """text of a pdf in the bucket; cached pages never touch gcs"""
+    return "\n".join(extract_document_pages(cloud, path))
+
+def extract_document_pages(cloud: CloudStorage, path: str) -> List[str]:
+    key, version = _text_key(cloud, path)
+    return shared_extractor().pages(lambda: _open_document(cloud, path), key=key, version=version)
+
+# ---------- map-reduce for long documents ----------
+MAP_REDUCE_TOKENS = int(os.getenv("KB_MAP_REDUCE_TOKENS", "24000"))  # longer text is summarized in chunks
+MAP_REDUCE_PAGES = int(os.getenv("KB_MAP_REDUCE_PAGES", "30"))  # shorter pdfs aren't parsed to check
+CHUNK_TOKENS = int(os.getenv("KB_SUMMARY_CHUNK_TOKENS", "6000"))
+CHUNK_WORKERS = int(os.getenv("KB_SUMMARY_CHUNK_WORKERS", "4"))
+
+CHUNK_PROMPT = (
+    "you are a precise study-notes writer. the text is one section of a longer document "
+    "(or notes on several sections). write terse plain-text bullets of its key facts, "
+    "definitions/terms, formulas/equations, and any deadlines/dates. omit boilerplate. "
+    "keep it under ~250 words."
+)
+REDUCE_PROMPT = (
+    "you are a precise study-notes writer. the text is notes on consecutive sections of one "
+    "document. merge them into a terse summary of the whole document optimized for recall. "
+    "include: title (if obvious), 6–12 bullet points with key facts, definitions/terms, "
+    "formulas/equations, and any deadlines/dates. drop repetition. keep it under ~180 words. "
+    "write plain text bullets."
+)
+CHUNK_PROMPT_HASH = prompt_hash(CHUNK_PROMPT)
+REDUCE_PROMPT_HASH = prompt_hash(REDUCE_PROMPT)
+
+def _chunk_pages(pages: List[str], max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    consecutive pages grouped into chunks of at most ~max_tokens. past half full, a chunk
+    also ends after any page whose text hashes to 0 mod 4, so boundaries follow content
+    rather than position: an edited or inserted page only changes the chunks around it
+    and every other chunk's summary stays cached
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    # compressed together so running headers/footers are dropped after their first page
+    for page in compress_pages(pages):
+        if not page:
+            continue
+        tokens = min(count_tokens(page), max_tokens)
+        if current and size + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(truncate_tokens(page, max_tokens))
+        size += tokens
+        if size >= max_tokens // 2 and zlib.crc32(page.encode("utf-8")) % 4 == 0:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def _pack(notes: List[str], max_tokens: int) -> List[List[str]]:
+    """consecutive notes packed into groups of at most max_tokens (a lone oversized note is its own group)"""
+    groups: List[List[str]] = []
+    size = 0
+    for note in notes:
+        tokens = count_tokens(note)
+        if not groups or size + tokens > max_tokens:
+            groups.append([])
+            size = 0
+        groups[-1].append(note)
+        size += tokens
+    return groups
+
+def _cached_chat(client: OpenAI, kind: str, prompt: str, prompt_h: str, text: str, label: str) -> str:
+    """chat summary of `text` cached by (kind, text hash, model, prompt, input limit): unchanged chunks are never resent"""
+    cache = shared_summary_cache()
+    key = SummaryCache.key(kind, hashlib.sha256(text.encode("utf-8")).hexdigest(), MODEL, prompt_h,
+                           str(CHAT_INPUT_TOKENS))
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    summary = _chat_summarize_text(client, text, label, prompt=prompt)
+    if summary:
+        cache.put(key, summary, path=label, model=MODEL, kind=kind)
+    return summary
+
+def _map_reduce_summarize(client: OpenAI, pages: List[str], path: str) -> str:
+    """
+    summarizes each chunk of the document in parallel (map), merges the chunk notes in
+    rounds until they fit one call, then writes the final summary from them (reduce)
+    """
+    chunks = _chunk_pages(pages)
+    # the pool only queues the chunks; the api calls themselves still wait for OPENAI_SLOTS
+    with ThreadPoolExecutor(max_workers=max(1, CHUNK_WORKERS), thread_name_prefix="summarize-chunk") as pool:
+        notes = list(pool.map(lambda chunk: _cached_chat(client, "chunk", CHUNK_PROMPT, CHUNK_PROMPT_HASH, chunk, path),
+                              chunks))
+        notes = [n for n in notes if n]
+        while len(notes) > 1 and count_tokens("\n\n".join(notes)) > CHUNK_TOKENS:
+            groups = _pack(notes, CHUNK_TOKENS)
+            if len(groups) == len(notes):
+                break  # nothing left to combine; the final call truncates
+            notes = list(pool.map(
+                lambda group: _cached_chat(client, "merge", CHUNK_PROMPT, CHUNK_PROMPT_HASH, "\n\n".join(group), path),
+                groups,
+            ))
+            notes = [n for n in notes if n]
+    if not notes:
+        return ""
+    return _cached_chat(client, "reduce", REDUCE_PROMPT, REDUCE_PROMPT_HASH, "\n\n".join(notes), path)
+
+# ---------- per-document work ----------
+def _content_of(cloud: CloudStorage, path: str) -> Optional[str]:
     try:
-        from pdfminer.high_level import extract_text_to_fp
-        from io import StringIO
-        buf = StringIO()
-        fh.seek(0)
-        extract_text_to_fp(fh, buf, laparams=None)
-        return buf.getvalue()
+        return content_id(cloud.stat(path))
     except Exception:
+        return None
+
+# what a document summary depends on besides its content, model and prompt: the mode it was
+# made in, the settings that picked that mode, and the ones that shaped the mode's output
+_MODE_SETTINGS = {
+    "whole": f"input={CHAT_INPUT_TOKENS}",
+    "map-reduce": f"chunk={CHUNK_TOKENS};input={CHAT_INPUT_TOKENS};{CHUNK_PROMPT_HASH};{REDUCE_PROMPT_HASH}",
+}
+_GATE = f"pages={MAP_REDUCE_PAGES};tokens={MAP_REDUCE_TOKENS}"
+
+def _summary_key(cid: Optional[str], mode: str) -> Optional[str]:
+    """summary cache key for content `cid` summarized in `mode`, or None if the content can't be identified"""
+    return SummaryCache.key(cid, MODEL, PROMPT_HASH, mode, _MODE_SETTINGS[mode], _GATE) if cid else None
+
+def _long_document_pages(doc: _Document, text_key: Optional[str], version) -> List[str]:
+    """
+    the pages of a document long enough to summarize by map-reduce, else []. the page count
+    is cheap (and usually cached); only pdfs of MAP_REDUCE_PAGES+ pages are fully parsed
+    """
+    extractor = shared_extractor()
+    try:
+        if extractor.page_count(doc.lend, key=text_key, version=version) < MAP_REDUCE_PAGES:
+            return []
+        pages = extractor.pages(doc.lend, key=text_key, version=version)
+    except Exception as e:
+        print(f"local extraction failed for {doc.path}: {e}")
+        return []
+    return pages if count_tokens("\n".join(pages)) > MAP_REDUCE_TOKENS else []
+
+class _Duplicate:
+    """result for a path whose content another path in the same build already covers"""
+    def __init__(self, of: str):
+        self.of = of
+
+def _summarize_path(client: OpenAI, cloud: CloudStorage, path: str) -> str:
+    """
+    upload one pdf to openai, summarize it, clean up; returns '' if nothing came back.
+    documents of MAP_REDUCE_PAGES+ pages whose text runs past MAP_REDUCE_TOKENS are
+    summarized chunk by chunk instead; shorter ones never have their text extracted here.
+    the document is opened at most once, and not at all when its pages are cached.
+    """
+    cache = shared_summary_cache()
+    cid = _content_of(cloud, path)
+    text_key, version = _text_key(cloud, path)
+    doc = _Document(cloud, path)
+    try:
+        pages = _long_document_pages(doc, text_key, version)
+        if pages:
+            # unchanged content under the same model/prompt/settings was already summarized
+            key = _summary_key(cid, "map-reduce")
+            cached = cache.get(key) if key else None
+            if cached is not None:
+                return cached
+            summary = _map_reduce_summarize(client, pages, path)
+            if summary:
+                if key:
+                    cache.put(key, summary, path=path, model=MODEL, mode="map-reduce")
+                return summary
+
+        key = _summary_key(cid, "whole")
+        cached = cache.get(key) if key else None
+        if cached is not None:
+            return cached
+        summary = _upload_and_summarize(client, doc, path, text_key, version)
+    finally:
+        doc.close()
+    if key and summary:
+        cache.put(key, summary, path=path, model=MODEL, mode="whole")
+    return summary
+
+def _upload_and_summarize(client: OpenAI, doc: _Document, path: str, text_key: Optional[str], version) -> str:
+    # IMPORTANT: give the upload a real filename with .pdf (and content-type)
+    filename = os.path.basename(path) or "document.pdf"
+    if not filename.lower().endswith(".pdf"):
+        filename += ".pdf"
+
+    def upload():
+        # upload to openai files for native doc reading (rewind on every attempt)
+        return client.files.create(
+            file=(filename, doc.open(), "application/pdf"),
+            purpose="assistants",
+        )
+
+    file_obj = _with_backoff(upload)
+
+    try:
+        summary = _responses_summarize_file(client, file_obj.id, path)
+        if not summary:
+            # fallback: local extract + chat summarize
+            txt = _extract_text_locally(doc.lend(), key=text_key, version=version)
+            summary = _chat_summarize_text(client, txt, path) if txt.strip() else ""
+    finally:
         try:
-            import PyPDF2
-            fh.seek(0)
-            reader = PyPDF2.PdfReader(fh)
-            return "\n".join((p.extract_text() or "") for p in reader.pages)
+            with OPENAI_SLOTS:
+                client.files.delete(file_id=file_obj.id)
         except Exception:
-            return ""
+            pass
+    return summary
 
 # ---------- public entry ----------
-def build_context(prefix: str = "") -> str:
-    """
-    walks gcs under `prefix`, summarizes every pdf with openai, concatenates, returns string
-    """
+def _openai_client(timeout: float) -> OpenAI:
     load_dotenv()
     api_key = os.getenv("OPENAI_KEY") or os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("set OPENAI_KEY")
+    # retries are ours (_with_backoff), so the sdk's own are off
+    return OpenAI(api_key=api_key, timeout=timeout, max_retries=0)
 
-    client = OpenAI(api_key=api_key)
+def iter_context(prefix: str = "", concurrency: int = SUMMARY_WORKERS, timeout: float = REQUEST_TIMEOUT,
+                 cancel: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+    """
+    streaming form of build_context: yields events as work completes.
+      {"type": "start", "prefix"}
+      {"type": "document", "index", "path", "summary"}      # as soon as each pdf is done
+      {"type": "duplicate", "index", "path", "of"}          # same content as `of`, summarized once
+      {"type": "error", "index", "path", "error"}
+      {"type": "progress", "done", "failed", "total"}       # total is None until listing ends
+      {"type": "done", "documents", "failed", "duplicates", "total", "cancelled"}
+    closing the generator (e.g. client disconnect) or setting `cancel` drops queued work.
+    """
+    client = _openai_client(timeout)
     cloud = CloudStorage()
+    pool = ThreadPoolExecutor(max_workers=max(1, int(concurrency)), thread_name_prefix="summarize")
+    pending: Dict[Any, Tuple[int, str]] = {}
+    counts = {"done": 0, "failed": 0}
+    duplicates = 0
+    total: Optional[int] = None
+    # content id -> first path claiming it, so identical pdfs are summarized (and sent) once;
+    # a path that fails gives its claim up, so the next copy is summarized instead
+    claimed: Dict[str, str] = {}
+    claim_lock = threading.Lock()
+    outcome: Dict[str, bool] = {}  # claiming path -> whether it succeeded, once it has finished
+    parked: Dict[str, List[Tuple[int, str]]] = {}  # claiming path -> duplicates waiting on its outcome
 
-    summaries: List[str] = []
-    path_generator = iter_all_paths(cloud, prefix)
-
-    for i in range(1):
-        path = next(path_generator)
-        low = path.lower()
-        if not low.endswith(".pdf"):
-            continue
-
-        # stream from gcs
+    def summarize(path: str):
+        cid = _content_of(cloud, path)
+        if cid:
+            with claim_lock:
+                first = claimed.setdefault(cid, path)
+            if first != path:
+                return _Duplicate(first)
         try:
-            fh, _, _ = getattr(cloud, "open_stream")(path)  # preferred
-        except AttributeError:
-            fh, _, _ = cloud.preview_file(path)            # fallback
-
-        try:
-            # upload to openai files for native doc reading
-            spool = _copy_stream_to_spooled(fh)
-            spool.seek(0)
+            return _summarize_path(client, cloud, path)
+        except Exception:
+            if cid:
+                with claim_lock:
+                    if claimed.get(cid) == path:
+                        del claimed[cid]
+            raise
 
-            # IMPORTANT: give the upload a real filename with .pdf (and content-type)
-            filename = os.path.basename(path) or "document.pdf"
-            if not filename.lower().endswith(".pdf"):
-                filename += ".pdf"
+    def settle(path: str, ok: bool):
+        """record how a claiming path went; its parked duplicates are reported, or retried if it failed"""
+        outcome[path] = ok
+        for index, duplicate in parked.pop(path, []):
+            if ok:
+                yield from duplicate_of(index, duplicate, path)
+            else:
+                pending[pool.submit(summarize, duplicate)] = (index, duplicate)
 
-            file_obj = client.files.create(
-                file=(filename, spool, "application/pdf"),
-                purpose="assistants",
-            )
+    def duplicate_of(index: int, path: str, first: str):
+        nonlocal duplicates
+        if first not in outcome:
+            parked.setdefault(first, []).append((index, path))
+        elif not outcome[first]:
+            pending[pool.submit(summarize, path)] = (index, path)
+        else:
+            duplicates += 1
+            yield {"type": "duplicate", "index": index, "path": path, "of": first}
 
+    def finished(block: bool):
+        if not pending:
+            return
+        ready, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in ready:
+            index, path = pending.pop(future)
             try:
-                summary = _responses_summarize_file(client, file_obj.id, path)
-                if not summary:
-                    # fallback: local extract + chat summarize
-                    spool.seek(0)
-                    txt = _extract_text_locally(spool)
-                    summary = _chat_summarize_text(client, txt, path) if txt.strip() else ""
-            finally:
-                try:
-                    client.files.delete(file_id=file_obj.id)
-                except Exception:
-                    pass
-                try:
-                    spool.close()
-                except Exception:
-                    pass
-        finally:
-            try:
-                fh.close()
-            except Exception:
-                pass
+                summary = future.result()
+            except Exception as e:
+                print(f"failed to summarize {path}: {e.__class__.__name__}: {e}")
+                counts["failed"] += 1
+                yield {"type": "error", "index": index, "path": path, "error": f"{e.__class__.__name__}: {e}"}
+                yield from settle(path, False)
+            else:
+                if isinstance(summary, _Duplicate):
+                    yield from duplicate_of(index, path, summary.of)
+                else:
+                    counts["done"] += 1
+                    yield {"type": "document", "index": index, "path": path, "summary": summary}
+                    yield from settle(path, True)
+            yield {"type": "progress", **counts, "duplicates": duplicates, "total": total}
+
+    try:
+        yield {"type": "start", "prefix": prefix}
+        # submit while listing so summarization overlaps the gcs walk
+        listed = 0
+        for path in iter_all_paths(cloud, prefix):
+            if cancel is not None and cancel.is_set():
+                break
+            if not path.lower().endswith(".pdf"):
+                continue
+            pending[pool.submit(summarize, path)] = (listed, path)
+            listed += 1
+            yield from finished(block=False)
+        total = listed
+        while pending and not (cancel is not None and cancel.is_set()):
+            yield from finished(block=True)
+        yield {"type": "done", "documents": counts["done"], "failed": counts["failed"], "duplicates": duplicates,
+               "total": total, "cancelled": cancel is not None and cancel.is_set()}
+    finally:
+        # in-flight api calls can't be interrupted; queued ones never start
+        pool.shutdown(wait=False, cancel_futures=True)
+        shared_summary_cache().prune()
+
+def build_context(prefix: str = "", concurrency: int = SUMMARY_WORKERS, timeout: float = REQUEST_TIMEOUT,
+                  cancel: Optional[threading.Event] = None, progress=None,
+                  max_tokens: int = BUILD_MAX_TOKENS, focus: str = "") -> str:
+    """
+    walks gcs under `prefix`, summarizes every pdf with openai, concatenates, returns string.
+    up to `concurrency` documents are in flight at once, and at most KB_OPENAI_CONCURRENCY
+    api calls across every build (each gets `timeout` seconds and backs off on rate
+    limits); output keeps listing order.
+    the result fits in `max_tokens`: near-duplicate bullets are dropped and each summary
+    gets a share weighted by recency, size and overlap with `focus` (see context_budget).
+    `progress(done=, failed=, total=)` is called as documents finish.
+    """
+    documents = {}
+    for event in iter_context(prefix, concurrency=concurrency, timeout=timeout, cancel=cancel):
+        if event["type"] == "document" and event["summary"]:
+            documents[event["index"]] = event
+        elif event["type"] == "progress" and progress:
+            progress(done=event["done"], failed=event["failed"], total=event["total"])
 
-        if summary:
-            summaries.append(f"[{os.path.basename(path)}]\n{summary}")
+    cloud = CloudStorage()
+    context, _ = assemble(
+        [{"label": os.path.basename(documents[i]["path"]), "text": documents[i]["summary"],
+          "updated": _updated(cloud, documents[i]["path"])} for i in sorted(documents)],
+        max_tokens=max_tokens, query=focus,
+    )
+    return context
 
-    return "\n\n".join(summaries)
+def _updated(cloud: CloudStorage, path: str) -> Optional[str]:
+    try:
+        return cloud.stat(path).get("updated")
+    except Exception:
+        return None
 
 if __name__ == "__main__":
     print(build_context(prefix=""))
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from services.local_storage import LocalStorage
+from storage.state import state_path
+
+JOB_WORKERS = int(os.getenv("KB_JOB_WORKERS", "2"))
+PROGRESS_SAVE_INTERVAL = 1.0
+ACTIVE = ("queued", "running")
+
+
+class Job:
+    """A unit of background work. `fn(job)` reads `job.cancelled` and reports via `job.update()`."""
+
+    def __init__(self, kind: str, params: Optional[Dict] = None, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self._done = threading.Event()
+        self._manager: Optional["JobManager"] = None
+        self._saved_at = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def update(self, **progress) -> None:
+        """Merge progress counters; persisted at most once a second."""
+        self.progress.update(progress)
+        if self._manager and time.monotonic() - self._saved_at >= PROGRESS_SAVE_INTERVAL:
+            self._manager._save(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self, with_result: bool = False) -> Dict:
+        out = {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if with_result:
+            out['result'] = self.result
+        return out
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Job":
+        job = cls(data['kind'], data.get('params'), data['id'])
+        for key in ('status', 'progress', 'error', 'created_at', 'started_at', 'finished_at', 'result'):
+            if key in data:
+                setattr(job, key, data[key])
+        job._done.set()
+        return job
+
+
+class JobManager:
+    """
+    In-process job queue: a worker pool runs long operations off the request thread.
+
+    Every job's status, progress and result are written to KB_STATE_DIR/jobs so they
+    survive restarts; jobs that were running when the process died come back as
+    "interrupted".
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, store: Optional[LocalStorage] = None, max_kept: int = 200):
+        self.store = store or LocalStorage(state_path("jobs"))
+        self.max_kept = max_kept
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any], params: Optional[Dict] = None) -> Job:
+        job = Job(kind, params)
+        job._manager = self
+        with self._lock:
+            self._jobs[job.id] = job
+        self._start(job, fn)
+        return job
+
+    def submit_if_idle(self, kind: str, fn: Callable[[Job], Any], params: Optional[Dict] = None) -> Tuple[Job, bool]:
+        """
+        Submits unless a job of `kind` is already queued or running; the check and the
+        submit happen under one lock, so two concurrent callers can't both start one.
+        Returns (the new job, True) or (the active job, False).
+        """
+        job = Job(kind, params)
+        job._manager = self
+        with self._lock:
+            active = [j for j in self._jobs.values() if j.kind == kind and j.status in ACTIVE]
+            if active:
+                return max(active, key=lambda j: j.created_at), False
+            self._jobs[job.id] = job
+        self._start(job, fn)
+        return job, True
+
+    def _start(self, job: Job, fn: Callable[[Job], Any]) -> None:
+        self._save(job)
+        self._pool.submit(self._run, job, fn)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if kind is None or j.kind == kind]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def latest(self, kind: str) -> Optional[Job]:
+        jobs = self.list(kind)
+        return jobs[0] if jobs else None
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Queued jobs never start; running ones stop at their next cancellation check."""
+        job = self.get(job_id)
+        if job and job.status in ACTIVE:
+            job.cancel_event.set()
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]) -> None:
+        if job.cancelled:
+            return
+        job.status = "running"
+        job.started_at = datetime.now().isoformat()
+        self._save(job)
+        try:
+            job.result = fn(job)
+            self._finish(job, "cancelled" if job.cancelled else "succeeded")
+        except Exception as e:
+            job.error = f"{e.__class__.__name__}: {e}"
+            self._finish(job, "failed")
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = datetime.now().isoformat()
+        self._save(job)
+        job._done.set()
+        self._trim()
+
+    def _save(self, job: Job) -> None:
+        job._saved_at = time.monotonic()
+        try:
+            self.store.save_json_data(job.to_dict(with_result=True), f"{job.id}.json")
+        except Exception as e:
+            print(f"Failed to persist job {job.id}: {e}")
+
+    def _load(self) -> None:
+        for path in self.store.base_dir.glob("*.json"):
+            try:
+                job = Job.from_dict(self.store.load_json_data(path.name))
+            except Exception as e:
+                print(f"Skipping unreadable job file {path.name}: {e}")
+                continue
+            if job.status in ACTIVE:
+                job.status = "interrupted"
+                self._save(job)
+            self._jobs[job.id] = job
+
+    def _trim(self) -> None:
+        """Forget the oldest finished jobs beyond max_kept."""
+        finished = [j for j in self.list() if j.status not in ACTIVE]
+        for job in finished[self.max_kept:]:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            try:
+                (self.store.base_dir / f"{job.id}.json").unlink()
+            except OSError:
+                pass
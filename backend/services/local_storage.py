@@ -1,5 +1,7 @@
 import json
 import os
+import shutil
+import tempfile
 from datetime import datetime
 from pathlib import Path
 from typing import Dict
@@ -7,7 +9,7 @@ from typing import Dict
 class LocalStorage:
     def __init__(self, base_dir: str = "canvas_data"):
         self.base_dir = Path(base_dir)
-        self.base_dir.mkdir(exist_ok=True)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
 
     def save_json_data(self, data: Dict, file_path: str) -> str:
         """Save JSON data to local file"""
@@ -17,14 +19,24 @@ class LocalStorage:
         full_path.parent.mkdir(parents=True, exist_ok=True)
 
         try:
-            # Convert data to JSON and save
-            with open(full_path, 'w', encoding='utf-8') as f:
+            # Convert data to JSON and save; write-then-rename so readers never see half a file
+            fd, tmp_path = tempfile.mkstemp(dir=full_path.parent, prefix=full_path.name, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=2, default=str, ensure_ascii=False)
+            os.replace(tmp_path, full_path)
             return str(full_path)
 
         except Exception as e:
             raise
 
+    def load_json_data(self, file_path: str, default=None):
+        """Load JSON data saved with `save_json_data`; returns `default` if missing"""
+        full_path = self.base_dir / file_path
+        if not full_path.exists():
+            return default
+        with open(full_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
     def save_canvas_data(self, canvas_data: Dict) -> Dict[str, str]:
         """Save Canvas data with organized structure"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -77,4 +89,19 @@ class LocalStorage:
     def get_latest_extraction(self) -> str:
         """Get the latest extraction timestamp"""
         extractions = self.list_extractions()
-        return max(extractions) if extractions else None
\ No newline at end of file
+        return max(extractions) if extractions else None
+
+    def load_latest_canvas_data(self):
+        """Load the most recent full dump written by `save_canvas_data`, or None"""
+        latest = self.get_latest_extraction()
+        if not latest:
+            return None
+        return self.load_json_data(f"full_dumps/{latest}/complete_data.json")
+
+    def prune_extractions(self, keep: int = 3) -> None:
+        """Remove all but the `keep` most recent extractions"""
+        for timestamp in sorted(self.list_extractions())[:-keep or None]:
+            for folder in ("full_dumps", "user_data", "courses_list", "summaries"):
+                shutil.rmtree(self.base_dir / folder / timestamp, ignore_errors=True)
+            for course_dir in (self.base_dir / "courses").glob(f"*/{timestamp}"):
+                shutil.rmtree(course_dir, ignore_errors=True)
@@ -0,0 +1,249 @@
+# local pdf text extraction: pages are parsed in batches across a process pool, and each
+# page's text is cached on disk per object (for its latest version) so re-reads don't
+# parse anything again
+
+import hashlib
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+from typing import Dict, List, Optional
+from services.local_storage import LocalStorage
+from storage.state import shared, state_path
+
+WORKERS = int(os.getenv("KB_PDF_WORKERS", str(os.cpu_count() or 1)))
+MIN_BATCH = 4  # pages per task; fewer pages than this are parsed in-process
+MAX_ENTRIES = int(os.getenv("KB_PDF_TEXT_CACHE_MAX_ENTRIES", "5000"))
+PRUNE_EVERY = 100  # documents written between prunes
+
+# the server is multi-threaded, so workers are spawned rather than forked; a spawned
+# worker re-imports the main module as __mp_main__, which server.py keeps side-effect free
+_SPAWN = multiprocessing.get_context("spawn")
+
+
+# ---------- page parsing (runs in worker processes) ----------
+def _page_count(path: str) -> Optional[int]:
+    try:
+        import PyPDF2
+        return len(PyPDF2.PdfReader(path).pages)
+    except Exception:
+        pass
+    try:
+        from pdfminer.pdfpage import PDFPage
+        with open(path, "rb") as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+    except Exception:
+        return None
+
+def _extract_pages(path: str, pages: List[int]) -> Dict[int, str]:
+    """text of the given (0-based, ascending) pages: pdfminer, else PyPDF2, else empty"""
+    try:
+        from pdfminer.converter import TextConverter
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        out = {}
+        rsrc = PDFResourceManager()
+        with open(path, "rb") as f:
+            for number, page in zip(pages, PDFPage.get_pages(f, pagenos=set(pages))):
+                buf = StringIO()
+                device = TextConverter(rsrc, buf, laparams=None)
+                try:
+                    PDFPageInterpreter(rsrc, device).process_page(page)
+                finally:
+                    device.close()
+                out[number] = buf.getvalue()
+        return out
+    except Exception:
+        pass
+    try:
+        import PyPDF2
+        reader = PyPDF2.PdfReader(path)
+        return {i: reader.pages[i].extract_text() or "" for i in pages}
+    except Exception:
+        return {i: "" for i in pages}
+
+
+# ---------- extractor ----------
+class PdfTextExtractor:
+    """
+    extract(source, key, version) -> text, pages(...) -> text per page, or
+    page_count(source, key, version) without parsing any text.
+    `source` is a file path, a seekable file, or a callable that opens one (only called
+    when some page isn't cached). pages under `key` (e.g. the object path) are cached in
+    KB_STATE_DIR/pdf_text for one `version` (e.g. its generation): a new version replaces
+    the old pages, and the oldest documents beyond `max_entries` are pruned. without a
+    key nothing is cached.
+    """
+
+    def __init__(self, workers: int = WORKERS, cache_dir: Optional[str] = None, max_entries: int = MAX_ENTRIES):
+        self.workers = max(1, workers)
+        self.store = LocalStorage(cache_dir or state_path("pdf_text"))
+        self.max_entries = max_entries
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._saves = 0
+        self.documents = self.pages_parsed = self.pages_cached = self.chars = 0
+        self.seconds = 0.0
+
+    def extract(self, source, key: Optional[str] = None, version=None) -> str:
+        return "\n".join(self.pages(source, key=key, version=version))
+
+    def pages(self, source, key: Optional[str] = None, version=None) -> List[str]:
+        """like extract, but one string per page"""
+        entry = self._load(key, version)
+        wanted = self._wanted(entry)
+        if wanted is not None and all(str(i) in entry["pages"] for i in wanted):
+            return self._finish(entry, wanted, parsed=0, started=None)
+
+        started = time.monotonic()
+        with self._opened(source) as path:
+            self._count(entry, path)
+            wanted = self._wanted(entry)
+            missing = [i for i in wanted if str(i) not in entry["pages"]]
+            for number, text in self._parse(path, missing).items():
+                entry["pages"][str(number)] = text
+        if key:
+            self._save(key, entry)
+        return self._finish(entry, wanted, parsed=len(missing), started=started)
+
+    def page_count(self, source, key: Optional[str] = None, version=None) -> int:
+        """number of pages, read from the page tree (no text is parsed); cached like pages"""
+        entry = self._load(key, version)
+        if entry.get("count") is None:
+            with self._opened(source) as path:
+                self._count(entry, path)
+            if key:
+                self._save(key, entry)
+        return entry["count"]
+
+    def prune(self) -> int:
+        """drop the oldest documents beyond max_entries; returns how many were removed"""
+        files = sorted(self.store.base_dir.glob("*/*.json"), key=lambda f: f.stat().st_mtime)
+        extra = files[:max(0, len(files) - self.max_entries)]
+        for f in extra:
+            try:
+                f.unlink()
+            except OSError:
+                pass
+        return len(extra)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rate = self.pages_parsed / self.seconds if self.seconds else 0.0
+            return {"documents": self.documents, "pages_parsed": self.pages_parsed,
+                    "pages_cached": self.pages_cached, "chars": self.chars,
+                    "seconds": round(self.seconds, 3), "pages_per_second": round(rate, 1),
+                    "workers": self.workers}
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _parse(self, path: str, pages: List[int]) -> Dict[int, str]:
+        if len(pages) <= MIN_BATCH or self.workers == 1:
+            return _extract_pages(path, pages)
+        size = max(MIN_BATCH, math.ceil(len(pages) / (self.workers * 4)))
+        batches = [pages[i:i + size] for i in range(0, len(pages), size)]
+        out: Dict[int, str] = {}
+        for part in self._executor().map(_extract_pages, [path] * len(batches), batches):
+            out.update(part)
+        return out
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_SPAWN)
+            return self._pool
+
+    def _finish(self, entry: Dict, wanted: List[int], parsed: int, started: Optional[float]) -> List[str]:
+        pages = [entry["pages"].get(str(i), "") for i in wanted]
+        with self._lock:
+            self.documents += 1
+            self.pages_parsed += parsed
+            self.pages_cached += len(wanted) - parsed
+            self.chars += sum(len(p) for p in pages)
+            if started is not None:
+                self.seconds += time.monotonic() - started
+        return pages
+
+    @staticmethod
+    def _count(entry: Dict, path: str) -> None:
+        if entry.get("count") is None:
+            # an unreadable page tree counts as one page (which will most likely come back empty)
+            entry["count"], entry["pages"] = _page_count(path) or 1, {}
+
+    @staticmethod
+    def _wanted(entry: Dict) -> Optional[List[int]]:
+        count = entry.get("count")
+        return None if count is None else list(range(count))
+
+    @contextmanager
+    def _opened(self, source):
+        """filesystem path for `source` (opening it first if it's a callable) while in use"""
+        opened = source() if callable(source) else None
+        try:
+            path, cleanup = self._local_path(opened or source)
+            try:
+                yield path
+            finally:
+                cleanup()
+        finally:
+            if opened is not None:
+                opened.close()
+
+    @staticmethod
+    def _local_path(source):
+        """(filesystem path, cleanup) for a path, a file on disk, or any other seekable file"""
+        if isinstance(source, str):
+            return source, lambda: None
+        name = getattr(source, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            return name, lambda: None
+        # in-memory/spooled: the worker processes need something they can open
+        tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        try:
+            source.seek(0)
+            shutil.copyfileobj(source, tmp, 1024 * 1024)
+        finally:
+            tmp.close()
+        return tmp.name, lambda: os.unlink(tmp.name)
+
+    def _load(self, key: Optional[str], version) -> Dict:
+        if key:
+            try:
+                entry = self.store.load_json_data(self._file(key))
+            except ValueError:
+                entry = None
+            if entry and entry.get("version") == version:
+                return entry
+        return {"version": version, "count": None, "pages": {}}
+
+    def _save(self, key: str, entry: Dict) -> None:
+        try:
+            self.store.save_json_data(entry, self._file(key))
+        except Exception as e:
+            print(f"Failed to cache pdf text for {key}: {e}")
+            return
+        with self._lock:
+            self._saves += 1
+            due = self._saves % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    @staticmethod
+    def _file(key: str) -> str:
+        h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return f"{h[:2]}/{h}.json"
+
+
+@shared
+def shared_extractor() -> PdfTextExtractor:
+    return PdfTextExtractor()
@@ -0,0 +1,231 @@
+# query-aware context: chunk extracted pdf text, embed it locally, keep a compact
+# numpy vector index per prefix on disk, and return the top passages for a question
+
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from services.context_budget import NearDuplicates, count_tokens
+from services.get_context import extract_document_text, iter_all_paths
+from services.summary_cache import content_id
+from storage.cloud import CloudStorage
+from storage.state import shared, state_path
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional: hashing embeddings need nothing beyond numpy
+    SentenceTransformer = None
+
+VECTOR_DIR = state_path("vectors")
+EMBED_MODEL = os.getenv("KB_EMBED_MODEL", "")  # e.g. "all-MiniLM-L6-v2" to use a local sentence-transformers model
+HASH_DIM = int(os.getenv("KB_EMBED_DIM", "1024"))
+CHUNK_WORDS = int(os.getenv("KB_CHUNK_WORDS", "180"))
+CHUNK_OVERLAP = int(os.getenv("KB_CHUNK_OVERLAP", "40"))
+TOP_K = 8
+MAX_TOKENS = int(os.getenv("KB_CONTEXT_MAX_TOKENS", "6000"))
+REFRESH_WORKERS = int(os.getenv("KB_RETRIEVAL_WORKERS", "4"))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+# ---------- chunking ----------
+def chunk_text(text: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """overlapping word windows, so a passage cut at a boundary still shows up whole in its neighbour"""
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    return [" ".join(tokens[i:i + words]) for i in range(0, max(1, len(tokens) - overlap), step)]
+
+
+# ---------- embeddings ----------
+class HashingEmbedder:
+    """
+    signed feature hashing of words and word bigrams into `dim` buckets,
+    log-scaled counts, l2-normalized: no model download, deterministic, fast on cpu
+    """
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+        self.name = f"hash-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = [w.lower() for w in _WORD.findall(text)]
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for f in features:
+                h = zlib.crc32(f.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # dampen repeated terms but keep the hash sign
+        return _normalize(np.sign(out) * np.log1p(np.abs(out)))
+
+
+class ModelEmbedder:
+    """a local sentence-transformers model on cpu (KB_EMBED_MODEL)"""
+
+    def __init__(self, model_name: str):
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return _normalize(np.asarray(self.model.encode(texts, batch_size=32), dtype=np.float32))
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+@shared
+def shared_embedder():
+    return ModelEmbedder(EMBED_MODEL) if EMBED_MODEL and SentenceTransformer else HashingEmbedder()
+
+
+# ---------- vector index ----------
+class VectorIndex:
+    """
+    passages of every pdf under one prefix: a float16 matrix (vectors.npy, one unit
+    row per passage) plus meta.json with each passage's text and each document's
+    content id and row range. refresh() only re-embeds documents whose content changed.
+    """
+
+    def __init__(self, prefix: str, embedder=None, base_dir: str = VECTOR_DIR):
+        self.prefix = prefix
+        self.embedder = embedder or shared_embedder()
+        self.dir = os.path.join(base_dir, hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16])
+        self.vectors = np.zeros((0, 0), dtype=np.float16)
+        self.passages: List[Dict] = []     # {"path", "chunk", "text"}
+        self.docs: Dict[str, Dict] = {}    # path -> {"content_id", "start", "count"}
+        self._lock = threading.Lock()
+        self._load()
+
+    def refresh(self, cloud: CloudStorage, text_for=None, workers: int = REFRESH_WORKERS) -> Dict:
+        """
+        syncs with the pdfs now under the prefix; `text_for(path, cid)` may supply already
+        extracted text (e.g. from the search index) before falling back to parsing the pdf.
+        returns {"documents", "passages", "embedded", "removed"}
+        """
+        paths = [p for p in iter_all_paths(cloud, self.prefix) if p.lower().endswith(".pdf")]
+
+        def identify(path):
+            try:
+                return path, content_id(cloud.stat(path))
+            except Exception:
+                return path, None
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="retrieval") as pool:
+            current = dict(pool.map(identify, paths))
+            stale = [p for p, cid in current.items()
+                     if cid is None or p not in self.docs or self.docs[p]["content_id"] != cid]
+            fresh = dict(pool.map(lambda p: (p, self._chunks(cloud, p, current[p], text_for)), stale))
+
+        with self._lock:
+            keep = [p for p in current if p not in fresh and p in self.docs]
+            blocks, passages, docs = [], [], {}
+            for path in keep:
+                d = self.docs[path]
+                rows = slice(d["start"], d["start"] + d["count"])
+                docs[path] = {"content_id": d["content_id"], "start": len(passages), "count": d["count"]}
+                blocks.append(self.vectors[rows])
+                passages.extend(self.passages[rows])
+            for path, chunks in fresh.items():
+                docs[path] = {"content_id": current[path], "start": len(passages), "count": len(chunks)}
+                if chunks:
+                    blocks.append(self.embedder.embed(chunks).astype(np.float16))
+                    passages.extend({"path": path, "chunk": i, "text": c} for i, c in enumerate(chunks))
+            removed = len(set(self.docs) - set(current))
+            self.vectors = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float16)
+            self.passages, self.docs = passages, docs
+            self._save()
+            return {"documents": len(docs), "passages": len(passages), "embedded": len(fresh), "removed": removed}
+
+    def query(self, question: str, top_k: int = TOP_K, max_tokens: int = MAX_TOKENS) -> List[Dict]:
+        """
+        best-matching passages (cosine similarity), at most `top_k` and together within
+        `max_tokens`, skipping near-copies of a better passage (e.g. the same pdf at two
+        paths); each {path, chunk, score, text}
+        """
+        with self._lock:
+            if not self.passages:
+                return []
+            q = self.embedder.embed([question])[0].astype(np.float32)
+            scores = self.vectors.astype(np.float32) @ q
+            n = min(len(scores), max(top_k * 4, top_k))
+            best = np.argpartition(-scores, n - 1)[:n]
+            best = best[np.argsort(-scores[best])]
+            out, used, seen = [], 0, NearDuplicates()
+            for i in best:
+                if scores[i] <= 0:
+                    break  # nothing in common with the question
+                p = self.passages[int(i)]
+                cost = count_tokens(p["text"])
+                if used + cost > max_tokens or not seen.keep(p["text"]):
+                    continue
+                out.append({**p, "score": round(float(scores[i]), 4)})
+                used += cost
+                if len(out) >= top_k:
+                    break
+            return out
+
+    def _chunks(self, cloud: CloudStorage, path: str, cid: Optional[str], text_for) -> List[str]:
+        text = text_for(path, cid) if text_for else None
+        if text is None:
+            try:
+                text = extract_document_text(cloud, path)
+            except Exception as e:
+                print(f"retrieval: could not read {path}: {e}")
+                text = ""
+        return chunk_text(text)
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("embedder") != self.embedder.name:
+                return  # vectors from another embedder aren't comparable; rebuild
+            self.vectors = np.load(os.path.join(self.dir, "vectors.npy"))
+            self.passages, self.docs = meta["passages"], meta["docs"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = os.path.join(self.dir, f".vectors.{threading.get_ident()}.npy")
+        np.save(tmp, self.vectors)
+        os.replace(tmp, os.path.join(self.dir, "vectors.npy"))
+        tmp = os.path.join(self.dir, f".meta.{threading.get_ident()}.json")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"prefix": self.prefix, "embedder": self.embedder.name,
+                       "docs": self.docs, "passages": self.passages}, f)
+        os.replace(tmp, os.path.join(self.dir, "meta.json"))
+
+
+_indexes: Dict[str, VectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+def vector_index(prefix: str) -> VectorIndex:
+    """the (process-wide, lazily loaded) index for `prefix`"""
+    with _indexes_lock:
+        if prefix not in _indexes:
+            _indexes[prefix] = VectorIndex(prefix)
+        return _indexes[prefix]
+
+
+def retrieve_context(prefix: str, query: str, top_k: int = TOP_K, max_tokens: int = MAX_TOKENS,
+                     cloud: Optional[CloudStorage] = None, text_for=None) -> Tuple[str, List[Dict]]:
+    """
+    refreshes the prefix's vector index, then returns (context string, passages) with
+    the passages most relevant to `query`, grouped by document in reading order
+    """
+    index = vector_index(prefix)
+    index.refresh(cloud or CloudStorage(), text_for=text_for)
+    passages = index.query(query, top_k=top_k, max_tokens=max_tokens)
+    ordered = sorted(passages, key=lambda p: (p["path"], p["chunk"]))
+    blocks = [f"[{os.path.basename(p['path'])} #{p['chunk']}]\n{p['text']}" for p in ordered]
+    return "\n\n".join(blocks), passages
@@ -0,0 +1,223 @@
+# full-text index over vault pdfs: sqlite fts5 on local disk (bm25 ranking + snippets)
+# kept current by a CloudStorage listener; text comes from the local pdf extractor (pdf_text)
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+from services.summary_cache import content_id
+from storage.state import state_path
+
+if TYPE_CHECKING:
+    from storage.cloud import CloudStorage
+
+DB_PATH = os.getenv("KB_SEARCH_DB", state_path("search.sqlite3"))
+WORKERS = int(os.getenv("KB_SEARCH_WORKERS", "2"))
+MAX_CHARS = int(os.getenv("KB_SEARCH_MAX_CHARS", "2000000"))
+EXTS = (".pdf",)
+
+SCHEMA = """
+create table if not exists docs (
+    id integer primary key,
+    path text unique not null,
+    content_id text,
+    chars integer,
+    indexed_at real
+);
+create virtual table if not exists docs_fts using fts5(body, tokenize = 'porter unicode61');
+"""
+
+_TERM = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def fts_query(q: str, any_term: bool = False) -> Optional[str]:
+    """
+    user text -> safe fts5 expression: every word quoted (so operators/punctuation can't
+    break the syntax), "word*" kept as a prefix match; terms are ANDed unless `any_term`
+    """
+    terms = []
+    for t in _TERM.findall(q or ""):
+        word, star = (t[:-1], "*") if t.endswith("*") else (t, "")
+        if word:
+            terms.append(f'"{word}"{star}')
+    if not terms:
+        return None
+    return (" OR " if any_term else " ").join(terms)
+
+
+def _prefix_bounds(prefix: str):
+    # every string starting with `prefix` sorts in [prefix, prefix + U+10FFFF)
+    return prefix, prefix + "\U0010ffff"
+
+
+class SearchIndex:
+    """one sqlite file; a connection per thread (wal, so reads never wait on the writer)"""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            self._db().executescript(SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            db.execute("pragma journal_mode = wal")
+            db.execute("pragma synchronous = normal")
+            self._local.db = db
+        return db
+
+    # ---------- writes ----------
+    def put(self, path: str, text: str, cid: Optional[str] = None) -> None:
+        text = text[:MAX_CHARS]
+        with self._write_lock:
+            db = self._db()
+            with db:
+                row = db.execute("select id from docs where path = ?", (path,)).fetchone()
+                if row:
+                    db.execute("update docs set content_id = ?, chars = ?, indexed_at = ? where id = ?",
+                               (cid, len(text), time.time(), row[0]))
+                    db.execute("delete from docs_fts where rowid = ?", (row[0],))
+                    doc_id = row[0]
+                else:
+                    doc_id = db.execute("insert into docs (path, content_id, chars, indexed_at) values (?, ?, ?, ?)",
+                                        (path, cid, len(text), time.time())).lastrowid
+                db.execute("insert into docs_fts (rowid, body) values (?, ?)", (doc_id, text))
+
+    def remove(self, path: str) -> None:
+        with self._write_lock:
+            db = self._db()
+            with db:
+                row = db.execute("select id from docs where path = ?", (path,)).fetchone()
+                if row:
+                    db.execute("delete from docs_fts where rowid = ?", row)
+                    db.execute("delete from docs where id = ?", row)
+
+    # ---------- reads ----------
+    def content_id_of(self, path: str) -> Optional[str]:
+        row = self._db().execute("select content_id from docs where path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def text_for_content(self, cid: str) -> Optional[str]:
+        """already-extracted text of the same content under another path (dedup aliases, copies)"""
+        row = self._db().execute(
+            "select f.body from docs d join docs_fts f on f.rowid = d.id where d.content_id = ? limit 1", (cid,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def paths(self) -> set:
+        return {r[0] for r in self._db().execute("select path from docs")}
+
+    def search(self, q: str, prefix: str = "", limit: int = 20, offset: int = 0, any_term: bool = False) -> List[Dict]:
+        """
+        bm25-ranked matches (best first) restricted to paths under `prefix`;
+        each hit: {path, score, snippet} with matches wrapped in [ ]
+        """
+        expr = fts_query(q, any_term)
+        if expr is None:
+            return []
+        lo, hi = _prefix_bounds(prefix or "")
+        rows = self._db().execute(
+            """
+            select d.path, bm25(docs_fts) as score, snippet(docs_fts, 0, '[', ']', '…', 16)
+            from docs_fts join docs d on d.id = docs_fts.rowid
+            where docs_fts match ? and d.path >= ? and d.path < ?
+            order by score limit ? offset ?
+            """,
+            (expr, lo, hi, int(limit), int(offset)),
+        ).fetchall()
+        # sqlite's bm25 is "lower is better"; flip it so callers see higher = more relevant
+        return [{"path": p, "score": round(-s, 4), "snippet": snip} for p, s, snip in rows]
+
+    def stats(self) -> Dict:
+        docs, chars = self._db().execute("select count(*), coalesce(sum(chars), 0) from docs").fetchone()
+        return {"documents": docs, "chars": chars}
+
+
+class SearchIndexer:
+    """
+    keeps a SearchIndex in step with the bucket: `on_change` (a CloudStorage listener)
+    queues pdf uploads/deletes, and a small worker pool extracts and indexes them.
+    every path belongs to one worker (by hash) and only its latest event is kept, so an
+    upload and a delete of the same path are applied in order, never concurrently.
+    unchanged content (same content id) is skipped; content already extracted for
+    another path is reused instead of parsing the pdf again.
+    """
+
+    def __init__(self, index: SearchIndex, cloud: "CloudStorage", workers: int = WORKERS):
+        self.index = index
+        self.cloud = cloud
+        self._queues: "List[queue.Queue[str]]" = [queue.Queue() for _ in range(max(1, workers))]
+        self._queued: Dict[str, str] = {}  # path -> latest event not yet picked up
+        self._lock = threading.Lock()
+        self.indexed = self.skipped = self.failed = 0
+        for i, q in enumerate(self._queues):
+            threading.Thread(target=self._work, args=(q,), name=f"search-index-{i}", daemon=True).start()
+
+    def on_change(self, event: str, path: str) -> None:
+        if path.lower().endswith(EXTS):
+            self._enqueue(event, path)
+
+    def backfill(self, names: Iterable[str], force: bool = False) -> int:
+        """queue pdfs missing from the index (every pdf with `force`); returns how many"""
+        known = set() if force else self.index.paths()
+        count = 0
+        for name in names:
+            if name.lower().endswith(EXTS) and name not in known:
+                self._enqueue("upload", name)
+                count += 1
+        return count
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"queued": len(self._queued), "indexed": self.indexed,
+                    "skipped": self.skipped, "failed": self.failed, **self.index.stats()}
+
+    def _enqueue(self, event: str, path: str) -> None:
+        with self._lock:
+            waiting = path in self._queued
+            self._queued[path] = event
+        if not waiting:
+            self._queues[zlib.crc32(path.encode("utf-8")) % len(self._queues)].put(path)
+
+    def _work(self, q: "queue.Queue[str]") -> None:
+        while True:
+            path = q.get()
+            with self._lock:
+                event = self._queued.pop(path)
+            try:
+                if event == "delete":
+                    self.index.remove(path)
+                else:
+                    self._index_path(path)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"search index failed for {path}: {e.__class__.__name__}: {e}")
+
+    def _index_path(self, path: str) -> None:
+        try:
+            cid = content_id(self.cloud.stat(path))
+        except Exception:
+            # gone again before we got to it
+            self.index.remove(path)
+            return
+        if cid and self.index.content_id_of(path) == cid:
+            with self._lock:
+                self.skipped += 1
+            return
+        text = self.index.text_for_content(cid) if cid else None
+        if text is None:
+            # imported here: get_context pulls in openai, which indexing itself doesn't need
+            from services.get_context import extract_document_text
+            text = extract_document_text(self.cloud, path)
+        self.index.put(path, text, cid)
+        with self._lock:
+            self.indexed += 1
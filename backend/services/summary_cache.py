@@ -0,0 +1,77 @@
+# persistent summary store for build_context, one small json file per entry
+# key = hash(content id, model, prompt hash): an edited object or a prompt/model change
+# is simply a different key, so stale summaries are never returned
+
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+from services.local_storage import LocalStorage
+from storage.state import shared, state_path
+
+MAX_ENTRIES = int(os.getenv("KB_SUMMARY_CACHE_MAX_ENTRIES", "20000"))
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def content_id(meta: dict) -> Optional[str]:
+    """md5 identifies content across paths/re-uploads; generation is the fallback for composite objects"""
+    if meta.get("md5_hash"):
+        return f"md5:{meta['md5_hash']}"
+    if meta.get("generation"):
+        return f"gen:{meta.get('path')}#{meta['generation']}"
+    return None
+
+
+class SummaryCache:
+    def __init__(self, base_dir: str = None, max_entries: int = MAX_ENTRIES):
+        base_dir = base_dir or state_path("summaries")
+        self.store = LocalStorage(base_dir)
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            entry = self.store.load_json_data(self._file(key))
+        except ValueError:
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry.get("summary")
+
+    def put(self, key: str, summary: str, **info) -> None:
+        self.store.save_json_data({"summary": summary, "saved_at": time.time(), **info}, self._file(key))
+
+    def prune(self) -> int:
+        """drop the oldest entries beyond max_entries; returns how many were removed"""
+        files = sorted(self.store.base_dir.glob("*/*.json"), key=lambda f: f.stat().st_mtime)
+        extra = files[:max(0, len(files) - self.max_entries)]
+        for f in extra:
+            try:
+                f.unlink()
+            except OSError:
+                pass
+        return len(extra)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def _file(self, key: str) -> str:
+        return f"{key[:2]}/{key}.json"
+
+
+@shared
+def shared_summary_cache() -> SummaryCache:
+    return SummaryCache()
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from storage.state import shared
+
+
+DEFAULT_TTLS = {
+    "list": float(os.getenv("KB_CACHE_TTL_LIST", "30")),
+    "media": float(os.getenv("KB_CACHE_TTL_MEDIA", "60")),
+    "meta": float(os.getenv("KB_CACHE_TTL_META", "300")),
+}
+HASHES_TTL = float(os.getenv("KB_CACHE_TTL_HASHES", "300"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("KB_CACHE_MAX_ENTRIES", "2048"))
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a TTL per operation, used by `CloudStorage` for
+    listings ("list", "media") and object metadata ("meta").
+
+    Every entry remembers the object path or prefix it describes so a write can
+    drop exactly the entries it may have made stale. Any object with the same
+    get/set/invalidate/stats methods can be plugged into `CloudStorage` instead.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._entries = OrderedDict()  # (op, key) -> (expires_at, value, scope, exact)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.evictions = 0
+
+    def get(self, op, key):
+        """Returns (hit, value)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((op, key))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((op, key))
+                self._count(op, "hits")
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[(op, key)]
+            self._count(op, "misses")
+            return False, None
+
+    def set(self, op, key, value, scope="", exact=False):
+        """
+        Caches `value`. `scope` is the object path (exact=True) or prefix the value
+        was read from; writes under it invalidate the entry.
+        """
+        ttl = self.ttls.get(op, 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(op, key)] = (time.monotonic() + ttl, value, scope, exact)
+            self._entries.move_to_end((op, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """Drops every entry a write to `path` could have changed."""
+        with self._lock:
+            stale = [
+                k for k, (_, _, scope, exact) in self._entries.items()
+                if (path == scope if exact else path.startswith(scope))
+            ]
+            for k in stale:
+                del self._entries[k]
+            self._count("invalidate", "calls")
+            self._count("invalidate", "dropped", len(stale))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "ttls": dict(self.ttls),
+                "ops": {op: dict(c) for op, c in self._counters.items()},
+            }
+
+    def _count(self, op, name, n=1):
+        counters = self._counters.setdefault(op, {})
+        counters[name] = counters.get(name, 0) + n
+
+
+class FolderHashes:
+    """
+    Per-folder snapshots of the checksums/generations of the objects directly in a
+    folder, each fetched with a single listing, so uploads can compare content and
+    set generation preconditions without a request per file.
+
+    Writes made through `CloudStorage` update the snapshot in place (`record`); any
+    other change only marks the name stale (`forget`), which makes the next lookup
+    for it fall back to a per-object request.
+    """
+    def __init__(self, ttl=HASHES_TTL, max_folders=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_folders = max_folders
+        self._snaps = OrderedDict()  # folder -> (expires_at, {name: entry}, stale names)
+        self._lock = threading.Lock()
+        self._fetching = {}
+        self.listings = self.hits = self.unknown = 0
+
+    def get(self, path, fetch):
+        """
+        Returns (known, entry) for object `path`: (True, None) means it doesn't exist,
+        (False, None) that the snapshot can't tell. `fetch(folder)` lists a folder as
+        {name: entry} when there is no fresh snapshot.
+        """
+        if self.ttl <= 0:
+            return False, None
+        folder, name = _split(path)
+        snap = self._snapshot(folder, fetch)
+        with self._lock:
+            if snap is None or name in snap[2]:
+                self.unknown += 1
+                return False, None
+            self.hits += 1
+            return True, snap[1].get(name)
+
+    def record(self, path, entry):
+        """The current state of `path` (None once deleted), as written by this process."""
+        folder, name = _split(path)
+        with self._lock:
+            snap = self._snaps.get(folder)
+            if snap is None:
+                return
+            if entry is None:
+                snap[1].pop(name, None)
+            else:
+                snap[1][name] = entry
+            snap[2].discard(name)
+
+    def forget(self, path):
+        folder, name = _split(path)
+        with self._lock:
+            snap = self._snaps.get(folder)
+            if snap is not None:
+                snap[1].pop(name, None)
+                snap[2].add(name)
+
+    def stats(self):
+        with self._lock:
+            return {"folders": len(self._snaps), "listings": self.listings,
+                    "hits": self.hits, "unknown": self.unknown}
+
+    def _snapshot(self, folder, fetch):
+        with self._lock:
+            snap = self._snaps.get(folder)
+            if snap is not None and snap[0] > time.monotonic():
+                self._snaps.move_to_end(folder)
+                return snap
+            # one listing per folder even when many uploads into it start at once
+            lock = self._fetching.setdefault(folder, threading.Lock())
+        with lock:
+            with self._lock:
+                snap = self._snaps.get(folder)
+                if snap is not None and snap[0] > time.monotonic():
+                    return snap
+            try:
+                objects = fetch(folder)
+            except Exception as e:
+                print(f"Listing checksums of {folder} failed: {e}")
+                return None
+            snap = (time.monotonic() + self.ttl, objects, set())
+            with self._lock:
+                self.listings += 1
+                self._snaps[folder] = snap
+                self._snaps.move_to_end(folder)
+                while len(self._snaps) > self.max_folders:
+                    self._snaps.popitem(last=False)
+                self._fetching.pop(folder, None)
+            return snap
+
+
+def _split(path):
+    """'a/b/c.pdf' -> ('a/b/', 'c.pdf'); a folder marker 'a/b/' -> ('a/b/', '')"""
+    cut = path.rfind("/") + 1
+    return path[:cut], path[cut:]
+
+
+@shared
+def shared_folder_hashes():
+    """The process-wide checksum snapshots every `CloudStorage()` uses."""
+    return FolderHashes()
+
+@shared
+def shared_cache():
+    """The process-wide cache every `CloudStorage()` uses unless given its own."""
+    return TTLCache()
@@ -1,11 +1,124 @@
+import base64
+import hashlib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound, PreconditionFailed
 from google.cloud import storage
 from dotenv import load_dotenv
-from io import BytesIO
 import mimetypes
+from storage.cache import shared_cache, shared_folder_hashes
+from storage.dedup import ALIAS_KEY, ALIAS_SIZE_KEY, shared_dedup_index
 
-class CloudStorage:
+try:
+    import google_crc32c
+except ImportError:  # ships with google-cloud-storage; only needed to compare composite objects
+    google_crc32c = None
+
+# resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv("KB_TRANSFER_CHUNK_MB", "8")) * 1024 * 1024
+RANGE_CHUNK_SIZE = 1024 * 1024 * 2
+# GCS accepts up to 100 calls per batch request; batches run on a worker pool
+BATCH_SIZE = 100
+BATCH_WORKERS = int(os.getenv("KB_BATCH_WORKERS", "8"))
+
+# callables (event, path) told about every object this process writes ("upload") or removes ("delete")
+_listeners = []
+
+def add_listener(fn):
+    """Registers `fn(event, path)` for change events from every CloudStorage instance."""
+    _listeners.append(fn)
+
+def _notify(event, path):
+    for fn in list(_listeners):
+        try:
+            fn(event, path)
+        except Exception as e:
+            print(f"Storage listener failed on {event} {path}: {e}")
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode("ascii")
+
+class _Checksums:
+    """md5 and crc32c of a byte stream, base64-encoded the way GCS reports them."""
     def __init__(self):
+        self.bytes = 0
+        self._md5 = hashlib.md5()
+        self._crc = google_crc32c.Checksum() if google_crc32c else None
+
+    def update(self, data):
+        self.bytes += len(data)
+        self._md5.update(data)
+        if self._crc is not None:
+            self._crc.update(data)
+
+    def md5(self):
+        return _b64(self._md5.digest())
+
+    def crc32c(self):
+        return _b64(self._crc.digest()) if self._crc is not None else None
+
+class _NotifyingWriter:
+    """
+    Wraps a blob writer: hashes the bytes passing through, and once the upload is
+    finalized records it for dedup and tells caches and listeners.
+    """
+    def __init__(self, writer, blob, path, content_type, on_close):
+        self._writer = writer
+        self._blob = blob
+        self.path = path
+        self.content_type = content_type
+        self.checksums = _Checksums()
+        self._on_close = on_close
+
+    @property
+    def bytes(self):
+        return self.checksums.bytes
+
+    def write(self, data):
+        self.checksums.update(data)
+        return self._writer.write(data)
+
+    def md5(self):
+        """base64 md5 of everything written so far, as GCS reports it"""
+        return self.checksums.md5()
+
+    def close(self):
+        self._writer.close()
+        self._on_close(self.path, self.checksums, self.content_type, getattr(self._blob, "generation", None))
+
+def _batch_error(response):
+    try:
+        message = response.json()["error"]["message"]
+    except Exception:
+        message = getattr(response, "reason", "") or ""
+    return f"{response.status_code} {message}".strip()
+
+class _KnownChecksums:
+    """Checksums reported by the source (e.g. Drive's md5Checksum) for bytes not read here."""
+    def __init__(self, md5):
+        self._md5 = md5
+        self.bytes = 0
+
+    def md5(self):
+        return self._md5
+
+    def crc32c(self):
+        return None
+
+class CloudStorage:
+    def __init__(self, cache=None, dedup=None):
+        """
+        `cache` holds listings and metadata (see storage.cache.TTLCache);
+        `dedup` maps content hashes to stored objects (see storage.dedup.DedupIndex).
+        Both default to the process-wide instances shared by every CloudStorage.
+        """
+        self.cache = cache if cache is not None else shared_cache()
+        self.dedup = dedup if dedup is not None else shared_dedup_index()
+        self.hashes = shared_folder_hashes()
+        self._handoffs = {}  # path -> (heir, dedup entry) while a write to path is in flight
+        self._handoffs_lock = threading.Lock()
         self.authenticate()
 
     def authenticate(self):
@@ -18,6 +131,239 @@ class CloudStorage:
         self.client = storage.Client()
         self.bucket = self.client.bucket(GOOGLE_CLOUD_BUCKET)
 
+    def _changed(self, event, path):
+        """Write-through: drop cached listings/metadata covering `path`, then tell listeners."""
+        self.cache.invalidate(path)
+        self.hashes.forget(path)
+        _notify(event, path)
+
+    # ---------- remote checksums ----------
+    def _list_hashes(self, folder):
+        """{name: {md5_hash, crc32c, generation, alias_of}} for objects directly in `folder`, one listing."""
+        blobs = self.client.list_blobs(
+            self.bucket, prefix=folder, delimiter='/',
+            fields="items(name,md5Hash,crc32c,generation,metadata),prefixes,nextPageToken",
+        )
+        return {
+            blob.name[len(folder):]: {
+                "md5_hash": blob.md5_hash,
+                "crc32c": blob.crc32c,
+                "generation": blob.generation,
+                "alias_of": (blob.metadata or {}).get(ALIAS_KEY),
+            }
+            for blob in blobs
+        }
+
+    def _current(self, path):
+        """Checksums/generation of the object at `path` now, or None if there isn't one."""
+        known, entry = self.hashes.get(path, self._list_hashes)
+        if known:
+            return entry
+        try:
+            meta = self._object_meta(path)
+        except NotFound:
+            return None
+        return {k: meta[k] for k in ("md5_hash", "crc32c", "generation", "alias_of")}
+
+    def _record(self, path, checksums, generation, alias_of=None):
+        if generation is None:
+            self.hashes.forget(path)
+            return
+        self.hashes.record(path, {"md5_hash": checksums.md5(), "crc32c": checksums.crc32c(),
+                                  "generation": generation, "alias_of": alias_of})
+
+    # ---------- content dedup ----------
+    # identical bytes are stored once: further paths get a zero-byte "alias" object whose
+    # metadata names the canonical object, and stat()/reads resolve it transparently
+
+    def _store(self, path, checksums, size, content_type, write):
+        """
+        Commits content to `path` at most once. Returns "unchanged" if `path` already
+        holds it, "alias" if another object does (an alias is written instead), else
+        calls `write(if_generation_match)` to upload the bytes and returns "uploaded"
+        (or None when there is no `write`).
+
+        Overwrites are conditional on the generation seen before deciding, so a
+        concurrent writer makes this raise PreconditionFailed instead of being clobbered.
+        """
+        md5 = checksums.md5()
+        current = self._current(path)
+        if self._same(path, current, checksums):
+            return "unchanged"
+        canonical = self._live_canonical(md5)
+        if write is None and not canonical:
+            return None
+        generation = current["generation"] if current else 0
+        try:
+            self._hand_off(path)
+            try:
+                if canonical and canonical != path:
+                    self._write_alias(path, canonical, md5, size, content_type, generation)
+                    return "alias"
+                write(generation)
+            except Exception:
+                self._take_back(path)
+                raise
+        except PreconditionFailed:
+            self.cache.invalidate(path)
+            self.hashes.forget(path)
+            raise
+        return "uploaded"
+
+    def _same(self, path, current, checksums):
+        if current is None:
+            return False
+        if current["alias_of"]:
+            return self._holds(path, checksums.md5())
+        if current["md5_hash"]:
+            return current["md5_hash"] == checksums.md5()
+        # composite objects have no md5
+        return bool(current["crc32c"]) and current["crc32c"] == checksums.crc32c()
+
+    def store_known(self, file_dict, user_prefix, md5):
+        """
+        Stores `file_dict` without transferring anything when content with `md5` (base64)
+        is already in the bucket. Returns "unchanged"/"alias", or None if the bytes are needed.
+        """
+        if not self._live_canonical(md5):
+            return None
+        user_path = self._prepare_upload(file_dict, user_prefix)
+        size = int(file_dict.get('size') or 0)
+        return self._store(user_path, _KnownChecksums(md5), size, file_dict.get('mimeType'), write=None)
+
+    def finish_upload(self, writer):
+        """
+        Finalizes a stream from `open_upload_stream` unless its bytes turned out to be
+        stored already; then the resumable upload is abandoned, so nothing is committed.
+        Returns "uploaded", "alias" or "unchanged".
+        """
+        return self._store(writer.path, writer.checksums, writer.bytes, writer.content_type,
+                           lambda generation: writer.close())
+
+    def _uploaded(self, path, checksums, content_type, generation):
+        self._settle(path)
+        self.dedup.add_canonical(checksums.md5(), path, checksums.bytes, content_type)
+        self._changed("upload", path)
+        self._record(path, checksums, generation)
+
+    def _holds(self, path, md5):
+        try:
+            return self.stat(path)["md5_hash"] == md5
+        except Exception:
+            return False
+
+    def _live_canonical(self, md5):
+        """The indexed canonical object for `md5` if it still holds those bytes."""
+        entry = self.dedup.lookup(md5) if md5 else None
+        if entry is None:
+            return None
+        try:
+            meta = self._object_meta(entry["canonical"])
+            if meta["md5_hash"] == md5 and not meta["alias_of"]:
+                return entry["canonical"]
+        except Exception:
+            pass
+        self.dedup.discard(md5)
+        return None
+
+    def _write_alias(self, path, canonical, md5, size, content_type, if_generation_match=None):
+        blob = self.bucket.blob(path)
+        blob.metadata = {ALIAS_KEY: canonical, ALIAS_SIZE_KEY: str(size or 0)}
+        blob.upload_from_string(b"", content_type=content_type or "application/octet-stream",
+                                if_generation_match=if_generation_match)
+        self._settle(path)
+        self.dedup.add_alias(md5, path)
+        self._changed("upload", path)
+        self._record(path, _Checksums(), blob.generation, alias_of=canonical)
+
+    def _release(self, path, doomed=frozenset()):
+        """
+        Call before `path` is deleted or overwritten by a copy: if it is the canonical copy
+        of content other paths alias, its bytes move to the first alias (server-side copy).
+        Returns the [(alias, canonical, size)] patches that re-point the remaining
+        aliases there, for `_repoint`.
+
+        `doomed` are the other paths going away in the same bulk call: none of them is
+        chosen as the heir or re-pointed (if every alias is doomed the entry is dropped).
+        """
+        promotion = self.dedup.release(path)
+        if promotion is None:
+            return []
+        md5, entry = promotion
+        survivors = [alias for alias in entry["aliases"] if alias not in doomed]
+        if not survivors:
+            self.dedup.discard(md5)
+            return []
+        heir, *rest = survivors
+        self.bucket.copy_blob(self.bucket.blob(path), self.bucket, heir)
+        self.dedup.promote(md5, heir)
+        self._changed("upload", heir)
+        return [(alias, heir, entry["size"]) for alias in rest]
+
+    def _hand_off(self, path):
+        """
+        Call before new content is written to `path`: if it is the canonical copy of
+        content other paths alias, its bytes are copied to the first alias (server-side)
+        so they outlive the write. Nothing else changes until the write has landed
+        (`_settle`); if it fails, `_take_back` makes that alias an alias again.
+        """
+        md5 = self.dedup.md5_of(path)
+        entry = self.dedup.lookup(md5) if md5 else None
+        if not entry or entry["canonical"] != path or not entry["aliases"]:
+            return
+        heir = entry["aliases"][0]
+        self.bucket.copy_blob(self.bucket.blob(path), self.bucket, heir)
+        self._changed("upload", heir)
+        self.hashes.forget(heir)
+        with self._handoffs_lock:
+            self._handoffs[path] = (heir, entry)
+
+    def _settle(self, path):
+        """New content landed at `path`: the alias its old bytes went to becomes their canonical."""
+        with self._handoffs_lock:
+            handoff = self._handoffs.pop(path, None)
+        if handoff is None:
+            return
+        heir = handoff[0]
+        promotion = self.dedup.release(path)
+        if promotion is None:
+            return
+        md5, entry = promotion
+        self.dedup.promote(md5, heir)
+        self._repoint([(alias, heir, entry["size"]) for alias in entry["aliases"] if alias != heir])
+
+    def _take_back(self, path):
+        """The write `_hand_off` prepared for failed: turn the heir back into an alias of `path`."""
+        with self._handoffs_lock:
+            handoff = self._handoffs.pop(path, None)
+        if handoff is None:
+            return
+        heir, entry = handoff
+        try:
+            blob = self.bucket.blob(heir)
+            blob.metadata = {ALIAS_KEY: path, ALIAS_SIZE_KEY: str(entry["size"] or 0)}
+            blob.upload_from_string(b"", content_type=entry["content_type"] or "application/octet-stream")
+            self._record(heir, _Checksums(), blob.generation, alias_of=path)
+        except Exception as e:
+            # the heir still holds a full copy of the same bytes, so reads stay correct
+            print(f"Failed to restore alias {heir}: {e}")
+            self.hashes.forget(heir)
+        self._changed("upload", heir)
+
+    def _repoint(self, patches, workers=BATCH_WORKERS):
+        """Points each alias in [(alias, canonical, size)] at its new canonical, in batched metadata patches."""
+        def patch(item):
+            alias, canonical, size = item
+            blob = self.bucket.blob(alias)
+            blob.metadata = {ALIAS_KEY: canonical, ALIAS_SIZE_KEY: str(size or 0)}
+            blob.patch()
+
+        errors = self._batched(patches, patch, workers)
+        for (alias, canonical, _), error in zip(patches, errors):
+            self._changed("upload", alias)
+            if error is not None:
+                print(f"Failed to re-point alias {alias} at {canonical}: {error}")
+
     def open_local_file(self, file_path):
         """
         Opens a local file and returns the file stream and mime type.
@@ -36,18 +382,28 @@ class CloudStorage:
             blob = self.bucket.blob(path)
             if not blob.exists():
                 blob.upload_from_string('', content_type='application/x-directory')
+                self._changed("upload", path)
             return True
         except Exception as e:
             print(f"Error creating folder: {e}")
             return False
 
-    def upload_file(self, file_dict, user_prefix=""):
-        """
-        Uploads a file to GCS with a user-specific directory prefix.
+    def _ensure_folder(self, path):
+        """create_folder for the upload path: known markers (from the folder's checksum snapshot) cost no request"""
+        known, marker = self.hashes.get(path, self._list_hashes)
+        if known and marker is not None:
+            return
+        blob = self.bucket.blob(path)
+        try:
+            blob.upload_from_string('', content_type='application/x-directory', if_generation_match=0)
+            self._changed("upload", path)
+        except PreconditionFailed:
+            pass  # already there
+        self.hashes.record(path, {"md5_hash": None, "crc32c": None, "generation": blob.generation, "alias_of": None})
 
-        Args:
-            file_dict: a dictionary containing (stream, name, mimeType, full_path, folder_path)
-            user_prefix: Directory prefix for user files (default: "" to root)
+    def _prepare_upload(self, file_dict, user_prefix=""):
+        """
+        Resolves the destination path for `file_dict` and makes sure its folder exists.
         """
         # Create the user-prefixed path
         original_path = file_dict['full_path'].lstrip('/')  # Remove leading slash if present
@@ -58,23 +414,59 @@ class CloudStorage:
         if folder_path and not folder_path.endswith('/'):
             folder_path += '/'
 
-        # Check if folder exists, create if not
-        folder_blob = self.bucket.blob(folder_path)
-        if folder_path != f"{user_prefix}/" and not folder_blob.exists():
-            self.create_folder(folder_path)
+        # Check if folder exists (known markers cost no request), create if not
+        if folder_path != f"{user_prefix}/":
+            self._ensure_folder(folder_path)
+        return user_path
+
+    def upload_file(self, file_dict, user_prefix=""):
+        """
+        Uploads a file to GCS with a user-specific directory prefix.
+
+        Args:
+            file_dict: a dictionary containing (stream, name, mimeType, full_path, folder_path)
+            user_prefix: Directory prefix for user files (default: "" to root)
+        """
+        user_path = self._prepare_upload(file_dict, user_prefix)
 
         # Upload the file to the user-prefixed path
         blob = self.bucket.blob(user_path)
         stream, mime_type = file_dict['stream'], file_dict['mimeType']
 
-        # Reset stream position to beginning
+        # Hash the content first: identical bytes (here or elsewhere in the bucket) aren't sent again
         stream.seek(0)
+        checksums = _Checksums()
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+            checksums.update(chunk)
 
-        blob.upload_from_file(stream, content_type=mime_type)
+        def write(if_generation_match):
+            # Reset stream position to beginning
+            stream.seek(0)
+            blob.upload_from_file(stream, content_type=mime_type, if_generation_match=if_generation_match)
+            self._uploaded(user_path, checksums, mime_type, blob.generation)
 
-        print(f"Uploaded file to: {user_path}")
+        outcome = self._store(user_path, checksums, checksums.bytes, mime_type, write)
+        print(f"Uploaded file to: {user_path} ({outcome})")
         return True
 
+    def open_upload_stream(self, file_dict, user_prefix="", content_type=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Opens a resumable upload for `file_dict` and returns (writer, path).
+
+        Bytes written to the writer are sent in `chunk_size` pieces, so only about one
+        chunk is buffered. Finish with `finish_upload(writer)` to skip storing content that
+        is already in the bucket (or `writer.close()` to always commit it); abandoning the
+        writer after an error leaves no partial object behind. The upload only commits
+        if the object is still at the generation it had when the stream was opened.
+        """
+        user_path = self._prepare_upload(file_dict, user_prefix)
+        current = self._current(user_path)
+        blob = self.bucket.blob(user_path)
+        content_type = content_type or file_dict['mimeType']
+        writer = blob.open("wb", chunk_size=chunk_size, content_type=content_type,
+                           if_generation_match=current["generation"] if current else 0)
+        return _NotifyingWriter(writer, blob, user_path, content_type, self._uploaded), user_path
+
     def migrate_files(self, file_dicts_with_paths, user_prefix="user_files"):
         """
         Migrate files with a user-specific directory prefix.
@@ -99,7 +491,7 @@ class CloudStorage:
         """
         Downloads a file from GCS.
         """
-        blob = self.bucket.blob(file_path)
+        blob = self.bucket.blob(self.stat(file_path)["path"])
         blob.download_to_filename(file_name)
         return True
 
@@ -110,7 +502,12 @@ class CloudStorage:
 
         Returns a dictionary of list of files and folder names.
         Sample output {"files":['hello.pdf'], "folders": ['/user', '/public']}
+        Results are cached for a short TTL; don't mutate them.
         """
+        hit, cached = self.cache.get("list", current_path)
+        if hit:
+            return cached
+
         blobs = self.client.list_blobs(
             self.bucket,
             prefix=current_path,
@@ -126,26 +523,140 @@ class CloudStorage:
                 if not blob.name.endswith('/'):
                     relative_name = blob.name[len(current_path):]
                     files.append(relative_name)
-        return {"files": files, "folders": folders}
+        listing = {"files": files, "folders": folders}
+        self.cache.set("list", current_path, listing, scope=current_path)
+        return listing
 
     def delete_file(self, file_path):
         """Deletes a file from GCS."""
+        self._repoint(self._release(file_path))
         blob = self.bucket.blob(file_path)
         blob.delete()
+        self._changed("delete", file_path)
+        self.hashes.record(file_path, None)
         return True
 
     def copy_file(self, source_path, destination_path):
+        self._repoint(self._release(destination_path))
         source_blob = self.bucket.blob(source_path)
         self.bucket.copy_blob(source_blob, self.bucket, destination_path)
+        self._copied(source_path, destination_path)
         return True
 
     def move_file(self, source_path, destination_path):
         self.copy_file(source_path, destination_path)
+        self._repoint(self._moved(source_path, destination_path))
         self.delete_file(source_path)
         return True
 
+    def _copied(self, source_path, destination_path):
+        # copying an alias copies its metadata, so the copy is an alias too
+        md5 = self.dedup.md5_of(source_path)
+        if md5 and self.dedup.lookup(md5)["canonical"] != source_path:
+            self.dedup.add_alias(md5, destination_path)
+        self._changed("upload", destination_path)
+
+    def _moved(self, source_path, destination_path):
+        """
+        A moved canonical stays canonical at its new path. Returns the
+        [(alias, canonical, size)] patches that re-point its aliases, for `_repoint`.
+        """
+        aliases = self.dedup.rename(source_path, destination_path)
+        size = (self.dedup.lookup(self.dedup.md5_of(destination_path)) or {}).get("size") if aliases else None
+        return [(alias, destination_path, size) for alias in aliases]
+
+    # ---------- bulk operations ----------
+    # each returns one result per item, in order: {"path"/"source"+"destination", "ok", "error"}
+
+    def delete_files(self, paths, workers=BATCH_WORKERS):
+        """Deletes many objects with batched requests; an already-missing object counts as deleted."""
+        paths = list(paths)
+        doomed = frozenset(paths)
+        self._repoint([patch for path in paths for patch in self._release(path, doomed)], workers)
+        errors = self._batched(paths, lambda path: self.bucket.blob(path).delete(), workers, ok_statuses=(404,))
+        results = []
+        for path, error in zip(paths, errors):
+            if error is None:
+                self._changed("delete", path)
+                self.hashes.record(path, None)
+            results.append({"path": path, "ok": error is None, "error": error})
+        return results
+
+    def copy_files(self, pairs, workers=BATCH_WORKERS):
+        """Copies many (source, destination) pairs server-side with batched requests."""
+        pairs = [tuple(p) for p in pairs]
+        doomed = frozenset(destination for _, destination in pairs)
+        self._repoint([patch for _, destination in pairs for patch in self._release(destination, doomed)], workers)
+        errors = self._batched(
+            pairs, lambda pair: self.bucket.copy_blob(self.bucket.blob(pair[0]), self.bucket, pair[1]), workers,
+        )
+        results = []
+        for (source, destination), error in zip(pairs, errors):
+            if error is None:
+                self._copied(source, destination)
+            results.append({"source": source, "destination": destination, "ok": error is None, "error": error})
+        return results
+
+    def move_files(self, pairs, workers=BATCH_WORKERS):
+        """Copies every pair, then deletes the sources that were copied; a failed copy leaves its source alone."""
+        results = self.copy_files(pairs, workers)
+        copied = [r for r in results if r["ok"]]
+        self._repoint([patch for r in copied for patch in self._moved(r["source"], r["destination"])], workers)
+        deleted = self.delete_files([r["source"] for r in copied], workers)
+        for r, d in zip(copied, deleted):
+            if not d["ok"]:
+                r["ok"], r["error"] = False, f"copied, but deleting the source failed: {d['error']}"
+        return results
+
+    def list_prefix(self, prefix):
+        """Every object name under `prefix` (recursive, folder markers included)."""
+        blobs = self.client.list_blobs(self.bucket, prefix=prefix, fields="items(name),nextPageToken")
+        return [blob.name for blob in blobs]
+
+    def delete_folder(self, prefix, workers=BATCH_WORKERS):
+        prefix = prefix.rstrip('/') + '/'
+        return self.delete_files(self.list_prefix(prefix), workers)
+
+    def move_folder(self, source_prefix, destination_prefix, workers=BATCH_WORKERS):
+        """Moves everything under `source_prefix` to the same relative paths under `destination_prefix`."""
+        source_prefix = source_prefix.rstrip('/') + '/'
+        destination_prefix = destination_prefix.rstrip('/') + '/'
+        if destination_prefix.startswith(source_prefix):
+            raise ValueError("cannot move a folder into itself")
+        pairs = [(name, destination_prefix + name[len(source_prefix):]) for name in self.list_prefix(source_prefix)]
+        return self.move_files(pairs, workers)
+
+    def _batched(self, items, call, workers=BATCH_WORKERS, ok_statuses=()):
+        """
+        Runs `call(item)` for every item inside GCS batch requests of BATCH_SIZE calls,
+        several batches at once (the client keeps its batch per thread). Returns one
+        error message (None on success) per item, in order.
+        Needs google-cloud-storage >= 2.10 (pinned in requirements.txt): that is where
+        `raise_exception=False` and the batch's per-call responses appeared.
+        """
+        chunks = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+
+        def run(chunk):
+            try:
+                with self.client.batch(raise_exception=False) as batch:
+                    for item in chunk:
+                        call(item)
+                responses = batch._responses
+            except Exception as e:
+                return [f"{e.__class__.__name__}: {e}"] * len(chunk)
+            return [
+                None if 200 <= r.status_code < 300 or r.status_code in ok_statuses else _batch_error(r)
+                for r in responses
+            ]
+
+        if not chunks:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks))), thread_name_prefix="gcs-batch") as pool:
+            return [error for errors in pool.map(run, chunks) for error in errors]
+
     def make_public(self, file_path):
-        blob = self.bucket.blob(file_path)
+        # an alias is an empty placeholder; publish the object that holds the bytes
+        blob = self.bucket.blob(self.stat(file_path)["path"])
         blob.make_public()
         return blob.public_url
 
@@ -154,23 +665,75 @@ class CloudStorage:
         return (fh, mime, filename) where fh is a streaming, file-like object.
         nothing is written to disk and we don't load full bytes into memory.
         """
-        blob = self.bucket.blob(file_path)
-        fh = blob.open("rb")                  # streaming handle
-        # fetch metadata for correct headers
+        # fetch metadata for correct headers (cached, so usually no round trip)
         try:
-            blob.reload()
+            meta = self.stat(file_path)
         except Exception:
-            pass
-        mime = blob.content_type or mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+            meta = {"path": file_path, "content_type": None}
+        blob = self.bucket.blob(meta["path"])  # the canonical object if this is an alias
+        fh = blob.open("rb")                  # streaming handle
+        content_type = meta["content_type"]
+        mime = content_type or mimetypes.guess_type(file_path)[0] or "application/octet-stream"
         filename = os.path.basename(file_path)
         return fh, mime, filename
 
+    def iter_range(self, file_path: str, start: int, end: int, generation=None, chunk: int = RANGE_CHUNK_SIZE):
+        """
+        yield bytes [start, end] (inclusive) of an object using ranged reads,
+        `chunk` bytes per request, without touching the rest of the object.
+        pass `generation` to pin every chunk to the same object version.
+        """
+        blob = self.bucket.blob(self.stat(file_path)["path"], generation=generation)
+        pos = start
+        while pos <= end:
+            stop = min(pos + chunk - 1, end)
+            data = blob.download_as_bytes(start=pos, end=stop)
+            if not data:
+                break
+            yield data
+            pos += len(data)
+
+    def stat(self, file_path: str):
+        """
+        return cached object metadata:
+        {path, size, content_type, generation, md5_hash, crc32c, etag, updated, alias_of}
+        for a dedup alias this describes the canonical object: `path` is always the
+        object holding the bytes, and "alias" is set to the `file_path` asked for.
+        """
+        meta = self._object_meta(file_path)
+        if meta["alias_of"]:
+            return {**self._object_meta(meta["alias_of"]), "alias": file_path}
+        return meta
+
+    def _object_meta(self, file_path: str):
+        hit, meta = self.cache.get("meta", file_path)
+        if hit:
+            return meta
+        blob = self.bucket.blob(file_path)
+        blob.reload()
+        meta = {
+            "path": file_path,
+            "size": blob.size,
+            "content_type": blob.content_type or "",
+            "generation": blob.generation,
+            "md5_hash": blob.md5_hash,
+            "crc32c": blob.crc32c,
+            "etag": blob.etag,
+            "updated": (blob.updated.isoformat() if getattr(blob, "updated", None) else None),
+            "alias_of": (blob.metadata or {}).get(ALIAS_KEY),
+        }
+        self.cache.set("meta", file_path, meta, scope=file_path, exact=True)
+        return meta
+
     def list_media(self, prefix: str = "", exts: tuple[str, ...] = ("pdf", "mp4")):
         """
         return a flat list of pdf/mp4 objects under `prefix` (recursive).
         each item: {path, name, size, content_type, updated}
         """
         exts = tuple(e.lower().lstrip(".") for e in exts)
+        hit, cached = self.cache.get("media", (prefix, exts))
+        if hit:
+            return cached
         out = []
         for blob in self.client.list_blobs(self.bucket, prefix=prefix or None):
             if blob.name.endswith("/"):
@@ -179,15 +742,17 @@ class CloudStorage:
             ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
             if ext not in exts:
                 continue
+            alias = blob.metadata or {}
             out.append({
                 "path": blob.name,
                 "name": name,
-                "size": blob.size,
+                "size": int(alias[ALIAS_SIZE_KEY]) if ALIAS_KEY in alias else blob.size,
                 "content_type": (blob.content_type or ""),
                 "updated": (blob.updated.isoformat() if getattr(blob, "updated", None) else None),
             })
         # newest first
         out.sort(key=lambda x: x["updated"] or "", reverse=True)
+        self.cache.set("media", (prefix, exts), out, scope=prefix)
         return out
 
 
@@ -0,0 +1,195 @@
+import atexit
+import base64
+import json
+import os
+import threading
+import time
+from storage.state import shared, state_path
+
+
+INDEX_PATH = os.getenv("KB_DEDUP_INDEX", state_path("dedup.json"))
+SAVE_INTERVAL = 2.0
+
+# object metadata key marking a zero-byte alias; its value is the canonical object's path
+ALIAS_KEY = "kb-alias-of"
+ALIAS_SIZE_KEY = "kb-size"
+
+
+def md5_from_hex(hex_digest):
+    """Drive reports md5Checksum as hex; GCS (and this index) use base64."""
+    return base64.b64encode(bytes.fromhex(hex_digest)).decode("ascii") if hex_digest else None
+
+
+class DedupIndex:
+    """
+    Content-hash index of the bucket: md5 -> the one canonical object holding those
+    bytes, plus the alias objects that stand in for it at other paths.
+
+    Only objects this process wrote are tracked, so a lookup is a hint: callers check
+    the canonical object still carries that md5 before aliasing to it. The index is
+    saved to a JSON file at most every SAVE_INTERVAL seconds and on `flush()`.
+    """
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._entries = {}  # md5 -> {"canonical", "size", "content_type", "aliases": [paths]}
+        self._paths = {}    # object path -> md5, for canonicals and aliases alike
+        self._dirty = False
+        self._saved_at = 0.0
+        self.hits = 0
+        self._load()
+
+    def lookup(self, md5):
+        """Canonical entry for `md5`, or None."""
+        with self._lock:
+            entry = self._entries.get(md5)
+            return dict(entry, aliases=list(entry["aliases"])) if entry else None
+
+    def md5_of(self, path):
+        with self._lock:
+            return self._paths.get(path)
+
+    def add_canonical(self, md5, path, size=None, content_type=None):
+        """Records `path` as holding `md5` (replacing whatever it held before)."""
+        with self._lock:
+            self._forget(path)
+            # a second full copy of known content (e.g. two concurrent uploads) stays untracked
+            if md5 not in self._entries:
+                self._entries[md5] = {"canonical": path, "size": size, "content_type": content_type, "aliases": []}
+                self._paths[path] = md5
+            self._mark()
+
+    def add_alias(self, md5, path):
+        with self._lock:
+            self._forget(path)
+            entry = self._entries.get(md5)
+            if entry is None:
+                return
+            entry["aliases"].append(path)
+            self._paths[path] = md5
+            self.hits += 1
+            self._mark()
+
+    def release(self, path):
+        """
+        Stops tracking `path` before it is overwritten or deleted. If it was a canonical
+        with aliases, returns (md5, entry) so the caller can promote an alias; the entry
+        is left in place until `promote()` runs.
+        """
+        with self._lock:
+            md5 = self._paths.get(path)
+            entry = self._entries.get(md5) if md5 else None
+            if entry and entry["canonical"] == path and entry["aliases"]:
+                return md5, dict(entry, aliases=list(entry["aliases"]))
+            self._forget(path)
+            return None
+
+    def promote(self, md5, new_canonical):
+        """Makes alias `new_canonical` the canonical of `md5`; returns the remaining aliases."""
+        with self._lock:
+            entry = self._entries[md5]
+            self._paths.pop(entry["canonical"], None)
+            entry["aliases"] = [a for a in entry["aliases"] if a != new_canonical]
+            entry["canonical"] = new_canonical
+            self._paths[new_canonical] = md5
+            self._mark()
+            return list(entry["aliases"])
+
+    def rename(self, old, new):
+        """
+        Follows a move of `old` to `new`. Returns the aliases to re-point when `old` was
+        a canonical (it stays canonical at `new`); an alias simply changes path.
+        """
+        with self._lock:
+            md5 = self._paths.get(old)
+            if md5 is None:
+                return []
+            entry = self._entries[md5]
+            if entry["canonical"] != old:
+                self._forget(old)
+                if new not in self._paths:
+                    entry["aliases"].append(new)
+                    self._paths[new] = md5
+                self._mark()
+                return []
+            self._paths.pop(old)
+            if self._paths.get(new) not in (None, md5):
+                self._forget(new)
+            entry["aliases"] = [a for a in entry["aliases"] if a != new]
+            entry["canonical"] = new
+            self._paths[new] = md5
+            self._mark()
+            return list(entry["aliases"])
+
+    def discard(self, md5):
+        """Drops a stale entry (its canonical object is gone or was changed elsewhere)."""
+        with self._lock:
+            entry = self._entries.get(md5)
+            if entry is not None:
+                self._forget(entry["canonical"])
+
+    def stats(self):
+        with self._lock:
+            aliases = sum(len(e["aliases"]) for e in self._entries.values())
+            saved = sum((e["size"] or 0) * len(e["aliases"]) for e in self._entries.values())
+            return {"contents": len(self._entries), "aliases": aliases, "bytes_saved": saved, "hits": self.hits}
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _forget(self, path):
+        md5 = self._paths.pop(path, None)
+        entry = self._entries.get(md5) if md5 else None
+        if entry is None:
+            return
+        if entry["canonical"] == path:
+            # normally the aliases were promoted away first (see release)
+            for alias in entry["aliases"]:
+                self._paths.pop(alias, None)
+            del self._entries[md5]
+        else:
+            entry["aliases"] = [a for a in entry["aliases"] if a != path]
+        self._mark()
+
+    def _mark(self):
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self._save()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f).get("entries", {})
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable dedup index: {e}")
+            return
+        for md5, entry in self._entries.items():
+            self._paths[entry["canonical"]] = md5
+            for alias in entry["aliases"]:
+                self._paths[alias] = md5
+
+    def _save(self):
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": time.time(), "entries": self._entries}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Failed to save dedup index: {e}")
+
+
+@shared
+def shared_dedup_index():
+    """The process-wide index every `CloudStorage()` uses unless given its own."""
+    index = DedupIndex()
+    atexit.register(index.flush)
+    return index
@@ -0,0 +1,202 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from storage.state import shared, state_path
+
+
+CACHE_DIR = os.getenv("KB_DISK_CACHE_DIR", state_path("content"))
+MAX_BYTES = int(os.getenv("KB_DISK_CACHE_MB", "2048")) * 1024 * 1024
+MAX_OBJECT_BYTES = int(os.getenv("KB_DISK_CACHE_MAX_OBJECT_MB", "512")) * 1024 * 1024
+# a ranged read that missed fills the whole object in the background only if it is
+# this small, or once the object has missed this many ranged reads
+RANGED_FILL_BYTES = int(os.getenv("KB_DISK_CACHE_RANGED_FILL_MB", "16")) * 1024 * 1024
+RANGED_FILL_MISSES = int(os.getenv("KB_DISK_CACHE_RANGED_FILL_MISSES", "3"))
+RANGED_MISSES_TRACKED = 4096
+READ_CHUNK = 1024 * 1024
+
+
+class DiskCache:
+    """
+    Content cache of GCS objects on local disk, keyed by (path, generation).
+
+    A new generation is a new key, so entries never go stale; old ones simply age
+    out. Writes land in a temp file and are renamed into place, so readers only
+    ever see complete objects. Total size is capped with LRU eviction.
+    """
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES, max_object_bytes=MAX_OBJECT_BYTES,
+                 ranged_fill_bytes=RANGED_FILL_BYTES, ranged_fill_misses=RANGED_FILL_MISSES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.ranged_fill_bytes = ranged_fill_bytes
+        self.ranged_fill_misses = ranged_fill_misses
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, least recently used first
+        self._filling = set()
+        self._ranged_misses = OrderedDict()  # file name -> ranged reads that missed, most recent last
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def cacheable(self, size):
+        return size is not None and 0 < size <= self.max_object_bytes
+
+    def open(self, path, generation):
+        """
+        The cached object version opened for reading (binary), or None. The file is
+        opened under the lock, so eviction can't unlink it between lookup and open;
+        once open it stays readable even if it is evicted later. Callers close it.
+        """
+        name = self._name(path, generation)
+        with self._lock:
+            return self._open(name, count=True)
+
+    def fetch(self, path, generation, size, read):
+        """
+        Returns the object opened from the local cache, downloading it with `read()`
+        (an iterable of byte chunks) on a miss. Returns None if it is too big to cache.
+        """
+        local = self.open(path, generation)
+        if local or not self.cacheable(size):
+            return local
+        for _ in self.tee(read(), path, generation, size):
+            pass
+        with self._lock:
+            return self._open(self._name(path, generation), count=False)
+
+    def tee(self, chunks, path, generation, size):
+        """
+        Yields `chunks` unchanged while writing them to the cache; the entry is only
+        committed if the stream completes with exactly `size` bytes.
+        """
+        if not self.cacheable(size):
+            yield from chunks
+            return
+        name = self._name(path, generation)
+        os.makedirs(os.path.dirname(self._file(name)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self._file(name)), prefix=".part-")
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    written += len(chunk)
+                    yield chunk
+            if written == size:
+                os.replace(tmp, self._file(name))
+                self._commit(name, size)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def ranged_miss(self, path, generation, size, read):
+        """
+        Notes a ranged read served from GCS. Small objects are then cached whole in the
+        background; bigger ones only once they keep being read, so seeking around a
+        large video once doesn't download all of it. Returns True if a fill started.
+        """
+        if not self.cacheable(size):
+            return False
+        if size > self.ranged_fill_bytes:
+            name = self._name(path, generation)
+            with self._lock:
+                misses = self._ranged_misses.pop(name, 0) + 1
+                if misses < self.ranged_fill_misses:
+                    self._ranged_misses[name] = misses
+                    while len(self._ranged_misses) > RANGED_MISSES_TRACKED:
+                        self._ranged_misses.popitem(last=False)
+                    return False
+        return self.fill_async(path, generation, size, read)
+
+    def fill_async(self, path, generation, size, read):
+        """Caches an object on a background thread. Returns True if a fill started."""
+        name = self._name(path, generation)
+        with self._lock:
+            if not self.cacheable(size) or name in self._filling or name in self._entries:
+                return False
+            self._filling.add(name)
+
+        def fill():
+            try:
+                self.fetch(path, generation, size, read)
+            except Exception as e:
+                print(f"Disk cache fill failed for {path}: {e}")
+            finally:
+                with self._lock:
+                    self._filling.discard(name)
+
+        threading.Thread(target=fill, name="disk-cache-fill", daemon=True).start()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _open(self, name, count):
+        # caller holds the lock
+        if name in self._entries:
+            try:
+                f = open(self._file(name), "rb")
+            except FileNotFoundError:
+                self.bytes -= self._entries.pop(name)
+            else:
+                self._entries.move_to_end(name)
+                if count:
+                    self.hits += 1
+                return f
+        if count:
+            self.misses += 1
+        return None
+
+    def _commit(self, name, size):
+        with self._lock:
+            if name not in self._entries:
+                self.bytes += size
+            self._entries[name] = size
+            self._entries.move_to_end(name)
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                old, old_size = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self._file(old))  # open readers keep their handle
+                except OSError:
+                    pass
+
+    def _scan(self):
+        """Rebuilds the LRU from disk, oldest access first, so the cache survives restarts."""
+        found = []
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                if f.startswith(".part-"):
+                    os.remove(os.path.join(dirpath, f))
+                    continue
+                st = os.stat(os.path.join(dirpath, f))
+                found.append((st.st_atime, f, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.bytes += size
+
+    def _name(self, path, generation):
+        return hashlib.sha256(f"{path}#{generation}".encode()).hexdigest()
+
+    def _file(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+
+def iter_file_range(f, start, end, chunk=READ_CHUNK):
+    """Yields bytes [start, end] of an open cached file through a read-only memory map."""
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for pos in range(start, end + 1, chunk):
+            yield mm[pos:min(pos + chunk, end + 1)]
+
+
+@shared
+def shared_disk_cache():
+    """The process-wide content cache."""
+    return DiskCache()
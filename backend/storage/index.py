@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+
+
+class _Node:
+    __slots__ = ("dirs", "files", "marker")
+
+    def __init__(self):
+        self.dirs = {}
+        self.files = set()
+        self.marker = False  # a zero-byte "folder/" object exists for this node
+
+    def empty(self):
+        return not (self.dirs or self.files or self.marker)
+
+
+class ListingIndex:
+    """
+    In-memory prefix tree of object names in the bucket.
+
+    Answers `list_files_in_directory`-style listings and child counts without any
+    GCS calls. It is kept current by `CloudStorage` change events, persisted to a
+    JSON snapshot so restarts are warm, and periodically rebuilt from a full bucket
+    listing to pick up writes made outside this process.
+    """
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self.ready = False
+        self.rebuilt_at = None
+        self._root = _Node()
+        self._lock = threading.RLock()
+        self._journal = None  # events seen while a rebuild is listing the bucket
+
+    # ---------- queries ----------
+    def listing(self, prefix=""):
+        """
+        Same shape as `CloudStorage.list_files_in_directory`.
+        Sample output {"files": ['hello.pdf'], "folders": ['user/', 'public/']}
+        """
+        with self._lock:
+            node = self._find(prefix)
+            if node is None:
+                return {"files": [], "folders": []}
+            return {
+                "files": sorted(node.files),
+                "folders": sorted(f"{name}/" for name in node.dirs),
+            }
+
+    def child_count(self, prefix=""):
+        """Number of immediate files and folders under `prefix`."""
+        with self._lock:
+            node = self._find(prefix)
+            return 0 if node is None else len(node.files) + len(node.dirs)
+
+    # ---------- updates ----------
+    def on_change(self, event, path):
+        """`CloudStorage` listener: event is "upload" or "delete"."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((event, path))
+            if event == "delete":
+                self._remove(self._root, path)
+            else:
+                self._add(self._root, path)
+
+    def rebuild(self, names):
+        """Replaces the tree with one built from `names`, replaying events that raced the listing."""
+        with self._lock:
+            self._journal = []
+        root = _Node()
+        for name in names:
+            self._add(root, name)
+        with self._lock:
+            for event, path in self._journal:
+                if event == "delete":
+                    self._remove(root, path)
+                else:
+                    self._add(root, path)
+            self._journal = None
+            self._root = root
+            self.ready = True
+            self.rebuilt_at = time.time()
+
+    def names(self):
+        """All object names in the index (folder markers end with '/')."""
+        out = []
+        with self._lock:
+            stack = [("", self._root)]
+            while stack:
+                prefix, node = stack.pop()
+                if node.marker:
+                    out.append(prefix)
+                out.extend(prefix + f for f in node.files)
+                stack.extend((f"{prefix}{name}/", child) for name, child in node.dirs.items())
+        return out
+
+    # ---------- snapshot ----------
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable listing snapshot: {e}")
+            return False
+        self.rebuild(snap.get("names", []))
+        self.rebuilt_at = snap.get("saved_at")
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"saved_at": time.time(), "names": self.names()}, f)
+        os.replace(tmp, self.snapshot_path)
+
+    # ---------- reconciler ----------
+    def reconcile(self, cloud):
+        """Rebuilds from a full (names-only) bucket listing and saves a snapshot."""
+        blobs = cloud.client.list_blobs(cloud.bucket, fields="items(name),nextPageToken")
+        self.rebuild(blob.name for blob in blobs)
+        self.save_snapshot()
+
+    def start_reconciler(self, cloud, interval=300):
+        """Reconciles now and then every `interval` seconds on a daemon thread."""
+        def loop():
+            while True:
+                try:
+                    self.reconcile(cloud)
+                except Exception as e:
+                    print(f"Listing index reconcile failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name="listing-index-reconciler", daemon=True)
+        thread.start()
+        return thread
+
+    # ---------- tree helpers ----------
+    def _find(self, prefix):
+        node = self._root
+        for part in prefix.split("/")[:-1]:
+            node = node.dirs.get(part)
+            if node is None:
+                return None
+        return node
+
+    def _add(self, root, path):
+        *parts, leaf = path.split("/")
+        node = root
+        for part in parts:
+            node = node.dirs.setdefault(part, _Node())
+        if leaf:
+            node.files.add(leaf)
+        elif parts:
+            node.marker = True
+
+    def _remove(self, root, path):
+        *parts, leaf = path.split("/")
+        trail = [root]
+        for part in parts:
+            child = trail[-1].dirs.get(part)
+            if child is None:
+                return
+            trail.append(child)
+        if leaf:
+            trail[-1].files.discard(leaf)
+        else:
+            trail[-1].marker = False
+        # prune folders that no longer contain anything, like GCS prefixes do
+        for depth in range(len(parts), 0, -1):
+            if not trail[depth].empty():
+                break
+            del trail[depth - 1].dirs[parts[depth - 1]]
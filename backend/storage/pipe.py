@@ -1,3 +1,22 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from storage.dedup import md5_from_hex
+
+
+DOWNLOAD_WORKERS = int(os.getenv("KB_MIGRATE_DOWNLOAD_WORKERS", "4"))
+UPLOAD_WORKERS = int(os.getenv("KB_MIGRATE_UPLOAD_WORKERS", "4"))
+MAX_IN_FLIGHT_BYTES = int(os.getenv("KB_MIGRATE_MAX_IN_FLIGHT_MB", "256")) * 1024 * 1024
+STREAMING = os.getenv("KB_MIGRATE_STREAMING", "1") == "1"
+CHUNK_SIZE = int(os.getenv("KB_TRANSFER_CHUNK_MB", "8")) * 1024 * 1024
+ATTEMPTS = int(os.getenv("KB_MIGRATE_ATTEMPTS", "3"))
+
+# google-native docs report no size, so exports are charged a guess up front
+UNKNOWN_SIZE_ESTIMATE = 8 * 1024 * 1024
+MIN_CHARGE = 256 * 1024
+
+
 class Pipe:
     """
     A class that migrates data from a `DataSource` to the cloud storage.
@@ -7,6 +26,228 @@ class Pipe:
         self.cloud = cloud
 
     def migrate_all(self):
-        all_files = self.source.get_all_files()
-        self.cloud.migrate_files(all_files)
+        return MigrationPipeline(self.source, self.cloud).run(self.source.iter_files_with_paths())
+
+
+class ByteBudget:
+    """
+    Caps the number of bytes held by in-flight transfers.
+    An item larger than the whole budget is still admitted once nothing else is in flight.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, n):
+        with self._cond:
+            while self.in_flight and self.in_flight + n > self.limit:
+                self._cond.wait()
+            self.in_flight += n
+
+    def charge(self, n):
+        """Accounts for bytes beyond the original estimate without blocking the caller."""
+        with self._cond:
+            self.in_flight += n
+
+    def release(self, n):
+        with self._cond:
+            self.in_flight -= n
+            self._cond.notify_all()
+
+
+class _CountingWriter:
+    """Forwards writes to `fh` while counting the bytes that pass through."""
+    def __init__(self, fh):
+        self.fh = fh
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.fh.write(data)
+
+
+class MigrationPipeline:
+    """
+    Pipelined migration from a `DataSource` to `CloudStorage`.
+
+    The calling thread walks the source and feeds a download pool, which hands
+    loaded files to an upload pool. The producer blocks once `max_in_flight_bytes`
+    are downloaded but not yet uploaded, so memory stays flat regardless of drive size.
+
+    In streaming mode (the default when the source has `stream_file`) each download
+    worker pipes chunks straight into a resumable GCS upload instead, so a transfer
+    holds about two chunks no matter how large the file is.
+
+    A failed download or streamed transfer is retried from scratch up to `attempts`
+    times (an abandoned resumable upload leaves no partial object behind).
+
+    Content already in the bucket is stored once (see `CloudStorage.finish_upload`);
+    when the source reports an md5 up front (Drive's md5Checksum) the transfer is
+    skipped entirely.
+    """
+    def __init__(self, source, cloud, *, user_prefix="user_files",
+                 download_workers=DOWNLOAD_WORKERS, upload_workers=UPLOAD_WORKERS,
+                 max_in_flight_bytes=MAX_IN_FLIGHT_BYTES, streaming=STREAMING,
+                 chunk_size=CHUNK_SIZE, attempts=ATTEMPTS):
+        self.source = source
+        self.cloud = cloud
+        self.user_prefix = user_prefix
+        self.download_workers = max(1, int(download_workers))
+        self.upload_workers = max(1, int(upload_workers))
+        self.max_in_flight_bytes = max(1, int(max_in_flight_bytes))
+        self.streaming = bool(streaming) and hasattr(source, "stream_file")
+        self.chunk_size = int(chunk_size)
+        self.attempts = max(1, int(attempts))
+
+    def run(self, files, cancel=None, progress=None, done=None):
+        """
+        Migrates every file dict yielded by `files` (e.g. `GoogleDrive.iter_files_with_paths()`).
+        Stops feeding new files once the `cancel` event is set; `progress(**counts)` is
+        called as files finish and `done(file)` after each successful transfer.
+        Returns {"count", "migrated", "deduped", "bytes", "failed": [{"path", "error"}], "cancelled"};
+        "deduped" counts migrated files whose bytes were already stored.
+        """
+        self._progress = progress
+        self._done = done
+        self._budget = ByteBudget(self.max_in_flight_bytes)
+        self._lock = threading.Lock()
+        self._result = {"count": 0, "migrated": 0, "deduped": 0, "bytes": 0, "failed": []}
+
+        self._uploads = ThreadPoolExecutor(self.upload_workers, thread_name_prefix="migrate-up")
+        downloads = ThreadPoolExecutor(self.download_workers, thread_name_prefix="migrate-down")
+        try:
+            for file in files:
+                if cancel is not None and cancel.is_set():
+                    break
+                cost = 2 * self.chunk_size if self.streaming else self._estimate(file)
+                self._budget.acquire(cost)
+                with self._lock:
+                    self._result["count"] += 1
+                downloads.submit(self._stream if self.streaming else self._download, file, cost)
+        finally:
+            # downloads enqueue their uploads, so drain them first
+            downloads.shutdown(wait=True)
+            self._uploads.shutdown(wait=True)
+            dedup = getattr(self.cloud, "dedup", None)
+            if dedup is not None:
+                dedup.flush()
+
+        result = self._result
+        result["cancelled"] = cancel is not None and cancel.is_set()
+        print(f"Successfully migrated {result['migrated']}/{result['count']} files")
+        return result
+
+    def _estimate(self, file):
+        try:
+            size = int(file.get('size'))
+        except (TypeError, ValueError):
+            size = UNKNOWN_SIZE_ESTIMATE
+        return max(size, MIN_CHARGE)
+
+    def _retrying(self, fn, file):
+        """Runs `fn()` up to `self.attempts` times, backing off between tries."""
+        for attempt in range(self.attempts):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == self.attempts - 1:
+                    raise
+                print(f"Retrying {file.get('name', 'unknown')} after: {e}")
+                time.sleep(min(10.0, 0.5 * 2 ** attempt))
+
+    def _known(self, file, cost):
+        """Stores `file` without a transfer if its md5 is known and already in the bucket."""
+        md5 = md5_from_hex(file.get('md5Checksum'))
+        if not md5 or not hasattr(self.cloud, "store_known"):
+            return False
+        try:
+            if not self.cloud.store_known(file, self.user_prefix, md5):
+                return False
+        except Exception as e:
+            print(f"Dedup lookup failed for {file.get('name', 'unknown')}: {e}")
+            return False
+        with self._lock:
+            self._result["migrated"] += 1
+            self._result["deduped"] += 1
+        self._budget.release(cost)
+        self._succeeded(file)
+        return True
+
+    def _download(self, file, cost):
+        if self._known(file, cost):
+            return
+        try:
+            self._retrying(lambda: self.source._load_file(file), file)
+            actual = file['stream'].getbuffer().nbytes
+            if actual > cost:
+                self._budget.charge(actual - cost)
+                cost = actual
+        except Exception as e:
+            self._fail(file, e, cost)
+            return
+        self._uploads.submit(self._upload, file, cost)
+
+    def _upload(self, file, cost):
+        try:
+            self.cloud.upload_file(file, self.user_prefix)
+            with self._lock:
+                self._result["migrated"] += 1
+                self._result["bytes"] += file['stream'].getbuffer().nbytes
+            self._succeeded(file)
+        except Exception as e:
+            self._fail(file, e, 0)
+        finally:
+            file.pop('stream').close()
+            self._budget.release(cost)
+
+    def _stream(self, file, cost):
+        if self._known(file, cost):
+            return
+
+        def transfer():
+            writer, _ = self.cloud.open_upload_stream(
+                file,
+                self.user_prefix,
+                content_type=self.source.content_type(file),
+                chunk_size=self.chunk_size,
+            )
+            counter = _CountingWriter(writer)
+            self.source.stream_file(file, counter, self.chunk_size)
+            finish = getattr(self.cloud, "finish_upload", None)
+            outcome = finish(writer) if finish else writer.close()
+            return counter.bytes, outcome
+
+        try:
+            sent, outcome = self._retrying(transfer, file)
+            with self._lock:
+                self._result["migrated"] += 1
+                self._result["bytes"] += sent
+                if outcome in ("alias", "unchanged"):
+                    self._result["deduped"] += 1
+            self._succeeded(file)
+        except Exception as e:
+            self._fail(file, e, 0)
+        finally:
+            self._budget.release(cost)
+
+    def _succeeded(self, file):
+        if self._done is not None:
+            self._done(file)
+        self._report()
+
+    def _fail(self, file, error, cost):
+        print(f"Failed to migrate {file.get('name', 'unknown')}: {error}")
+        with self._lock:
+            self._result["failed"].append({"path": file.get('full_path'), "error": str(error)})
+        if cost:
+            self._budget.release(cost)
+        self._report()
 
+    def _report(self):
+        if self._progress is None:
+            return
+        with self._lock:
+            counts = {k: self._result[k] for k in ("count", "migrated", "deduped", "bytes")}
+            counts["failed"] = len(self._result["failed"])
+        self._progress(**counts)
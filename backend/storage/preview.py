@@ -1,12 +1,139 @@
+# http range / conditional-request helpers for /vault/preview
 
-class CloudPreviewer:
-    type_map = {}
-    def __init__(self):
-        pass
-
-if type == 'pdf':
-    pass
-elif type == 'video':
-    pass
-elif type == 'docs':
-    pass
\ No newline at end of file
+import os
+import uuid
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    """Every requested range starts past the end of the object (HTTP 416)."""
+
+
+def parse_range(header, size):
+    """
+    Parses a `Range: bytes=...` header against an object of `size` bytes.
+    Returns a sorted, merged list of inclusive (start, end) pairs, or None when the
+    header should be ignored (malformed, not bytes, too many ranges) and the whole
+    object served. Raises RangeNotSatisfiable if nothing in it overlaps the object.
+    """
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else max(start, size - 1)
+                if start > end:
+                    return None
+            else:
+                suffix = int(last)  # "-500" = the final 500 bytes
+                if suffix == 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+def etag_for(meta):
+    """strong etag for an object version: gcs generation, else md5"""
+    return f'"{meta.get("generation") or meta.get("md5_hash") or ""}"'
+
+
+def last_modified(meta):
+    """`updated` from CloudStorage.stat as a datetime, or None"""
+    try:
+        return datetime.fromisoformat(meta["updated"]) if meta.get("updated") else None
+    except ValueError:
+        return None
+
+
+def http_date(dt):
+    return format_datetime(dt, usegmt=True)
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def if_range_matches(header, etag, modified):
+    """
+    If-Range: honour the Range header only if the client's copy is still current.
+    Accepts either a strong etag or an http date.
+    """
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return header == etag  # weak etags never match for ranges
+    since = parse_http_date(header)
+    return bool(since and modified and int(modified.timestamp()) == int(since.timestamp()))
+
+
+def not_modified(if_none_match, if_modified_since, etag, modified):
+    """
+    True when the client's cached copy is current (answer 304).
+    If-None-Match wins over If-Modified-Since, as in RFC 7232.
+    """
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        # weak comparison: W/"x" matches "x"
+        return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+    since = parse_http_date(if_modified_since)
+    return bool(since and modified and int(modified.timestamp()) <= int(since.timestamp()))
+
+
+def cache_control():
+    """
+    private, revalidate-every-time by default (a 304 costs one cached metadata lookup);
+    KB_PREVIEW_MAX_AGE > 0 opts into letting the client reuse its copy with no request at all.
+    """
+    max_age = int(os.getenv("KB_PREVIEW_MAX_AGE", "0"))
+    return f"private, max-age={max_age}" if max_age > 0 else "private, no-cache"
+
+
+def multipart_byteranges(ranges, size, content_type, read_range):
+    """
+    Builds a multipart/byteranges body for several ranges.
+    `read_range(start, end)` yields the bytes of one inclusive range.
+    Returns (boundary, content_length, chunk generator).
+    """
+    boundary = uuid.uuid4().hex
+    heads = [
+        (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+        for start, end in ranges
+    ]
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(h) for h in heads) + sum(end - start + 1 for start, end in ranges) + len(tail)
+
+    def generate():
+        for head, (start, end) in zip(heads, ranges):
+            yield head
+            yield from read_range(start, end)
+        yield tail
+
+    return boundary, length, generate()
@@ -0,0 +1,26 @@
+import functools
+import os
+import threading
+
+
+def state_path(*parts):
+    """A path under the local state directory (KB_STATE_DIR, default ./kb_state)."""
+    return os.path.join(os.getenv("KB_STATE_DIR", "kb_state"), *parts)
+
+
+def shared(factory):
+    """
+    Decorator for process-wide instances: the decorated function runs once, on first
+    call (under a lock, so concurrent first calls agree), and every call returns its result.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def get():
+        with lock:
+            if not instance:
+                instance.append(factory())
+            return instance[0]
+
+    return get
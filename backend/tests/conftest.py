@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# the backend imports its packages top-level (`from storage.cloud import ...`), as server.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def cloud(monkeypatch):
+    """a CloudStorage over an in-memory bucket (tests/fake_gcs.py) with its own caches and dedup index"""
+    from fake_gcs import FakeClient
+    from storage import cloud as cloud_module
+    from storage.cache import FolderHashes, TTLCache
+    from storage.dedup import DedupIndex
+
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "unused.json")
+    monkeypatch.setattr(cloud_module.storage, "Client", FakeClient)
+    store = cloud_module.CloudStorage(cache=TTLCache(), dedup=DedupIndex(path=None))
+    store.hashes = FolderHashes()
+    return store
@@ -0,0 +1,226 @@
+# in-memory stand-in for the parts of google.cloud.storage that CloudStorage uses
+
+import base64
+import hashlib
+import io
+import itertools
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+_generations = itertools.count(1)
+
+
+class _Object:
+    def __init__(self, data, content_type, metadata):
+        self.data = data
+        self.content_type = content_type
+        self.metadata = dict(metadata or {})
+        self.generation = next(_generations)
+
+    @property
+    def md5_hash(self):
+        return base64.b64encode(hashlib.md5(self.data).digest()).decode()
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.reason = ""
+
+    def json(self):
+        return {"error": {"message": "fake"}}
+
+
+class FakeBlob:
+    crc32c = None
+    etag = "etag"
+    updated = None
+
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self.generation = None
+        self._object = None
+
+    @property
+    def size(self):
+        return len(self._object.data)
+
+    @property
+    def content_type(self):
+        return self._object.content_type
+
+    @property
+    def md5_hash(self):
+        return self._object.md5_hash if self._object else None
+
+    @property
+    def public_url(self):
+        return f"https://storage.example/{self.name}"
+
+    def _put(self, data, content_type, if_generation_match):
+        client = self.bucket.client
+        if client.fail_uploads:
+            client.fail_uploads -= 1
+            raise RuntimeError("upload failed")
+        current = self.bucket.objects.get(self.name)
+        if if_generation_match is not None:
+            if if_generation_match == 0 and current is not None:
+                raise PreconditionFailed(self.name)
+            if if_generation_match and (current is None or current.generation != if_generation_match):
+                raise PreconditionFailed(self.name)
+        obj = _Object(data, content_type, self.metadata)
+        self.bucket.objects[self.name] = obj
+        self.generation = obj.generation
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        self._put(data.encode() if isinstance(data, str) else data, content_type, if_generation_match)
+
+    def upload_from_file(self, f, content_type=None, if_generation_match=None):
+        self._put(f.read(), content_type, if_generation_match)
+
+    def reload(self):
+        obj = self.bucket.objects.get(self.name)
+        if obj is None:
+            raise NotFound(self.name)
+        self._object = obj
+        self.metadata = dict(obj.metadata) or None
+        self.generation = obj.generation
+
+    def patch(self):
+        obj = self.bucket.objects.get(self.name)
+        if obj is None:
+            return self.bucket.client.respond(404, NotFound(self.name))
+        obj.metadata = dict(self.metadata or {})
+        self.bucket.client.respond(200)
+
+    def delete(self):
+        if self.bucket.objects.pop(self.name, None) is None:
+            return self.bucket.client.respond(404, NotFound(self.name))
+        self.bucket.client.respond(204)
+
+    def make_public(self):
+        self.bucket.public.add(self.name)
+
+    def open(self, mode, **kwargs):
+        if mode == "rb":
+            return io.BytesIO(self.bucket.objects[self.name].data)
+        blob = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                if not self.closed:
+                    blob._put(self.getvalue(), kwargs.get("content_type"), kwargs.get("if_generation_match"))
+                super().close()
+
+        return Writer()
+
+    def download_as_bytes(self, start=0, end=None):
+        data = self.bucket.objects[self.name].data
+        return data[start:None if end is None else end + 1]
+
+
+class FakeBucket:
+    def __init__(self, client):
+        self.client = client
+        self.objects = {}
+        self.public = set()
+
+    def blob(self, name, generation=None):
+        return FakeBlob(self, name, generation)
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        source = self.objects.get(blob.name)
+        if source is None:
+            return self.client.respond(404, NotFound(blob.name))
+        self.objects[new_name] = _Object(source.data, source.content_type, source.metadata)
+        self.client.respond(200)
+        return FakeBlob(self, new_name)
+
+    # test helpers
+    def put(self, name, data, metadata=None, content_type="application/pdf"):
+        self.objects[name] = _Object(data, content_type, metadata)
+
+    def data(self, name):
+        return self.objects[name].data
+
+    def alias_of(self, name):
+        return self.objects[name].metadata.get("kb-alias-of")
+
+
+class _Listed:
+    def __init__(self, name, obj):
+        self.name = name
+        self.size = len(obj.data)
+        self.content_type = obj.content_type
+        self.metadata = dict(obj.metadata) or None
+        self.generation = obj.generation
+        self.md5_hash = obj.md5_hash
+        self.crc32c = None
+        self.updated = None
+
+
+class _Page(list):
+    prefixes = ()
+
+
+class _Listing:
+    def __init__(self, items, prefixes):
+        self.items = items
+        self.prefixes = prefixes
+
+    def __iter__(self):
+        return iter(self.items)
+
+    @property
+    def pages(self):
+        page = _Page(self.items)
+        page.prefixes = self.prefixes
+        return [page]
+
+
+class _Batch:
+    def __init__(self, client):
+        self.client = client
+        self._responses = []
+
+    def __enter__(self):
+        self.client.batch_responses = self._responses
+        return self
+
+    def __exit__(self, *exc):
+        self.client.batch_responses = None
+
+
+class FakeClient:
+    def __init__(self, *args, **kwargs):
+        self.batch_responses = None
+        self.fail_uploads = 0  # how many of the next uploads raise
+
+    def bucket(self, name):
+        self.the_bucket = FakeBucket(self)
+        return self.the_bucket
+
+    def batch(self, raise_exception=True):
+        return _Batch(self)
+
+    def respond(self, status, error=None):
+        """outside a batch a failed call raises; inside one it is recorded as that call's response"""
+        if self.batch_responses is not None:
+            self.batch_responses.append(_Response(status))
+        elif error is not None:
+            raise error
+
+    def list_blobs(self, bucket, prefix=None, delimiter=None, fields=None):
+        prefix = prefix or ""
+        items, prefixes = [], set()
+        for name, obj in sorted(bucket.objects.items()):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter)[0] + delimiter)
+                continue
+            items.append(_Listed(name, obj))
+        return _Listing(items, sorted(prefixes))
@@ -0,0 +1,75 @@
+import pytest
+
+from services import canvas_client
+from services.canvas_client import RateLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(canvas_client, "time", clock)
+    return clock
+
+
+def _waited(clock, limiter):
+    del clock.sleeps[:]
+    reserved = limiter.acquire()
+    return reserved, sum(clock.sleeps)
+
+
+def test_burst_is_spent_without_waiting(clock):
+    limiter = RateLimiter(rate=10.0, burst=2.0)
+    assert _waited(clock, limiter) == (1.0, 0)
+    assert _waited(clock, limiter) == (1.0, 0)
+    reserved, waited = _waited(clock, limiter)
+    assert waited == pytest.approx(0.1)  # one cost unit at 10 units/s
+
+
+def test_reported_cost_and_remaining_set_the_wait(clock):
+    limiter = RateLimiter(rate=10.0, burst=2.0, min_rate=1.0, max_rate=10.0, comfortable_remaining=100.0)
+    limiter.acquire()
+    reserved = limiter.acquire()
+    # the request really cost 3 units (2 more than reserved) and Canvas has half the comfortable quota left
+    limiter.observe({"X-Request-Cost": "3", "X-Rate-Limit-Remaining": "50"}, reserved)
+    assert limiter.cost == pytest.approx(1.4)
+    assert limiter.rate == pytest.approx(1.0 + 9.0 * 0.25)
+    reserved, waited = _waited(clock, limiter)
+    # the bucket sits at -2 units and the next request is estimated at 1.4
+    assert reserved == pytest.approx(1.4)
+    assert waited == pytest.approx(3.4 / 3.25)
+
+
+def test_plenty_remaining_runs_at_max_rate(clock):
+    limiter = RateLimiter(rate=10.0, burst=1.0, min_rate=1.0, max_rate=20.0, comfortable_remaining=100.0)
+    limiter.observe({"X-Rate-Limit-Remaining": "700"})
+    assert limiter.rate == 20.0
+    limiter.acquire()
+    assert _waited(clock, limiter)[1] == pytest.approx(1.0 / 20.0)
+
+
+def test_throttled_drops_to_min_rate_and_empties_the_bucket(clock):
+    limiter = RateLimiter(rate=10.0, burst=5.0, min_rate=0.5)
+    limiter.throttled()
+    assert _waited(clock, limiter)[1] == pytest.approx(1.0 / 0.5)
+
+
+def test_costly_requests_never_reserve_more_than_the_bucket(clock):
+    limiter = RateLimiter(rate=10.0, burst=2.0)
+    for _ in range(20):
+        limiter.observe({"X-Request-Cost": "50"}, 0.0)
+        clock.now += 100.0
+    reserved, waited = _waited(clock, limiter)
+    assert reserved == 2.0 and waited == 0
@@ -0,0 +1,106 @@
+import io
+
+import pytest
+
+ALIAS = "kb-alias-of"
+
+
+def _upload(cloud, path, data):
+    folder = path.rsplit("/", 1)[0]
+    cloud.upload_file({"stream": io.BytesIO(data), "mimeType": "application/pdf",
+                       "full_path": path, "folder_path": folder}, "u")
+
+
+@pytest.fixture
+def copies(cloud):
+    """u/f/A.pdf holds b"same"; u/f/B.pdf and u/other/C.pdf are aliases of it"""
+    for path in ("/f/A.pdf", "/f/B.pdf", "/other/C.pdf"):
+        _upload(cloud, path, b"same")
+    return cloud
+
+
+def _read(cloud, path):
+    fh, _, _ = cloud.open_stream(path)
+    return fh.read()
+
+
+def test_identical_uploads_become_aliases(copies):
+    bucket = copies.bucket
+    assert bucket.data("u/f/A.pdf") == b"same"
+    assert bucket.data("u/f/B.pdf") == b""
+    assert bucket.alias_of("u/f/B.pdf") == bucket.alias_of("u/other/C.pdf") == "u/f/A.pdf"
+    assert _read(copies, "u/other/C.pdf") == b"same"
+
+
+def test_deleting_the_canonical_promotes_and_repoints(copies):
+    copies.delete_file("u/f/A.pdf")
+    bucket = copies.bucket
+    assert bucket.data("u/f/B.pdf") == b"same"
+    assert bucket.alias_of("u/f/B.pdf") is None
+    assert bucket.alias_of("u/other/C.pdf") == "u/f/B.pdf"
+    assert copies.dedup.lookup(copies.dedup.md5_of("u/f/B.pdf"))["canonical"] == "u/f/B.pdf"
+    assert _read(copies, "u/other/C.pdf") == b"same"
+
+
+def test_deleting_an_alias_leaves_the_canonical(copies):
+    copies.delete_file("u/f/B.pdf")
+    entry = copies.dedup.lookup(copies.dedup.md5_of("u/f/A.pdf"))
+    assert entry["canonical"] == "u/f/A.pdf"
+    assert entry["aliases"] == ["u/other/C.pdf"]
+    assert copies.bucket.data("u/f/A.pdf") == b"same"
+
+
+def test_deleting_a_canonical_with_an_alias_in_one_call(copies):
+    # A and its alias B go together: C must end up canonical, not pointing at the deleted B
+    results = copies.delete_folder("u/f/")
+    assert all(r["ok"] for r in results)
+    bucket = copies.bucket
+    assert "u/f/A.pdf" not in bucket.objects and "u/f/B.pdf" not in bucket.objects
+    assert bucket.data("u/other/C.pdf") == b"same"
+    assert bucket.alias_of("u/other/C.pdf") is None
+    assert copies.stat("u/other/C.pdf")["path"] == "u/other/C.pdf"
+    assert copies.dedup.lookup(copies.dedup.md5_of("u/other/C.pdf"))["aliases"] == []
+
+
+def test_deleting_every_copy_in_one_call_drops_the_entry(copies):
+    md5 = copies.dedup.md5_of("u/f/A.pdf")
+    copies.delete_files(["u/f/A.pdf", "u/f/B.pdf", "u/other/C.pdf"])
+    assert copies.dedup.lookup(md5) is None
+    assert not any(name.endswith(".pdf") for name in copies.bucket.objects)
+
+
+def test_moving_a_canonical_repoints_its_aliases(copies):
+    copies.move_files([("u/f/A.pdf", "u/g/A.pdf")])
+    assert copies.bucket.alias_of("u/f/B.pdf") == "u/g/A.pdf"
+    assert copies.bucket.alias_of("u/other/C.pdf") == "u/g/A.pdf"
+    assert _read(copies, "u/f/B.pdf") == b"same"
+
+
+def test_overwriting_the_canonical_hands_its_bytes_to_an_alias(copies):
+    _upload(copies, "/f/A.pdf", b"new content")
+    bucket = copies.bucket
+    assert bucket.data("u/f/A.pdf") == b"new content"
+    assert bucket.data("u/f/B.pdf") == b"same"
+    assert bucket.alias_of("u/other/C.pdf") == "u/f/B.pdf"
+    assert _read(copies, "u/other/C.pdf") == b"same"
+
+
+def test_failed_overwrite_leaves_index_and_aliases_alone(copies):
+    bucket = copies.bucket
+    md5 = copies.dedup.md5_of("u/f/A.pdf")
+    bucket.client.fail_uploads = 1
+    with pytest.raises(RuntimeError):
+        _upload(copies, "/f/A.pdf", b"new content")
+
+    entry = copies.dedup.lookup(md5)
+    assert entry["canonical"] == "u/f/A.pdf"
+    assert entry["aliases"] == ["u/f/B.pdf", "u/other/C.pdf"]
+    assert bucket.data("u/f/A.pdf") == b"same"
+    assert bucket.alias_of("u/f/B.pdf") == bucket.alias_of("u/other/C.pdf") == "u/f/A.pdf"
+    assert _read(copies, "u/f/B.pdf") == b"same"
+
+
+def test_make_public_publishes_the_canonical(copies):
+    url = copies.make_public("u/other/C.pdf")
+    assert copies.bucket.public == {"u/f/A.pdf"}
+    assert url.endswith("u/f/A.pdf")
@@ -0,0 +1,46 @@
+import io
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+
+def _file(path, data):
+    return {"stream": io.BytesIO(data), "mimeType": "application/pdf",
+            "full_path": path, "folder_path": path.rsplit("/", 1)[0]}
+
+
+def test_unchanged_upload_writes_nothing(cloud):
+    cloud.upload_file(_file("/f/A.pdf", b"one"), "u")
+    generation = cloud.bucket.objects["u/f/A.pdf"].generation
+    cloud.upload_file(_file("/f/A.pdf", b"one"), "u")
+    assert cloud.bucket.objects["u/f/A.pdf"].generation == generation
+
+
+def test_overwrite_is_conditional_on_the_generation_seen(cloud):
+    cloud.upload_file(_file("/f/A.pdf", b"one"), "u")
+    # another writer replaces the object behind the recorded generation
+    cloud.bucket.put("u/f/A.pdf", b"theirs")
+    with pytest.raises(PreconditionFailed):
+        cloud.upload_file(_file("/f/A.pdf", b"mine"), "u")
+    assert cloud.bucket.data("u/f/A.pdf") == b"theirs"
+    # the stale generation was forgotten, so a retry sees theirs and overwrites it
+    cloud.upload_file(_file("/f/A.pdf", b"mine"), "u")
+    assert cloud.bucket.data("u/f/A.pdf") == b"mine"
+
+
+def test_stream_create_conflicts_with_a_concurrent_create(cloud):
+    writer, path = cloud.open_upload_stream(_file("/f/A.pdf", b""), "u")
+    writer.write(b"mine")
+    cloud.bucket.put(path, b"theirs")
+    with pytest.raises(PreconditionFailed):
+        cloud.finish_upload(writer)
+    assert cloud.bucket.data(path) == b"theirs"
+
+
+def test_stream_finish_skips_content_already_stored(cloud):
+    cloud.upload_file(_file("/f/A.pdf", b"same"), "u")
+    writer, path = cloud.open_upload_stream(_file("/g/B.pdf", b""), "u")
+    writer.write(b"same")
+    assert cloud.finish_upload(writer) == "alias"
+    assert cloud.bucket.data(path) == b""
+    assert cloud.bucket.alias_of(path) == "u/f/A.pdf"
@@ -0,0 +1,39 @@
+from services.context_budget import allocate, assemble, count_tokens
+
+
+def test_allocate_splits_by_weight():
+    assert allocate([1000, 1000], [1.0, 3.0], 400) == [100, 300]
+
+
+def test_allocate_gives_capped_leftovers_to_the_rest():
+    shares = allocate([50, 1000, 1000], [1.0, 1.0, 1.0], 650)
+    assert shares[0] == 50
+    assert shares[1] == shares[2] == 300
+
+
+def test_allocate_floor_never_exceeds_need():
+    assert allocate([10, 500], [1.0, 1.0], 100, floor=64) == [10, 90]
+
+
+def test_assemble_fits_the_budget():
+    documents = [{"label": f"doc{i}.pdf", "text": " ".join(f"word{i}_{j}" for j in range(2000))}
+                 for i in range(4)]
+    context, stats = assemble(documents, max_tokens=800)
+    assert count_tokens(context) <= 800
+    assert stats["documents"] == 4
+    assert stats["truncated"] == 4
+    assert context.startswith("[doc0.pdf]\n")
+
+
+def test_assemble_drops_near_duplicates_and_running_headers():
+    shared = "the mitochondria is the powerhouse of the cell and makes most of its energy"
+    documents = [
+        {"label": "a.pdf", "text": f"{shared}\nonly in a: alpha beta gamma delta epsilon"},
+        {"label": "b.pdf", "text": f"{shared}\nonly in b: zeta eta theta iota kappa"},
+        {"label": "c.pdf", "text": "Header\nfirst\nHeader\nsecond\nHeader\nthird"},
+    ]
+    context, stats = assemble(documents, max_tokens=10000)
+    assert context.count("mitochondria") == 1
+    assert stats["duplicates"] == 1
+    assert context.count("Header") == 1
+    assert "only in b" in context
@@ -0,0 +1,41 @@
+from storage.dedup import DedupIndex
+
+
+def _index():
+    index = DedupIndex(path=None)
+    index.add_canonical("m", "a.pdf", size=5, content_type="application/pdf")
+    index.add_alias("m", "b.pdf")
+    index.add_alias("m", "c.pdf")
+    return index
+
+
+def test_alias_lookup():
+    index = _index()
+    assert index.lookup("m")["canonical"] == "a.pdf"
+    assert index.lookup("m")["aliases"] == ["b.pdf", "c.pdf"]
+    assert index.md5_of("c.pdf") == "m"
+    assert index.stats()["bytes_saved"] == 10
+
+
+def test_deleting_a_canonical_promotes_its_first_alias():
+    index = _index()
+    md5, entry = index.release("a.pdf")
+    assert (md5, entry["aliases"]) == ("m", ["b.pdf", "c.pdf"])
+
+    assert index.promote(md5, "b.pdf") == ["c.pdf"]
+    assert index.lookup("m")["canonical"] == "b.pdf"
+    assert index.md5_of("a.pdf") is None
+    assert index.md5_of("b.pdf") == "m"
+
+
+def test_releasing_an_alias_just_forgets_it():
+    index = _index()
+    assert index.release("c.pdf") is None
+    assert index.lookup("m")["aliases"] == ["b.pdf"]
+
+
+def test_releasing_a_lone_canonical_drops_the_entry():
+    index = DedupIndex(path=None)
+    index.add_canonical("m", "a.pdf")
+    assert index.release("a.pdf") is None
+    assert index.lookup("m") is None
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+import pytest
+
+from storage.disk_cache import DiskCache, iter_file_range
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / "content")
+
+
+def _put(cache, path, data, generation=1):
+    for _ in cache.tee(iter([data[:3], data[3:]]), path, generation, len(data)):
+        pass
+
+
+def _read(cache, path, generation=1):
+    f = cache.open(path, generation)
+    if f is None:
+        return None
+    with f:
+        return f.read()
+
+
+def test_tee_commits_a_complete_stream(root):
+    cache = DiskCache(root, max_bytes=100)
+    assert b"".join(cache.tee(iter([b"abc", b"def"]), "a.pdf", 1, 6)) == b"abcdef"
+    assert _read(cache, "a.pdf") == b"abcdef"
+    assert _read(cache, "a.pdf", generation=2) is None
+    assert cache.stats()["bytes"] == 6
+
+
+def test_tee_drops_a_stream_of_the_wrong_size(root):
+    cache = DiskCache(root, max_bytes=100)
+    assert b"".join(cache.tee(iter([b"abc"]), "a.pdf", 1, 6)) == b"abc"
+    assert _read(cache, "a.pdf") is None
+    assert cache.stats()["bytes"] == 0
+    assert not [f for _, _, files in os.walk(root) for f in files]
+
+
+def test_tee_abandoned_midway_leaves_nothing(root):
+    cache = DiskCache(root, max_bytes=100)
+    body = cache.tee(iter([b"abc", b"def"]), "a.pdf", 1, 6)
+    next(body)
+    body.close()  # the client went away
+    assert _read(cache, "a.pdf") is None
+    assert not [f for _, _, files in os.walk(root) for f in files]
+
+
+def test_oversized_objects_pass_through_uncached(root):
+    cache = DiskCache(root, max_bytes=100, max_object_bytes=4)
+    assert b"".join(cache.tee(iter([b"abcdef"]), "a.pdf", 1, 6)) == b"abcdef"
+    assert _read(cache, "a.pdf") is None
+
+
+def test_least_recently_used_is_evicted(root):
+    cache = DiskCache(root, max_bytes=12)
+    _put(cache, "a", b"aaaaaa")
+    _put(cache, "b", b"bbbbbb")
+    assert _read(cache, "a") == b"aaaaaa"  # now b is the least recently used
+    _put(cache, "c", b"cccccc")
+    assert _read(cache, "b") is None
+    assert _read(cache, "a") == b"aaaaaa" and _read(cache, "c") == b"cccccc"
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] == 12
+
+
+def test_open_handle_survives_eviction(root):
+    cache = DiskCache(root, max_bytes=6)
+    _put(cache, "a", b"aaaaaa")
+    f = cache.open("a", 1)
+    _put(cache, "b", b"bbbbbb")
+    assert _read(cache, "a") is None
+    with f:
+        assert f.read() == b"aaaaaa"
+
+
+def test_restart_recovers_entries_in_access_order(root):
+    cache = DiskCache(root, max_bytes=12)
+    _put(cache, "a", b"aaaaaa")
+    _put(cache, "b", b"bbbbbb")
+    # b was read longer ago than a
+    os.utime(cache._file(cache._name("b", 1)), (time.time() - 60, time.time() - 60))
+    # a write that was interrupted by the restart
+    with open(os.path.join(root, ".part-crashed"), "wb") as f:
+        f.write(b"junk")
+
+    restarted = DiskCache(root, max_bytes=12)
+    assert restarted.stats()["entries"] == 2 and restarted.stats()["bytes"] == 12
+    assert not os.path.exists(os.path.join(root, ".part-crashed"))
+    _put(restarted, "c", b"cccccc")
+    assert _read(restarted, "b") is None
+    assert _read(restarted, "a") == b"aaaaaa"
+
+
+def test_iter_file_range_bounds(root):
+    cache = DiskCache(root, max_bytes=100)
+    data = bytes(range(10))
+    _put(cache, "a", data)
+    with cache.open("a", 1) as f:
+        assert b"".join(iter_file_range(f, 0, 9, chunk=3)) == data
+        assert b"".join(iter_file_range(f, 2, 2, chunk=3)) == data[2:3]
+        assert b"".join(iter_file_range(f, 4, 9, chunk=4)) == data[4:]
+        assert [len(c) for c in iter_file_range(f, 1, 8, chunk=3)] == [3, 3, 2]
+
+
+def _reader(size):
+    """a whole-object read that reports when a fill has pulled it"""
+    done = threading.Event()
+
+    def read():
+        yield b"x" * size
+        done.set()
+
+    return done, read
+
+
+def test_ranged_miss_fills_small_objects_at_once(root):
+    cache = DiskCache(root, max_bytes=100, ranged_fill_bytes=10, ranged_fill_misses=3)
+    done, read = _reader(8)
+    assert cache.ranged_miss("a", 1, 8, read)
+    assert done.wait(5)
+
+
+def test_ranged_miss_fills_big_objects_only_when_they_keep_missing(root):
+    cache = DiskCache(root, max_bytes=100, ranged_fill_bytes=10, ranged_fill_misses=3)
+    done, read = _reader(20)
+    assert not cache.ranged_miss("a", 1, 20, read)
+    assert not cache.ranged_miss("a", 1, 20, read)
+    assert cache.ranged_miss("a", 1, 20, read)
+    assert done.wait(5)
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+
+import pytest
+
+from services.drive_sync import FOLDER_MIME, DriveSync
+from services.local_storage import LocalStorage
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"http {status}")
+        self.resp = type("Resp", (), {"status": status})()
+
+
+class FakeDrive:
+    """my drive as {id: metadata}, with a Changes API log of every edit"""
+    ROOT = "root0"
+
+    def __init__(self):
+        self.items = {}
+        self.log = []
+        self.unavailable = set()  # ids whose metadata fetch answers 503
+        self.data = {}
+
+    def add(self, file_id, name, parent=ROOT, data=None):
+        item = {"id": file_id, "name": name, "parents": [parent], "trashed": False}
+        if data is None:
+            item["mimeType"] = FOLDER_MIME
+        else:
+            self.data[file_id] = data
+            item.update(mimeType="application/pdf", size=str(len(data)),
+                        md5Checksum=hashlib.md5(data).hexdigest(), modifiedTime="t0")
+        self.items[file_id] = item
+        self.log.append(file_id)
+
+    def edit(self, file_id, **fields):
+        self.items[file_id].update(fields)
+        self.log.append(file_id)
+
+    # GoogleDrive's interface
+    def get_start_page_token(self):
+        return str(len(self.log))
+
+    def list_changes(self, page_token):
+        ids = dict.fromkeys(self.log[int(page_token):])
+        return [{"fileId": i, "removed": False, "file": None} for i in ids], str(len(self.log))
+
+    def get_file_metadata(self, file_id):
+        if file_id == "root":
+            return {"id": self.ROOT}
+        if file_id in self.unavailable:
+            raise HttpError(503)
+        if file_id not in self.items:
+            raise HttpError(404)
+        return dict(self.items[file_id])
+
+    def iter_files_with_paths(self, root_folder_id, folders=None):
+        for item in list(self.items.values()):
+            if item["trashed"] or item["parents"][0] != root_folder_id:
+                continue
+            if item["mimeType"] == FOLDER_MIME:
+                sub = {}
+                if folders is not None:
+                    folders[item["id"]] = "/" + item["name"]
+                for file in self.iter_files_with_paths(item["id"], sub):
+                    file["full_path"] = "/" + item["name"] + file["full_path"]
+                    file["folder_path"] = "/" + item["name"] + file["folder_path"]
+                    yield file
+                if folders is not None:
+                    folders.update({k: "/" + item["name"] + v for k, v in sub.items()})
+            else:
+                yield {**item, "full_path": "/" + item["name"], "folder_path": ""}
+
+    def content_type(self, file):
+        return file["mimeType"]
+
+    def stream_file(self, file, fd, chunksize):
+        fd.write(self.data[file["id"]])
+
+
+@pytest.fixture
+def drive():
+    drive = FakeDrive()
+    drive.add("docs", "Docs")
+    drive.add("a", "a.pdf", "docs", b"alpha")
+    drive.add("b", "b.pdf", data=b"beta")
+    return drive
+
+
+@pytest.fixture
+def sync(drive, cloud, tmp_path):
+    sync = DriveSync(drive, cloud, store=LocalStorage(str(tmp_path)), user_prefix="u")
+    result = sync.run()
+    assert result["mode"] == "full" and result["migrated"] == 2
+    return sync
+
+
+def _objects(cloud):
+    return {name: obj.data for name, obj in cloud.bucket.objects.items() if not name.endswith("/")}
+
+
+def test_incremental_run_only_transfers_changes(sync, drive, cloud):
+    drive.add("c", "c.pdf", "docs", b"gamma")
+    result = sync.run()
+    assert result["mode"] == "incremental"
+    assert result["changes"] == 1 and result["migrated"] == 1
+    assert _objects(cloud)["u/Docs/c.pdf"] == b"gamma"
+    assert sync.run()["changes"] == 0
+
+
+def test_renaming_a_folder_moves_its_files(sync, drive, cloud):
+    drive.edit("docs", name="Papers")
+    result = sync.run()
+    assert result["moved"] == 1 and result["migrated"] == 0
+    assert _objects(cloud) == {"u/Papers/a.pdf": b"alpha", "u/b.pdf": b"beta"}
+
+
+def test_renaming_a_file_moves_it_without_a_transfer(sync, drive, cloud):
+    drive.edit("b", name="renamed.pdf")
+    result = sync.run()
+    assert result["moved"] == 1 and result["migrated"] == 0
+    assert "u/b.pdf" not in _objects(cloud)
+    assert _objects(cloud)["u/renamed.pdf"] == b"beta"
+
+
+def test_trashing_a_folder_deletes_its_files(sync, drive, cloud):
+    drive.edit("docs", trashed=True)
+    result = sync.run()
+    assert result["deleted"] == 1
+    assert _objects(cloud) == {"u/b.pdf": b"beta"}
+
+
+def test_unavailable_metadata_is_deferred_not_deleted(sync, drive, cloud):
+    drive.edit("b", name="renamed.pdf")
+    drive.unavailable.add("b")
+    result = sync.run()
+    assert result["deferred"] == 1 and result["deleted"] == 0
+    assert _objects(cloud)["u/b.pdf"] == b"beta"
+    # the cursor moved on, but the deferred file is retried once drive answers again
+    drive.unavailable.clear()
+    result = sync.run()
+    assert result["changes"] == 0 and result["moved"] == 1
+    assert _objects(cloud)["u/renamed.pdf"] == b"beta"
+
+
+def test_cancelled_run_keeps_the_cursor(sync, drive, cloud):
+    drive.add("c", "c.pdf", data=b"gamma")
+    cancel = threading.Event()
+    cancel.set()
+    result = sync.run(cancel=cancel)
+    assert result["cancelled"] and result["migrated"] == 0
+    assert "u/c.pdf" not in _objects(cloud)
+    # the next run replays the same change
+    result = sync.run()
+    assert result["changes"] == 1 and result["migrated"] == 1
+    assert _objects(cloud)["u/c.pdf"] == b"gamma"
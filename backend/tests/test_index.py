@@ -0,0 +1,31 @@
+from storage.index import ListingIndex
+
+
+def test_listing_and_child_count():
+    index = ListingIndex()
+    index.rebuild(["a/x.pdf", "a/b/y.pdf", "a/c/", "top.pdf"])
+    assert index.ready
+    assert index.listing("") == {"files": ["top.pdf"], "folders": ["a/"]}
+    assert index.listing("a/") == {"files": ["x.pdf"], "folders": ["b/", "c/"]}
+    assert index.child_count("a/") == 3
+    assert index.listing("missing/") == {"files": [], "folders": []}
+
+
+def test_change_events_update_the_tree():
+    index = ListingIndex()
+    index.rebuild([])
+    index.on_change("upload", "docs/new.pdf")
+    assert index.listing("docs/")["files"] == ["new.pdf"]
+    index.on_change("delete", "docs/new.pdf")
+    assert index.listing("") == {"files": [], "folders": []}
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "listing.json")
+    index = ListingIndex(path)
+    index.rebuild(["a/x.pdf", "a/c/"])
+    index.save_snapshot()
+
+    restored = ListingIndex(path)
+    assert restored.load_snapshot()
+    assert sorted(restored.names()) == ["a/c/", "a/x.pdf"]
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from services import get_context
+from services.summary_cache import SummaryCache
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    """iter_context over a.pdf, b.pdf, c.pdf with identical content; summarizing a.pdf fails"""
+    paths = ["a.pdf", "b.pdf", "c.pdf"]
+    listed = threading.Event()
+    summarized = []
+
+    def summarize_path(client, cloud, path):
+        summarized.append(path)
+        if path == "a.pdf":
+            if build.hold:
+                listed.wait(5)
+                time.sleep(build.hold)
+            raise RuntimeError("upload failed")
+        return f"summary of {path}"
+
+    def content_of(cloud, path):
+        if path == paths[-1]:
+            listed.set()
+        return "md5:same"
+
+    summaries = SummaryCache(str(tmp_path / "summaries"))
+    monkeypatch.setattr(get_context, "_openai_client", lambda timeout: None)
+    monkeypatch.setattr(get_context, "CloudStorage", lambda: None)
+    monkeypatch.setattr(get_context, "iter_all_paths", lambda cloud, prefix: iter(paths))
+    monkeypatch.setattr(get_context, "_content_of", content_of)
+    monkeypatch.setattr(get_context, "_summarize_path", summarize_path)
+    monkeypatch.setattr(get_context, "shared_summary_cache", lambda: summaries)
+
+    def build(concurrency):
+        events = list(get_context.iter_context(concurrency=concurrency))
+        return events, summarized
+
+    build.hold = 0.0
+    return build
+
+
+def _check(events, summarized):
+    done = events[-1]
+    assert (done["documents"], done["duplicates"], done["failed"]) == (1, 1, 1)
+    [document] = [e for e in events if e["type"] == "document"]
+    [duplicate] = [e for e in events if e["type"] == "duplicate"]
+    assert {document["path"], duplicate["path"]} == {"b.pdf", "c.pdf"}
+    assert duplicate["of"] == document["path"]
+    assert summarized.count("a.pdf") == 1 and len(summarized) == 2
+
+
+def test_a_failed_copy_releases_its_claim(build):
+    # one worker: a.pdf fails before the copies are looked at
+    _check(*build(concurrency=1))
+
+
+def test_copies_waiting_on_a_failed_copy_are_retried(build):
+    # b.pdf and c.pdf are reported as duplicates while a.pdf is still in flight
+    build.hold = 0.2
+    _check(*build(concurrency=3))
@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+
+from services.jobs import Job, JobManager
+from services.local_storage import LocalStorage
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStorage(str(tmp_path))
+
+
+def _blocking():
+    """a job fn that runs until released or cancelled"""
+    started, release = threading.Event(), threading.Event()
+
+    def fn(job):
+        started.set()
+        while not release.is_set() and not job.cancelled:
+            release.wait(0.01)
+        return "done"
+
+    return fn, started, release
+
+
+def test_submit_if_idle_returns_the_active_job(store):
+    jobs = JobManager(workers=2, store=store)
+    fn, started, release = _blocking()
+    first, created = jobs.submit_if_idle("sync", fn)
+    assert created
+    started.wait(5)
+    again, created = jobs.submit_if_idle("sync", fn)
+    assert not created and again is first
+    # other kinds aren't held up
+    assert jobs.submit_if_idle("reindex", lambda job: None)[1]
+    release.set()
+    assert first.wait(5) and first.status == "succeeded" and first.result == "done"
+    assert jobs.submit_if_idle("sync", lambda job: None)[1]
+
+
+def test_concurrent_submit_if_idle_starts_one_job(store):
+    jobs = JobManager(workers=2, store=store)
+    fn, _, release = _blocking()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(jobs.submit_if_idle("sync", fn)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(created for _, created in results) == 1
+    assert len({job.id for job, _ in results}) == 1
+    release.set()
+
+
+def test_cancelling_a_running_job(store):
+    jobs = JobManager(workers=1, store=store)
+    fn, started, _ = _blocking()
+    job = jobs.submit("sync", fn)
+    started.wait(5)
+    jobs.cancel(job.id)
+    assert job.wait(5) and job.status == "cancelled"
+
+
+def test_cancelling_a_queued_job_means_it_never_runs(store):
+    jobs = JobManager(workers=1, store=store)
+    fn, started, release = _blocking()
+    running = jobs.submit("sync", fn)
+    started.wait(5)
+    ran = []
+    queued = jobs.submit("reindex", lambda job: ran.append(job.id))
+    assert jobs.cancel(queued.id).status == "cancelled"
+    release.set()
+    running.wait(5)
+    jobs._pool.shutdown(wait=True)
+    assert ran == [] and queued.status == "cancelled" and queued.started_at is None
+
+
+def test_failures_are_recorded(store):
+    jobs = JobManager(workers=1, store=store)
+
+    def boom(job):
+        raise ValueError("bad input")
+
+    job = jobs.submit("sync", boom)
+    assert job.wait(5) and job.status == "failed"
+    assert job.error == "ValueError: bad input"
+
+
+def test_jobs_survive_a_restart(store):
+    jobs = JobManager(workers=1, store=store)
+    job = jobs.submit("sync", lambda job: job.update(files=3) or {"migrated": 3}, {"full": True})
+    job.wait(5)
+    # a job that was running when the process died
+    crashed = Job("reindex")
+    crashed.status = "running"
+    store.save_json_data(crashed.to_dict(), f"{crashed.id}.json")
+
+    restarted = JobManager(workers=1, store=store)
+    again = restarted.get(job.id)
+    assert again.status == "succeeded" and again.result == {"migrated": 3}
+    assert again.params == {"full": True} and again.progress == {"files": 3}
+    assert restarted.get(crashed.id).status == "interrupted"
+    assert store.load_json_data(f"{crashed.id}.json")["status"] == "interrupted"
+    # an interrupted job doesn't block a new one
+    assert restarted.submit_if_idle("reindex", lambda job: None)[1]
+
+
+def test_only_max_kept_finished_jobs_are_kept(store):
+    jobs = JobManager(workers=1, store=store, max_kept=2)
+    for i in range(4):
+        jobs.submit("sync", lambda job: None).wait(5)
+    jobs._pool.shutdown(wait=True)  # trimming runs just after a job reports done
+    assert len(jobs.list()) == 2
+    assert len(list(store.base_dir.glob("*.json"))) == 2
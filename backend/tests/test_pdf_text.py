@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from fake_pdf import pdf
+from services.pdf_text import PdfTextExtractor
+
+
+def _unopenable():
+    raise AssertionError("cached pages shouldn't open the document")
+
+
+@pytest.fixture
+def extractor(tmp_path):
+    extractor = PdfTextExtractor(workers=1, cache_dir=str(tmp_path / "cache"))
+    yield extractor
+    extractor.close()
+
+
+def test_pages_are_cached_per_version(extractor, tmp_path):
+    doc = pdf(tmp_path / "a.pdf", ["first", "second"])
+    assert [p.strip() for p in extractor.pages(doc, key="a.pdf", version=1)] == ["first", "second"]
+    assert [p.strip() for p in extractor.pages(_unopenable, key="a.pdf", version=1)] == ["first", "second"]
+    assert extractor.stats()["pages_parsed"] == 2 and extractor.stats()["pages_cached"] == 2
+    # a new version replaces the old pages
+    doc = pdf(tmp_path / "a.pdf", ["changed"])
+    assert extractor.extract(doc, key="a.pdf", version=2).strip() == "changed"
+
+
+def test_page_count_parses_no_text(extractor, tmp_path):
+    doc = pdf(tmp_path / "a.pdf", ["one", "two", "three"])
+    assert extractor.page_count(doc, key="a.pdf", version=1) == 3
+    assert extractor.page_count(_unopenable, key="a.pdf", version=1) == 3
+    assert extractor.stats()["pages_parsed"] == 0
+
+
+def test_callable_sources_are_opened_and_closed(extractor, tmp_path):
+    doc = pdf(tmp_path / "a.pdf", ["text"])
+    opened = []
+
+    def source():
+        opened.append(open(doc, "rb"))
+        return opened[-1]
+
+    assert extractor.extract(source, key="a.pdf", version=1).strip() == "text"
+    assert len(opened) == 1 and opened[0].closed
+
+
+def test_cache_is_bounded(tmp_path):
+    extractor = PdfTextExtractor(workers=1, cache_dir=str(tmp_path / "cache"), max_entries=2)
+    doc = pdf(tmp_path / "a.pdf", ["text"])
+    for i, key in enumerate(("old", "middle", "new")):
+        extractor.pages(doc, key=key, version=1)
+        f = extractor.store.base_dir / extractor._file(key)
+        os.utime(f, (1000 + i, 1000 + i))
+    assert extractor.prune() == 1
+    assert not (extractor.store.base_dir / extractor._file("old")).exists()
+    assert extractor.page_count(_unopenable, key="new", version=1) == 1
+
+
+def test_large_documents_are_parsed_in_spawned_workers(tmp_path):
+    texts = [f"page{i}" for i in range(12)]
+    doc = pdf(tmp_path / "a.pdf", texts)
+    extractor = PdfTextExtractor(workers=2, cache_dir=str(tmp_path / "cache"))
+    try:
+        assert [p.strip() for p in extractor.pages(doc)] == texts
+        assert extractor._pool._mp_context.get_start_method() == "spawn"
+    finally:
+        extractor.close()
@@ -0,0 +1,89 @@
+import io
+import threading
+
+from storage.pipe import MigrationPipeline
+
+
+class FakeSource:
+    def content_type(self, file):
+        return file["mimeType"]
+
+    def stream_file(self, file, fd, chunksize):
+        if file["name"] == "broken":
+            raise RuntimeError("download failed")
+        fd.write(b"x" * int(file["size"]))
+
+    def _load_file(self, file):
+        buf = io.BytesIO()
+        self.stream_file(file, buf, 1)
+        buf.seek(0)
+        file["stream"] = buf
+
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class FakeCloud:
+    def __init__(self):
+        self.uploaded = []
+
+    def open_upload_stream(self, file, user_prefix, content_type=None, chunk_size=None):
+        return _Writer(file["full_path"]), file["full_path"]
+
+    def finish_upload(self, writer):
+        self.uploaded.append(writer.path)
+        return "uploaded"
+
+    def upload_file(self, file, user_prefix):
+        self.uploaded.append(file["full_path"])
+
+
+def _files():
+    files = [{"name": f"f{i}.pdf", "size": "100", "mimeType": "application/pdf",
+              "full_path": f"/f{i}.pdf", "folder_path": ""} for i in range(12)]
+    files.append({"name": "broken", "size": "1", "mimeType": "application/pdf",
+                  "full_path": "/broken", "folder_path": ""})
+    return files
+
+
+def _run(streaming):
+    cloud = FakeCloud()
+    done = []
+    pipeline = MigrationPipeline(FakeSource(), cloud, streaming=streaming, attempts=2,
+                                 max_in_flight_bytes=300, download_workers=3, upload_workers=2)
+    result = pipeline.run(iter(_files()), done=done.append)
+    return result, cloud, done
+
+
+def test_streaming_migration_counts_and_failures():
+    result, cloud, done = _run(streaming=True)
+    assert result["count"] == 13
+    assert result["migrated"] == 12
+    assert result["bytes"] == 1200
+    assert [f["path"] for f in result["failed"]] == ["/broken"]
+    assert sorted(cloud.uploaded) == sorted(f"/f{i}.pdf" for i in range(12))
+    assert len(done) == 12
+
+
+def test_buffered_migration_counts_and_failures():
+    result, cloud, _ = _run(streaming=False)
+    assert result["migrated"] == 12
+    assert result["bytes"] == 1200
+    assert len(result["failed"]) == 1
+    assert len(cloud.uploaded) == 12
+
+
+def test_cancel_stops_feeding_files():
+    cancel = threading.Event()
+    cancel.set()
+    result = MigrationPipeline(FakeSource(), FakeCloud()).run(iter(_files()), cancel=cancel)
+    assert result["count"] == 0
+    assert result["cancelled"]
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from storage.preview import RangeNotSatisfiable, multipart_byteranges, not_modified, parse_range
+
+
+def test_parse_range_single_and_open_ended():
+    assert parse_range("bytes=0-99", 1000) == [(0, 99)]
+    assert parse_range("bytes=900-", 1000) == [(900, 999)]
+    assert parse_range("bytes=-100", 1000) == [(900, 999)]
+
+
+def test_parse_range_clamps_and_merges():
+    assert parse_range("bytes=950-2000", 1000) == [(950, 999)]
+    assert parse_range("bytes=10-19, 0-9, 100-199, 150-250", 1000) == [(0, 19), (100, 250)]
+
+
+def test_parse_range_ignores_malformed_headers():
+    for header in (None, "", "items=0-1", "bytes=", "bytes=abc-", "bytes=5-1", "bytes=5"):
+        assert parse_range(header, 1000) is None
+
+
+def test_parse_range_ignores_too_many_ranges():
+    header = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(20))
+    assert parse_range(header, 1000) is None
+
+
+def test_parse_range_past_the_end_is_not_satisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1000-1100", 1000)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=-0", 1000)
+
+
+def test_multipart_byteranges_body_matches_length():
+    data = bytes(range(256)) * 4
+    ranges = [(0, 9), (500, 519)]
+    boundary, length, chunks = multipart_byteranges(ranges, len(data), "application/pdf",
+                                                   lambda start, end: iter([data[start:end + 1]]))
+    body = b"".join(chunks)
+    assert len(body) == length
+    assert body.count(f"--{boundary}".encode()) == 3
+    assert b"Content-Range: bytes 0-9/1024" in body
+    assert b"Content-Range: bytes 500-519/1024" in body
+    assert data[500:520] in body
+    assert body.endswith(f"--{boundary}--\r\n".encode())
+
+
+def test_not_modified_etag_wins_over_date():
+    modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert not_modified('"7"', None, '"7"', modified)
+    assert not_modified('W/"7", "8"', None, '"7"', modified)
+    assert not_modified("*", None, '"7"', modified)
+    # a mismatched etag means changed, whatever the date says
+    assert not not_modified('"6"', "Mon, 01 Jan 2024 00:00:00 GMT", '"7"', modified)
+
+
+def test_not_modified_by_date():
+    modified = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+    assert not_modified(None, "Mon, 01 Jan 2024 12:00:00 GMT", '"7"', modified)
+    assert not not_modified(None, "Mon, 01 Jan 2024 11:59:59 GMT", '"7"', modified)
+    assert not not_modified(None, "not a date", '"7"', modified)
+    assert not not_modified(None, None, '"7"', modified)
@@ -0,0 +1,94 @@
+import io
+
+import numpy as np
+import pytest
+
+from services.retrieval import HashingEmbedder, VectorIndex, chunk_text
+
+DOCS = {
+    "bio/photosynthesis.pdf": "plants use chlorophyll to turn light water and carbon dioxide into glucose and oxygen",
+    "bio/cells.pdf": "the mitochondria is the powerhouse of the cell and makes most of its energy as atp",
+    "history/rome.pdf": "the roman republic became an empire when augustus took power after the civil wars",
+}
+
+
+def _put(cloud, path, text):
+    folder = "/" + path.rsplit("/", 1)[0]
+    cloud.upload_file({"stream": io.BytesIO(text.encode()), "mimeType": "application/pdf",
+                       "full_path": "/" + path, "folder_path": folder}, "u")
+
+
+def _text_for(cloud):
+    """the test objects hold their text directly, so nothing is parsed"""
+    def text_for(path, cid):
+        fh, _, _ = cloud.open_stream(path)
+        return fh.read().decode()
+    return text_for
+
+
+@pytest.fixture
+def library(cloud):
+    for path, text in DOCS.items():
+        _put(cloud, path, text)
+    return cloud
+
+
+def test_chunks_overlap():
+    text = " ".join(f"w{i}" for i in range(10))
+    assert chunk_text(text, words=4, overlap=2) == ["w0 w1 w2 w3", "w2 w3 w4 w5", "w4 w5 w6 w7", "w6 w7 w8 w9"]
+    assert chunk_text("", words=4, overlap=2) == []
+
+
+def test_hashing_embeddings_are_deterministic_unit_vectors():
+    embedder = HashingEmbedder(dim=256)
+    a, b, empty = embedder.embed(["light and water", "light and water", ""])
+    assert np.allclose(a, b) and np.isclose(np.linalg.norm(a), 1.0)
+    assert not empty.any()
+
+
+def test_hashing_embedder_ranks_the_matching_document_first():
+    embedder = HashingEmbedder(dim=1024)
+    vectors = embedder.embed(list(DOCS.values()))
+    for query, expected in [("how do plants use light and chlorophyll", 0),
+                            ("what does the mitochondria make", 1),
+                            ("when did rome become an empire", 2)]:
+        scores = vectors @ embedder.embed([query])[0]
+        assert int(np.argmax(scores)) == expected
+
+
+def test_query_returns_the_best_passage(library, tmp_path):
+    index = VectorIndex("u/", embedder=HashingEmbedder(), base_dir=str(tmp_path))
+    assert index.refresh(library, text_for=_text_for(library))["embedded"] == 3
+    [best, *_] = index.query("where does a cell get its energy", top_k=2)
+    assert best["path"] == "u/bio/cells.pdf" and best["score"] > 0
+    assert index.query("zebra quasar", top_k=2) == []
+
+
+def test_refresh_only_re_embeds_changed_documents(library, tmp_path):
+    index = VectorIndex("u/", embedder=HashingEmbedder(), base_dir=str(tmp_path))
+    index.refresh(library, text_for=_text_for(library))
+    assert index.refresh(library, text_for=_text_for(library))["embedded"] == 0
+
+    _put(library, "history/rome.pdf", "the byzantine empire kept constantinople for a thousand years")
+    library.delete_file("u/bio/cells.pdf")
+    result = index.refresh(library, text_for=_text_for(library))
+    assert (result["embedded"], result["removed"], result["documents"]) == (1, 1, 2)
+    assert index.query("constantinople", top_k=1)[0]["path"] == "u/history/rome.pdf"
+    assert all(p["path"] != "u/bio/cells.pdf" for p in index.passages)
+    assert index.query("augustus civil wars", top_k=1) == []
+
+
+def test_indexes_are_per_prefix_and_survive_a_restart(library, tmp_path):
+    bio = VectorIndex("u/bio/", embedder=HashingEmbedder(), base_dir=str(tmp_path))
+    history = VectorIndex("u/history/", embedder=HashingEmbedder(), base_dir=str(tmp_path))
+    assert bio.refresh(library, text_for=_text_for(library))["documents"] == 2
+    assert history.refresh(library, text_for=_text_for(library))["documents"] == 1
+    assert bio.dir != history.dir
+
+    reloaded = VectorIndex("u/bio/", embedder=HashingEmbedder(), base_dir=str(tmp_path))
+    assert set(reloaded.docs) == {"u/bio/photosynthesis.pdf", "u/bio/cells.pdf"}
+    assert reloaded.refresh(library, text_for=_text_for(library))["embedded"] == 0
+    # vectors from a different embedder aren't comparable, so they are rebuilt
+    other = VectorIndex("u/bio/", embedder=HashingEmbedder(dim=64), base_dir=str(tmp_path))
+    assert other.docs == {}
+    assert other.refresh(library, text_for=_text_for(library))["embedded"] == 2
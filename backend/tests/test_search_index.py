@@ -0,0 +1,21 @@
+from services.search_index import fts_query
+
+
+def test_fts_query_quotes_terms():
+    assert fts_query("cell biology") == '"cell" "biology"'
+    assert fts_query("cell biology", any_term=True) == '"cell" OR "biology"'
+
+
+def test_fts_query_keeps_prefix_matches():
+    assert fts_query("mito*") == '"mito"*'
+
+
+def test_fts_query_neutralises_operators():
+    query = fts_query('NOT "drop" OR near(a)')
+    assert '"NOT"' in query and '"OR"' in query
+    assert "(" not in query
+
+
+def test_fts_query_empty():
+    assert fts_query("") is None
+    assert fts_query("  ?! ") is None
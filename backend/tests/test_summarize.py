@@ -0,0 +1,130 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from fake_pdf import pdf
+from services import get_context
+from services.context_budget import count_tokens
+from services.pdf_text import PdfTextExtractor
+from services.summary_cache import SummaryCache
+from storage.disk_cache import DiskCache
+
+
+# ---------- chunking ----------
+def _page(i, words=40):
+    return " ".join(f"p{i}w{j}" for j in range(words))
+
+
+def test_chunks_stay_within_the_token_limit():
+    pages = [_page(i) for i in range(30)]
+    chunks = get_context._chunk_pages(pages, max_tokens=200)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 200 for chunk in chunks)
+    # every page lands in exactly one chunk, in order
+    assert "\n".join(chunks).split("\n") == pages
+
+
+def test_oversized_pages_are_truncated_and_empty_ones_skipped():
+    chunks = get_context._chunk_pages(["", _page(0, words=2000), "", _page(1)], max_tokens=100)
+    assert chunks[0].startswith("p0w0") and count_tokens(chunks[0]) <= 100
+    assert chunks[-1].endswith(_page(1))
+
+
+def test_an_edited_page_only_changes_the_chunks_around_it():
+    pages = [_page(i, words=20 + (i * 37) % 60) for i in range(60)]
+    before = get_context._chunk_pages(pages, max_tokens=300)
+    pages[30] += " edited" * 15
+    after = get_context._chunk_pages(pages, max_tokens=300)
+    changed = [chunk for chunk in after if chunk not in before]
+    assert 1 <= len(changed) <= 3
+    assert any("edited" in chunk for chunk in changed)
+    # chunks of pages before the edit are untouched (and so are their cached summaries)
+    earlier = [chunk for chunk in before if int(chunk.rsplit(" ", 1)[1][1:].split("w")[0]) < 30]
+    assert earlier and after[:len(earlier)] == earlier
+
+
+# ---------- the map-reduce gate ----------
+class FakeOpenAI:
+    """records which api each document went through"""
+
+    def __init__(self):
+        self.uploads = []
+        self.chats = []
+        self.files = SimpleNamespace(create=self._upload, delete=lambda file_id: None)
+        self.responses = SimpleNamespace(create=lambda **kw: SimpleNamespace(output_text="whole summary"))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+
+    def _upload(self, file, purpose):
+        self.uploads.append(file[1].read())
+        return SimpleNamespace(id=f"file-{len(self.uploads)}")
+
+    def _chat(self, model, messages, temperature):
+        self.chats.append(messages[0]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="notes"))])
+
+
+@pytest.fixture
+def summarize(cloud, tmp_path, monkeypatch):
+    extractor = PdfTextExtractor(workers=1, cache_dir=str(tmp_path / "pdf_text"))
+    summaries = SummaryCache(str(tmp_path / "summaries"))
+    disk = DiskCache(str(tmp_path / "content"))
+    monkeypatch.setattr(get_context, "shared_extractor", lambda: extractor)
+    monkeypatch.setattr(get_context, "shared_summary_cache", lambda: summaries)
+    monkeypatch.setattr(get_context, "shared_disk_cache", lambda: disk)
+    monkeypatch.setattr(get_context, "MAP_REDUCE_PAGES", 4)
+    monkeypatch.setattr(get_context, "MAP_REDUCE_TOKENS", 30)
+    monkeypatch.setattr(get_context, "CHUNK_TOKENS", 20)
+    opened = []
+    open_document = get_context._open_document
+    monkeypatch.setattr(get_context, "_open_document",
+                        lambda cloud, path: opened.append(path) or open_document(cloud, path))
+    client = FakeOpenAI()
+
+    def run(name, texts):
+        with open(pdf(tmp_path / name, texts), "rb") as f:
+            data = f.read()
+        cloud.upload_file({"stream": io.BytesIO(data), "mimeType": "application/pdf",
+                           "full_path": f"/{name}", "folder_path": ""}, "u")
+        return get_context._summarize_path(client, cloud, f"u/{name}")
+
+    run.client, run.opened, run.cloud = client, opened, cloud
+    return run
+
+
+def test_short_documents_are_uploaded_whole(summarize):
+    assert summarize("short.pdf", ["one", "two"]) == "whole summary"
+    assert len(summarize.client.uploads) == 1 and summarize.client.chats == []
+    assert summarize.client.uploads[0].startswith(b"%PDF")
+
+
+def test_long_documents_with_little_text_are_uploaded_whole(summarize):
+    assert summarize("sparse.pdf", ["a", "b", "c", "d", "e"]) == "whole summary"
+    assert len(summarize.client.uploads) == 1 and summarize.client.chats == []
+
+
+def test_long_wordy_documents_are_map_reduced(summarize):
+    texts = [" ".join(f"page{i}word{j}" for j in range(12)) for i in range(6)]
+    assert summarize("long.pdf", texts) == "notes"
+    assert summarize.client.uploads == []
+    assert summarize.client.chats[-1] == get_context.REDUCE_PROMPT
+    assert get_context.CHUNK_PROMPT in summarize.client.chats
+
+
+def test_each_document_is_opened_once(summarize):
+    summarize("short.pdf", ["one", "two"])
+    texts = [" ".join(f"page{i}word{j}" for j in range(12)) for i in range(6)]
+    summarize("long.pdf", texts)
+    assert summarize.opened == ["u/short.pdf", "u/long.pdf"]
+
+
+def test_cached_summaries_open_nothing(summarize):
+    summarize("short.pdf", ["one", "two"])
+    del summarize.opened[:]
+    assert get_context._summarize_path(summarize.client, summarize.cloud, "u/short.pdf") == "whole summary"
+    assert summarize.opened == [] and len(summarize.client.uploads) == 1
+
+
+def test_summary_keys_depend_on_the_mode():
+    assert get_context._summary_key("md5:x", "whole") != get_context._summary_key("md5:x", "map-reduce")
+    assert get_context._summary_key(None, "whole") is None
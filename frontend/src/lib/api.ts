@@ -74,6 +74,43 @@ export async function buildContext(prefix = '') {
   return j as { ok: boolean; context: string }
 }
 
+export type ContextEvent =
+  | { type: 'start'; prefix: string }
+  | { type: 'document'; index: number; path: string; summary: string }
+  | { type: 'duplicate'; index: number; path: string; of: string }
+  | { type: 'error'; index?: number; path?: string; error: string }
+  | { type: 'progress'; done: number; failed: number; duplicates: number; total: number | null }
+  | { type: 'done'; documents: number; failed: number; duplicates: number; total: number; cancelled: boolean }
+
+// streams /context/build as ndjson; aborting the signal cancels the remaining work server-side
+export async function streamContext(
+  prefix: string,
+  onEvent: (e: ContextEvent) => void,
+  opts: { signal?: AbortSignal } = {},
+) {
+  const r = await fetch('/api/context/build', {
+    method: 'POST',
+    headers: { 'content-type': 'application/json' },
+    body: JSON.stringify({ prefix, stream: true }),
+    signal: opts.signal,
+  })
+  if (!r.ok || !r.body) throw new Error(`http ${r.status}`)
+  const reader = r.body.getReader()
+  const decoder = new TextDecoder()
+  let buf = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buf += decoder.decode(value, { stream: true })
+    let nl
+    while ((nl = buf.indexOf('\n')) >= 0) {
+      const line = buf.slice(0, nl).trim()
+      buf = buf.slice(nl + 1)
+      if (line) onEvent(JSON.parse(line) as ContextEvent)
+    }
+  }
+}
+
 export type Company = {
   id: string;
   name?: string;